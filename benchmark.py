@@ -14,34 +14,271 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import timeit
+# Benchmark suite which builds its own stores, so it needs no data
+# files. Results are written as JSON and can be compared against a
+# saved baseline to catch performance regressions, e.g.
+#
+#   ./benchmark.py --output baseline.json
+#   ...change things...
+#   ./benchmark.py --baseline baseline.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
 
 import board
 import strategy
+import successor_table
+
+# name -> (num_markers, num_spots, limit). A limit > 0 only computes
+# that many boards (see DistributionStore.compute), for configurations
+# too slow to compute fully in a benchmark.
+CONFIGS = {
+    "6x6": (6, 6, 0),
+    "10x6": (10, 6, 0),
+    "15x6_partial": (15, 6, 3000),
+}
+
+DEFAULT_CONFIGS = ["6x6", "10x6", "15x6_partial"]
+
+# Number of boards sampled for the per board benchmarks
+NUM_SAMPLE_BOARDS = 50
+
+# Number of (board, roll) pairs in a batch query
+BATCH_QUERY_SIZE = 10000
+
+# Default fraction by which a benchmark can be slower than the baseline
+# before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def _seconds_per_item(func, items, repeat):
+    """Returns the best over repeat runs of the mean time of func(item)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = (time.perf_counter() - start) / len(items)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _seconds(func, repeat):
+    """Returns the best over repeat runs of the time of func()."""
+    return _seconds_per_item(lambda _: func(), [None], repeat)
+
+
+def benchmark_config(num_markers, num_spots, limit=0, repeat=3, seed=0):
+    """Runs every benchmark on one configuration.
+
+    Full configurations are computed with the batched compute and a
+    prebuilt successor table, whose build is timed separately. Partial
+    ones use the serial compute, which generates moves as it goes.
+
+    Args:
+      num_markers: int
+      num_spots: int
+      limit: if > 0, only compute this many boards
+      repeat: number of runs, the fastest of which is reported
+      seed: seed for choosing the sample boards
+
+    Returns:
+      dict from benchmark name to seconds
+    """
+    results = {}
+    config = board.GameConfiguration(num_markers, num_spots)
+    store = strategy.DistributionStore(config)
+
+    if limit > 0:
+        # The serial compute is the only one which can stop early.
+        results["compute_seconds"] = _seconds(
+            lambda: store.compute(progress_interval=0, limit=limit), repeat)
+        computed_ids = config.valid_ids()[:limit].tolist()
+    else:
+        start = time.perf_counter()
+        table = successor_table.SuccessorTable.build(config)
+        results["successor_table_seconds"] = time.perf_counter() - start
+        results["compute_seconds"] = _seconds(
+            lambda: store.compute(progress_interval=0, successor_table=table,
+                                  batched=True),
+            repeat)
+        computed_ids = config.valid_ids().tolist()
+
+    rng = random.Random(seed)
+    sample_ids = [rng.choice(computed_ids[1:])
+                  for _ in range(NUM_SAMPLE_BOARDS)]
+    sample_boards = [board.Board.from_id(config, i) for i in sample_ids]
+    results["from_id_seconds"] = _seconds_per_item(
+        lambda board_id: board.Board.from_id(config, board_id),
+        sample_ids, repeat)
+    results["get_id_seconds"] = _seconds_per_item(
+        lambda b: b.get_id(), sample_boards, repeat)
+    results["generate_moves_seconds"] = _seconds_per_item(
+        lambda b: [list(b.generate_moves(roll)) for roll in board.ROLLS],
+        sample_boards, repeat)
+    results["evaluate_board_seconds"] = _seconds_per_item(
+        store.compute_move_distribution_for_id, sample_ids, repeat)
+    queries = [(b, rng.choice(board.ROLLS)) for b in sample_boards]
+    results["best_moves_query_seconds"] = _seconds_per_item(
+        lambda query: store.compute_best_moves_for_roll(*query),
+        queries, repeat)
+
+    if limit <= 0:
+        results["successor_lookup_seconds"] = _seconds_per_item(
+            lambda board_id: [table.successor_ids(board_id, roll_idx)
+                              for roll_idx in range(len(board.ROLLS))],
+            sample_ids, repeat)
+        batch_query = strategy.BatchQuery(store, table)
+        board_ids = np.array([rng.choice(computed_ids)
+                              for _ in range(BATCH_QUERY_SIZE)])
+        roll_idxs = np.array([rng.randrange(len(board.ROLLS))
+                              for _ in range(BATCH_QUERY_SIZE)])
+        results["batch_query_seconds"] = _seconds(
+            lambda: batch_query.best_next_ids(board_ids, roll_idxs), repeat)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, "store.hdf5")
+        results["save_seconds"] = _seconds(lambda: store.save_hdf5(fn),
+                                           repeat)
+        results["load_seconds"] = _seconds(
+            lambda: strategy.DistributionStore.load_hdf5(fn), repeat)
+        # Format version 1 too, so that regressions in either are tracked.
+        v1_fn = os.path.join(tmpdir, "store_v1.hdf5")
+        results["save_v1_seconds"] = _seconds(
+            lambda: store.save_hdf5(v1_fn, format_version=1), repeat)
+        results["load_v1_seconds"] = _seconds(
+            lambda: strategy.DistributionStore.load_hdf5(v1_fn), repeat)
+    return results
+
+
+def run(config_names, repeat=3):
+    """Runs the benchmarks for config_names (keys of CONFIGS).
+
+    Returns:
+      dict with "environment" and "results", a dict from config name to
+      the benchmark_config results
+    """
+    results = {}
+    for name in config_names:
+        num_markers, num_spots, limit = CONFIGS[name]
+        print("Benchmarking %s" % name, flush=True)
+        results[name] = benchmark_config(num_markers, num_spots, limit, repeat)
+    return {
+        "environment": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares the results of two runs.
+
+    Args:
+      current: dict returned by run
+      baseline: dict returned by run
+      tolerance: fraction by which current can be slower than baseline
+
+    Returns:
+      list of (config name, benchmark name, baseline seconds, current
+      seconds, is regression) for every benchmark in both
+    """
+    out = []
+    for config_name, results in current["results"].items():
+        baseline_results = baseline["results"].get(config_name, {})
+        for benchmark_name, seconds in results.items():
+            if benchmark_name not in baseline_results:
+                continue
+            baseline_seconds = baseline_results[benchmark_name]
+            out.append((config_name, benchmark_name, baseline_seconds,
+                        seconds,
+                        seconds > baseline_seconds * (1 + tolerance)))
+    return out
+
+
+def check_expectations(output):
+    """Checks relations between benchmarks that should always hold.
+
+    Looking up the next boards in a successor table has to be faster
+    than generating the moves, or using the table is pointless.
+
+    Args:
+      output: dict returned by run
+
+    Returns:
+      list of strings describing the failed checks
+    """
+    failures = []
+    for config_name, results in output["results"].items():
+        if "successor_lookup_seconds" not in results:
+            continue
+        if (results["successor_lookup_seconds"] >=
+                results["generate_moves_seconds"]):
+            failures.append(
+                "%s: successor table lookup (%.6fs) is not faster than "
+                "move generation (%.6fs)" % (
+                    config_name, results["successor_lookup_seconds"],
+                    results["generate_moves_seconds"]))
+    return failures
+
+
+def _print_results(output):
+    for config_name, results in output["results"].items():
+        for benchmark_name, seconds in results.items():
+            print("%-14s %-26s %12.6fs" % (config_name, benchmark_name,
+                                           seconds))
+
+
+def _print_comparison(comparison):
+    for (config_name, benchmark_name, baseline_seconds, seconds,
+         is_regression) in comparison:
+        print("%-14s %-26s %12.6fs %12.6fs %7.2fx%s" % (
+            config_name, benchmark_name, baseline_seconds, seconds,
+            seconds / baseline_seconds if baseline_seconds else np.inf,
+            "  REGRESSION" if is_regression else ""))
 
-def setup():
-    global store
-    store = strategy.DistributionStore.load_hdf5('data/bgend_store_15_6.hdf5')
-
-BOARD_LIST = [1046905,
-              1376236,
-              1567095,
-              1769255,
-              1897213,
-              1963925,
-              2026203,
-              2076269,
-              487420,
-              860127]
-
-def test_compute_move_distribution():
-    for board_id in BOARD_LIST:
-        this_board = board.Board.from_id(store.config, board_id)
-        dist = store.compute_move_distribution_for_board(this_board)
 
 if __name__ == '__main__':
-    num_iterations = 5
-    time_taken = timeit.timeit("test_compute_move_distribution()",
-                               setup="from __main__ import setup, test_compute_move_distribution; setup()",
-                               number=num_iterations)
-    print("test_compute_move_distribution: {:.6f}".format(time_taken / len(BOARD_LIST) / num_iterations))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS,
+                        choices=sorted(CONFIGS),
+                        help="Configurations to benchmark")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per benchmark, the fastest is reported")
+    parser.add_argument("--output",
+                        help="File to write the results to as JSON")
+    parser.add_argument("--baseline",
+                        help="JSON results of an earlier run to compare to")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Fraction slower than the baseline allowed")
+    args = parser.parse_args()
+
+    output = run(args.configs, args.repeat)
+    _print_results(output)
+    failures = check_expectations(output)
+    for failure in failures:
+        print("FAILED %s" % failure)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare(output, baseline, args.tolerance)
+        print()
+        _print_comparison(comparison)
+        if any(is_regression for *_, is_regression in comparison):
+            sys.exit(1)
+    if failures:
+        sys.exit(1)
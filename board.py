@@ -15,13 +15,24 @@
 import array
 import ast
 import collections
-import copy
 import itertools
+import operator
 import gmpy2
 import numpy as np
 import scipy.special
 
 
+# Configurations with at most this many possible ids (valid or not)
+# use a flat lookup array for GameConfiguration.rank. At the int32 we
+# store, this is at most 16MB. 15 markers on 6 spots needs 2**21 ids.
+RANK_LOOKUP_MAX_IDS = 1 << 22
+
+
+# Default size of GameConfiguration.board_cache. This is big enough for
+# every board of 15 markers on 6 spots.
+DEFAULT_BOARD_CACHE_SIZE = 1 << 16
+
+
 class GameConfiguration(object):
     """Keeps the overall config of the game and useful computed values.
 
@@ -31,6 +42,13 @@ class GameConfiguration(object):
     * num_valid_boards: Total number of valid positions
     * min_board_id: minimum (inclusive) valid board id
     * max_board_id: maximum (exclusive) value board id
+    * board_cache: BoardCache used by Board.from_id or None. See
+      enable_board_cache.
+
+    Valid board ids are sparse in [min_board_id, max_board_id). rank
+    and unrank map them to and from a dense index in
+    [0, num_valid_boards) which preserves the order of the ids, so
+    arrays indexed by rank can be used in place of dicts keyed by id.
     """
 
     def __init__(self, num_markers, num_spots):
@@ -46,11 +64,92 @@ class GameConfiguration(object):
             self.min_board_id |= 1 << i
             self.max_board_id |= 1 << (self.num_markers + self.num_spots - 1 - i)
 
+        # _binomial[p][k] is C(p, k) for 0 <= p <= num_bits and
+        # 0 <= k <= num_markers + 1. The extra k column lets the
+        # vectorized rank index with a too large popcount before we
+        # reject the invalid id.
+        num_bits = self.num_markers + self.num_spots
+        self._binomial = [[scipy.special.comb(p, k, exact=True)
+                           for k in range(self.num_markers + 2)]
+                          for p in range(num_bits + 1)]
+        self._binomial_array = np.array(self._binomial, dtype=np.int64)
+        self._rank_lookup = None
+        self._valid_ids = None
+        self.board_cache = None
+
+    def enable_board_cache(self, max_size=DEFAULT_BOARD_CACHE_SIZE):
+        """Makes Board.from_id return shared Boards from a BoardCache.
+
+        Boards from the cache are shared by all callers, so their
+        spot_counts are read only.
+
+        Returns:
+          BoardCache
+        """
+        self.board_cache = BoardCache(max_size)
+        return self.board_cache
+
+    def disable_board_cache(self):
+        self.board_cache = None
+
     def is_valid_id(self, idx):
+        # gmpy2 does not take numpy ints
+        idx = operator.index(idx)
         return (idx >= self.min_board_id and
                 idx < self.max_board_id and
                 gmpy2.popcount(idx) == self.num_markers)
 
+    def is_valid_id_array(self, board_ids):
+        """Vectorized version of is_valid_id.
+
+        Returns:
+          np array of bool with the same shape as board_ids
+        """
+        board_ids = np.asarray(board_ids, dtype=np.int64)
+        num_ones = np.zeros(board_ids.shape, dtype=np.int64)
+        for pos in range(self.num_markers + self.num_spots):
+            num_ones += (board_ids >> pos) & 1
+        return ((board_ids >= self.min_board_id) &
+                (board_ids < self.max_board_id) &
+                (num_ones == self.num_markers))
+
+    def contains_config(self, other):
+        """Returns whether every board of other is embedded in this config.
+
+        That is the case when other has no more markers and no more
+        spots. See embed_ids.
+        """
+        return (other.num_markers <= self.num_markers and
+                other.num_spots <= self.num_spots)
+
+    def embed_ids(self, smaller_config, board_ids):
+        """Maps board ids of smaller_config to the same boards in self.
+
+        The extra markers are put off the board and the extra spots are
+        empty. Markers that are off never move again and empty spots
+        above the markers never get any, so the embedded boards play
+        exactly like the smaller ones.
+
+        With the markers off in the low bits of the id, the extra
+        markers are k more 1s at the bottom. The extra spots are 0s at
+        the top, which do not change the value.
+
+        Args:
+          smaller_config: GameConfiguration, see contains_config
+          board_ids: array like of valid ids of smaller_config
+
+        Returns:
+          np array of int64 ids with the same shape as board_ids
+        """
+        if not self.contains_config(smaller_config):
+            raise ValueError(
+                "%dx%d boards are not embedded in %dx%d" %
+                (smaller_config.num_markers, smaller_config.num_spots,
+                 self.num_markers, self.num_spots))
+        extra_markers = self.num_markers - smaller_config.num_markers
+        board_ids = np.asarray(board_ids, dtype=np.int64)
+        return (board_ids << extra_markers) | ((1 << extra_markers) - 1)
+
     def next_valid_id(self, board_id):
         """Generates the next valid board idx after idx.
 
@@ -87,12 +186,273 @@ class GameConfiguration(object):
 
         return upper | lower
 
+    def apply_move_id(self, board_id, spot, die):
+        """Applies a move directly to a board id.
+
+        Same as Board.from_id(self, board_id).apply_move(
+        Move(spot, die)).get_id(), including the errors, but without
+        creating any Board.
+
+        Args:
+          board_id: valid board id
+          spot: spot to move a marker from
+          die: number of spots to move
+
+        Returns:
+          int board id
+        """
+        if spot < 1 or spot > self.num_spots:
+            raise ValueError("Invalid spot on %s on %d" %
+                             (Move(spot, die), board_id))
+        dividers = self._divider_positions(board_id)
+        if dividers[spot + 1] - dividers[spot] < 2:
+            raise ValueError("No marker for %s on %d" %
+                             (Move(spot, die), board_id))
+        if die > spot and board_id >> dividers[spot + 1]:
+            raise ValueError(
+                "Overflow count %s invalid when higher spots "
+                "still have markers on %d" % (Move(spot, die), board_id))
+        return self._move_marker_id(board_id, dividers, spot, die)
+
+    def generate_successor_ids(self, board_id, roll):
+        """Generates each distinct board id reachable with roll.
+
+        This is Board.generate_successors done with bit manipulations
+        on the id, so no Board is created. The ids and moves come out
+        in the same order.
+
+        Args:
+          board_id: valid board id
+          roll: Roll to generate moves for
+
+        Yields:
+          (list of Move, int) the moves and the board id they produce
+        """
+        if roll.dice[0] == roll.dice[1]:
+            yield from self._generate_successor_ids_recursive(
+                board_id, roll.dice, 0, self.num_spots, True, [])
+            return
+        seen = set()
+        for dice in (roll.dice, roll.dice[::-1]):
+            for moves, next_id in self._generate_successor_ids_recursive(
+                    board_id, dice, 0, self.num_spots, False, []):
+                if next_id in seen:
+                    continue
+                seen.add(next_id)
+                yield moves, next_id
+
+    def _generate_successor_ids_recursive(self, board_id, dice, dice_idx,
+                                          max_spot, non_increasing, moves):
+        # See Board._generate_successors_recursive
+        if dice_idx >= len(dice) or board_id == self.min_board_id:
+            yield moves, board_id
+            return
+        die = dice[dice_idx]
+        dividers = self._divider_positions(board_id)
+        # Any 1 above the divider of max_spot is a marker on a higher spot.
+        found_markers = (board_id >> dividers[max_spot + 1]) != 0
+        for spot in range(max_spot, 0, -1):
+            if found_markers and spot < die:
+                break
+            if dividers[spot + 1] - dividers[spot] > 1:
+                found_markers = True
+                yield from self._generate_successor_ids_recursive(
+                    self._move_marker_id(board_id, dividers, spot, die),
+                    dice, dice_idx + 1,
+                    spot if non_increasing else self.num_spots,
+                    non_increasing, moves + [Move(spot=spot, count=die)])
+
+    def _divider_positions(self, board_id):
+        """Returns the bit positions of the 0s in board_id.
+
+        Element i for 1 <= i <= num_spots is the position of the 0 just
+        below the markers for spot i. Element 0 is -1 and element
+        num_spots + 1 is the number of bits, so the markers for every
+        spot i are the bits strictly between elements i and i + 1.
+        """
+        out = [-1]
+        pos = -1
+        for _ in range(self.num_spots):
+            pos = gmpy2.bit_scan0(board_id, pos + 1)
+            out.append(pos)
+        out.append(self.num_markers + self.num_spots)
+        return out
+
+    def _move_marker_id(self, board_id, dividers, spot, die):
+        """Moves one marker from spot to spot - die (or off) without checks.
+
+        The lowest 1 of spot is removed, the bits from the start of the
+        destination spot up to there shift up by one, and a 1 is put at
+        the start of the destination spot.
+        """
+        low = dividers[max(spot - die, 0)] + 1
+        high = dividers[spot] + 1
+        between_mask = ((1 << (high - low)) - 1) << low
+        return ((board_id & ~(between_mask | (1 << high))) |
+                ((board_id & between_mask) << 1) |
+                (1 << low))
+
+    def valid_ids(self):
+        """Returns all valid board ids in increasing order.
+
+        The array is computed on first use and shared, so it is read
+        only. Element i is the id with rank i.
+
+        Returns:
+          np array of int64 of size num_valid_boards
+        """
+        if self._valid_ids is None:
+            num_bits = self.num_markers + self.num_spots
+            # combos[k] is all sorted ids with k 1s in the bits below
+            # pos. Those without a 1 at pos sort before those with one,
+            # so appending keeps them sorted. We only keep the k that
+            # can still end up with num_markers 1s and at most
+            # num_spots 0s.
+            combos = {0: np.zeros(1, dtype=np.int64)}
+            for pos in range(num_bits):
+                next_combos = {}
+                min_ones = max(0, self.num_markers - (num_bits - pos - 1))
+                max_ones = min(self.num_markers, pos + 1)
+                for num_ones in range(min_ones, max_ones + 1):
+                    if pos + 1 - num_ones > self.num_spots:
+                        continue
+                    parts = []
+                    if num_ones in combos:
+                        parts.append(combos[num_ones])
+                    if num_ones - 1 in combos:
+                        parts.append(combos[num_ones - 1] | (1 << pos))
+                    next_combos[num_ones] = np.concatenate(parts)
+                combos = next_combos
+            self._valid_ids = combos[self.num_markers]
+            self._valid_ids.flags.writeable = False
+        return self._valid_ids
+
     def generate_valid_ids(self):
-        board_id = self.min_board_id
-        while board_id < self.max_board_id:
-            if self.is_valid_id(board_id):
-                yield board_id
-            board_id += 1
+        for board_id in self.valid_ids().tolist():
+            yield board_id
+
+    def rank(self, board_id):
+        """Returns the dense index of a valid board id.
+
+        The ranks are in the same order as the ids, so the min_board_id
+        has rank 0 and the last valid id has rank num_valid_boards - 1.
+
+        This is the combinatorial number system: if the 1 bits of the
+        id are at positions c_1 < c_2 < ... < c_N, the rank is
+        sum(C(c_i, i)).
+
+        board_id can be any int type, including numpy ints.
+        """
+        board_id = operator.index(board_id)
+        lookup = self._get_rank_lookup()
+        if lookup is not None:
+            if board_id < self.min_board_id or board_id >= self.max_board_id:
+                raise ValueError("%d is not a valid board id" % board_id)
+            out = int(lookup[board_id])
+            if out < 0:
+                raise ValueError("%d is not a valid board id" % board_id)
+            return out
+
+        if not self.is_valid_id(board_id):
+            raise ValueError("%d is not a valid board id" % board_id)
+        out = 0
+        num_ones = 0
+        for pos in range(self.num_markers + self.num_spots):
+            if board_id & (1 << pos):
+                num_ones += 1
+                out += self._binomial[pos][num_ones]
+        return out
+
+    def unrank(self, rank):
+        """Returns the valid board id with the given dense index.
+
+        Inverse of rank.
+        """
+        if rank < 0 or rank >= self.num_valid_boards:
+            raise ValueError("%d is not a valid board rank" % rank)
+        out = 0
+        num_ones = self.num_markers
+        for pos in range(self.num_markers + self.num_spots - 1, -1, -1):
+            count = self._binomial[pos][num_ones]
+            if rank >= count:
+                out |= 1 << pos
+                rank -= count
+                num_ones -= 1
+        return out
+
+    def rank_array(self, board_ids):
+        """Vectorized version of rank.
+
+        Args:
+          board_ids: array like of valid board ids
+
+        Returns:
+          np array of int64 ranks with the same shape as board_ids
+        """
+        board_ids = np.asarray(board_ids, dtype=np.int64)
+        lookup = self._get_rank_lookup()
+        if lookup is not None:
+            in_range = ((board_ids >= self.min_board_id) &
+                        (board_ids < self.max_board_id))
+            out = np.full(board_ids.shape, -1, dtype=np.int64)
+            out[in_range] = lookup[board_ids[in_range]]
+            invalid = out < 0
+        else:
+            out = np.zeros(board_ids.shape, dtype=np.int64)
+            num_ones = np.zeros(board_ids.shape, dtype=np.int64)
+            for pos in range(self.num_markers + self.num_spots):
+                bit = (board_ids >> pos) & 1
+                num_ones = np.minimum(num_ones + bit, self.num_markers + 1)
+                out += bit * self._binomial_array[pos, num_ones]
+            invalid = ((num_ones != self.num_markers) |
+                       (board_ids < self.min_board_id) |
+                       (board_ids >= self.max_board_id))
+        if np.any(invalid):
+            raise ValueError("%d is not a valid board id" %
+                             board_ids[invalid].flat[0])
+        return out
+
+    def unrank_array(self, ranks):
+        """Vectorized version of unrank.
+
+        Args:
+          ranks: array like of ints in [0, num_valid_boards)
+
+        This indexes valid_ids() if it has already been computed.
+
+        Returns:
+          np array of int64 board ids with the same shape as ranks
+        """
+        remaining = np.array(ranks, dtype=np.int64)
+        invalid = (remaining < 0) | (remaining >= self.num_valid_boards)
+        if np.any(invalid):
+            raise ValueError("%d is not a valid board rank" %
+                             remaining[invalid].flat[0])
+        if self._valid_ids is not None:
+            return self._valid_ids[remaining]
+        out = np.zeros(remaining.shape, dtype=np.int64)
+        num_ones = np.full(remaining.shape, self.num_markers, dtype=np.int64)
+        for pos in range(self.num_markers + self.num_spots - 1, -1, -1):
+            count = self._binomial_array[pos, num_ones]
+            take = (num_ones > 0) & (remaining >= count)
+            out |= take.astype(np.int64) << pos
+            remaining -= np.where(take, count, 0)
+            num_ones -= take
+        return out
+
+    def _get_rank_lookup(self):
+        """Returns a flat id -> rank array or None if that would be too big.
+
+        Entries for invalid ids are -1. The array is built on first use.
+        """
+        if self.max_board_id > RANK_LOOKUP_MAX_IDS:
+            return None
+        if self._rank_lookup is None:
+            lookup = np.full(self.max_board_id, -1, dtype=np.int32)
+            lookup[self.valid_ids()] = (
+                np.arange(self.num_valid_boards, dtype=np.int32))
+            self._rank_lookup = lookup
+        return self._rank_lookup
 
     def save_into_hdf5(self, hdf5_group):
         hdf5_group.create_dataset("num_markers", data=[self.num_markers])
@@ -157,6 +517,11 @@ class Board(object):
     __slots__=["config", "spot_counts"]
 
     def from_id(config, idx):
+        if config.board_cache is not None:
+            return config.board_cache.get(config, idx)
+        return Board._decode_id(config, idx)
+
+    def _decode_id(config, idx):
         if not config.is_valid_id(idx):
             raise ValueError("%d is not a valid board id" % idx)
 
@@ -217,11 +582,12 @@ class Board(object):
         return self.spot_counts[0] == self.config.num_markers
 
     def total_pips(self):
-        return np.sum(np.array(range(self.config.num_spots + 1)) * self.spot_counts)
+        return sum(spot * count for spot, count in enumerate(self.spot_counts))
 
     def next_valid_board(self):
         """Return a new board which has the next valid id."""
-        out = copy.deepcopy(self)
+        out = Board(self.config, array.array('i', self.spot_counts),
+                    sanity_check=False)
         # Find the first non empty spot. From that spot, move one
         # to the next higher spot and the rest to spot 0.  Note
         # that the range is *not* looking at the last spot. If
@@ -245,7 +611,8 @@ class Board(object):
         if move.spot < 1 or move.spot > self.config.num_spots:
             raise ValueError("Invalid spot on %s on %s" % (
                 move, self))
-        new_board = Board(self.config, copy.copy(self.spot_counts), sanity_check=False)
+        new_board = Board(self.config, array.array('i', self.spot_counts),
+                          sanity_check=False)
         new_board.spot_counts[move.spot] -= 1
         if move.count > move.spot:
             for i in range(move.spot + 1, self.config.num_spots + 1):
@@ -285,6 +652,64 @@ class Board(object):
                     roll, len(roll.dice) - 1, -1, []):
                 yield move_list
 
+    def generate_successors(self, roll):
+        """Generates each distinct board reachable with roll.
+
+        Unlike generate_moves, each resulting Board is generated
+        exactly once, together with one list of moves that reaches it.
+
+        For doubles, the moves are generated in canonical order: the
+        spots moved from are non-increasing. Every reachable board has
+        exactly one such move list, so no duplicates are generated in
+        the first place. For non-doubles both dice orders are needed
+        and different checkers can end in the same place, so duplicates
+        are dropped by comparing spot_counts before the caller does any
+        work on them.
+
+        The boards come out in the same order as they first appear in
+        generate_moves.
+
+        Args:
+          roll: Roll to generate moves for
+
+        Yields:
+          (list of Move, Board) the moves and the board they produce
+        """
+        if roll.dice[0] == roll.dice[1]:
+            yield from self._generate_successors_recursive(
+                roll.dice, 0, self.config.num_spots, True, [])
+            return
+        seen = set()
+        for dice in (roll.dice, roll.dice[::-1]):
+            for moves, next_board in self._generate_successors_recursive(
+                    dice, 0, self.config.num_spots, False, []):
+                key = next_board.spot_counts.tobytes()
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield moves, next_board
+
+    def _generate_successors_recursive(self, dice, dice_idx, max_spot,
+                                       non_increasing, moves):
+        if dice_idx >= len(dice) or self.is_finished():
+            yield moves, self
+            return
+        die = dice[dice_idx]
+        # Markers above max_spot still block bearing off with a
+        # larger die from lower spots.
+        found_markers = any(self.spot_counts[max_spot + 1:])
+        for spot_idx in range(max_spot, 0, -1):
+            if found_markers and spot_idx < die:
+                break
+            if self.spot_counts[spot_idx] > 0:
+                found_markers = True
+                move = Move(spot=spot_idx, count=die)
+                new_board = self.apply_move(move)
+                yield from new_board._generate_successors_recursive(
+                    dice, dice_idx + 1,
+                    spot_idx if non_increasing else self.config.num_spots,
+                    non_increasing, moves + [move])
+
     def _generate_moves_recursive(self, roll, roll_idx, roll_idx_step, moves):
         # If you are thinking I shoudl be pythonic and ask for
         # forgiveness not permission, you shoudl remember that -1 is a
@@ -337,6 +762,141 @@ class Board(object):
         return '\n'.join(out) + '\n'
 
 
+class BoardCache(object):
+    """Bounded cache of decoded Boards, evicting the least recently used.
+
+    The Boards are shared between everyone who asks for the same id,
+    so their spot_counts are a read only memoryview. All Board methods
+    return new Boards rather than modifying the current one, so this
+    only matters for code which changes spot_counts directly.
+
+    Attributes:
+      max_size: maximum number of Boards kept
+      hits: number of get calls which found the Board in the cache
+      misses: number of get calls which had to decode the id
+    """
+
+    def __init__(self, max_size):
+        if max_size < 1:
+            raise ValueError("max_size must be positive, got %d" % max_size)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._boards = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._boards)
+
+    def get(self, config, board_id):
+        """Returns the Board for board_id, decoding it if needed."""
+        b = self._boards.get(board_id)
+        if b is not None:
+            self.hits += 1
+            self._boards.move_to_end(board_id)
+            return b
+        self.misses += 1
+        b = Board._decode_id(config, board_id)
+        b.spot_counts = memoryview(b.spot_counts).toreadonly()
+        self._boards[board_id] = b
+        if len(self._boards) > self.max_size:
+            self._boards.popitem(last=False)
+        return b
+
+    def clear(self):
+        """Removes all Boards, but keeps the hit and miss counts."""
+        self._boards.clear()
+
+
+class BoardBatch(object):
+    """Many boards of the same GameConfiguration in one array.
+
+    This is for bulk work over many boards where a Python loop over
+    Board objects would dominate. Each row of spot_counts is the
+    spot_counts of one Board.
+
+    Attributes:
+      config: GameConfiguration
+      spot_counts: 2D np array of uint8, shape [num_boards, num_spots + 1]
+    """
+    __slots__=["config", "spot_counts"]
+
+    def from_ids(config, board_ids):
+        board_ids = np.asarray(board_ids, dtype=np.int64).reshape(-1)
+        invalid = ~config.is_valid_id_array(board_ids)
+        if np.any(invalid):
+            raise ValueError("%d is not a valid board id" %
+                             board_ids[invalid][0])
+
+        # Same walk over the bits as Board.from_id, but for every board
+        # at once.
+        spot_counts = np.zeros([board_ids.shape[0], config.num_spots + 1],
+                               dtype=np.uint8)
+        rows = np.arange(board_ids.shape[0])
+        current_spot = np.zeros(board_ids.shape[0], dtype=np.intp)
+        for i in range(config.num_markers + config.num_spots):
+            bit = (board_ids >> i) & 1
+            spot_counts[rows, current_spot] += bit.astype(np.uint8)
+            current_spot += 1 - bit
+
+        return BoardBatch(config, spot_counts, sanity_check=False)
+
+    def from_boards(config, boards):
+        spot_counts = np.array([list(b.spot_counts) for b in boards],
+                               dtype=np.uint8)
+        return BoardBatch(
+            config, spot_counts.reshape([-1, config.num_spots + 1]))
+
+    def __init__(self, config, spot_counts, sanity_check=True):
+        self.config = config
+        self.spot_counts = np.asarray(spot_counts, dtype=np.uint8)
+        if not sanity_check:
+            return
+        if (len(self.spot_counts.shape) != 2 or
+            self.spot_counts.shape[1] != self.config.num_spots + 1):
+            raise ValueError("Bad shape %s, expected [n, %d]" %
+                             (self.spot_counts.shape,
+                              self.config.num_spots + 1))
+        invalid = ~self.is_valid()
+        if np.any(invalid):
+            raise ValueError("Total markers in %s not expected number %d" %
+                             (self.spot_counts[invalid][0],
+                              self.config.num_markers))
+
+    def __len__(self):
+        return self.spot_counts.shape[0]
+
+    def __getitem__(self, idx):
+        return Board(self.config,
+                     array.array('i', self.spot_counts[idx].tolist()),
+                     sanity_check=False)
+
+    def __str__(self):
+        return "BoardBatch(%d boards)" % len(self)
+
+    def is_valid(self):
+        """Returns np array of bool, whether each row has all the markers."""
+        return (np.sum(self.spot_counts, axis=1, dtype=np.int64) ==
+                self.config.num_markers)
+
+    def get_ids(self):
+        """Returns np array of int64 board ids."""
+        counts = self.spot_counts.astype(np.int64)
+        # The markers for spot i start after all markers on lower spots
+        # and one divider per lower spot.
+        start_bits = (np.cumsum(counts, axis=1) - counts +
+                      np.arange(self.config.num_spots + 1))
+        return np.sum(((1 << counts) - 1) << start_bits, axis=1)
+
+    def is_finished(self):
+        """Returns np array of bool."""
+        return self.spot_counts[:, 0] == self.config.num_markers
+
+    def total_pips(self):
+        """Returns np array of int64."""
+        return self.spot_counts.astype(np.int64) @ np.arange(
+            self.config.num_spots + 1)
+
+
 def encode_moves_string(moves):
     out = []
     for m in moves:
@@ -17,17 +17,54 @@
 import argparse
 
 import board
+import policy_table
 import strategy
+import successor_table
 
 parser = argparse.ArgumentParser()
 parser.add_argument("num_markers")
 parser.add_argument("num_spots")
+parser.add_argument("--jobs", type=int, default=1,
+                    help="Number of processes to compute with")
+parser.add_argument("--objectives", nargs="*", default=[],
+                    choices=strategy.OBJECTIVES,
+                    help="Extra objectives to compute in the same pass. "
+                    "Not supported with --jobs")
+parser.add_argument("--policy", action="store_true",
+                    help="Also build the policy table")
+parser.add_argument("--checkpoint",
+                    help="File to save progress to and resume from. Works "
+                    "with and without --jobs, but not with --objectives")
+parser.add_argument("--checkpoint_interval", type=float, default=600,
+                    help="Seconds between checkpoints")
 args = parser.parse_args()
+# Checked before the long build rather than failing or ignoring them
+# part way through.
+if args.objectives and args.jobs > 1:
+    parser.error("--objectives is not supported with --jobs")
+if args.objectives and args.checkpoint:
+    parser.error("--objectives is not supported with --checkpoint")
 num_markers = int(args.num_markers)
 num_spots = int(args.num_spots)
 
 config = board.GameConfiguration(num_markers, num_spots)
 store = strategy.DistributionStore(config)
-store.compute()
+checkpointer = None
+if args.checkpoint:
+    checkpointer = strategy.Checkpointer(
+        args.checkpoint, interval_seconds=args.checkpoint_interval)
+if args.jobs > 1:
+    store.compute(jobs=args.jobs, checkpointer=checkpointer)
+else:
+    # The table is saved once built, so it is not rebuilt on a resume.
+    table = successor_table.load_or_build(
+        config, "data/bgend_successors_%d_%d.hdf5" % (num_markers, num_spots),
+        progress_interval=500)
+    store.compute(successor_table=table, batched=True,
+                  objectives=args.objectives, checkpointer=checkpointer)
 fn = "data/bgend_store_%d_%d.hdf5" % (num_markers, num_spots)
 store.save_hdf5(fn)
+if args.policy:
+    policy = policy_table.PolicyTable.build(config, store,
+                                            progress_interval=500)
+    policy.save("data/bgend_policy_%d_%d.bin" % (num_markers, num_spots))
@@ -0,0 +1,113 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module contains a table of simple per board features, so that
+# analyses can sort and filter boards with array operations.
+
+import numpy as np
+
+import board
+
+
+# Average number of pips moved per roll, counting doubles as four moves.
+AVERAGE_PIPS_PER_ROLL = 49 / 6
+
+
+class FeatureTable(object):
+    """Columns of features for every board of a GameConfiguration.
+
+    Element i of every column is for the board with rank i (see
+    board.GameConfiguration.rank).
+
+    Attributes:
+      config: board.GameConfiguration
+      total_pips: np array of int32
+      checkers_off: np array of int32, markers on spot 0
+      highest_spot: np array of int32, highest spot with a marker, 0
+        for the finished board
+      is_finished: np array of bool
+      expected_value: np array of float64, expected number of rolls to
+        finish, NaN if unknown
+      wastage: np array of float64, expected_value converted to pips
+        minus total_pips, NaN if unknown
+    """
+
+    COLUMNS = ["total_pips", "checkers_off", "highest_spot", "is_finished",
+               "expected_value", "wastage"]
+
+    def __init__(self, config, **columns):
+        self.config = config
+        for name in FeatureTable.COLUMNS:
+            column = np.asarray(columns[name])
+            if column.shape != (config.num_valid_boards,):
+                raise ValueError("Bad shape %s for %s, expected (%d,)" %
+                                 (column.shape, name,
+                                  config.num_valid_boards))
+            setattr(self, name, column)
+
+    def build(config, store=None):
+        """Computes the features for every board.
+
+        Args:
+          config: board.GameConfiguration
+          store: if given, a strategy.DistributionStore to take the
+            expected values from
+
+        Returns:
+          FeatureTable
+        """
+        batch = board.BoardBatch.from_ids(config, config.valid_ids())
+        occupied = batch.spot_counts[:, 1:] > 0
+        # argmax finds the first occupied spot counting down from the top
+        highest_spot = np.where(
+            np.any(occupied, axis=1),
+            config.num_spots - np.argmax(occupied[:, ::-1], axis=1),
+            0)
+        total_pips = batch.total_pips().astype(np.int32)
+
+        if store is None:
+            expected_value = np.full(config.num_valid_boards, np.nan)
+        else:
+            expected_value = store.expected_values()
+
+        return FeatureTable(
+            config,
+            total_pips=total_pips,
+            checkers_off=batch.spot_counts[:, 0].astype(np.int32),
+            highest_spot=highest_spot.astype(np.int32),
+            is_finished=batch.is_finished(),
+            expected_value=expected_value,
+            wastage=expected_value * AVERAGE_PIPS_PER_ROLL - total_pips)
+
+    def board_ids(self, mask=None):
+        """Returns the board ids, optionally only where mask is True.
+
+        Args:
+          mask: np array of bool aligned with the columns or None
+
+        Returns:
+          np array of int64
+        """
+        if mask is None:
+            return self.config.valid_ids()
+        return self.config.valid_ids()[mask]
+
+    def save_into_hdf5(self, hdf5_group):
+        for name in FeatureTable.COLUMNS:
+            hdf5_group.create_dataset(name, data=getattr(self, name))
+
+    def load_from_hdf5(config, hdf5_group):
+        return FeatureTable(
+            config,
+            **{name: hdf5_group[name][:] for name in FeatureTable.COLUMNS})
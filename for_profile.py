@@ -14,28 +14,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import random
 
 import board
+import profiling
 import strategy
 
-SAMPLING_FRACTION = .005
-
-store = strategy.DistributionStore.load_hdf5('data/bgend_store_15_6.hdf5')
-
-print("Read store")
-
-count = 0
-for board_id in store.distribution_map.keys():
-    if random.random() > SAMPLING_FRACTION:
-        continue
-
-    this_board = board.Board.from_id(store.config, board_id)
-    dist = store.compute_move_distribution_for_board(this_board)
-
-    count += 1
-    if count % 25  == 0:
-        print("Boards processed: {} at id {}".format(count, board_id))
-
-
-print("Total boards processed: {}".format(count))
+parser = argparse.ArgumentParser(
+    description="Profiles compute and best move queries on a configuration")
+parser.add_argument("num_markers", type=int)
+parser.add_argument("num_spots", type=int)
+parser.add_argument("--num_queries", type=int, default=1000,
+                    help="Number of random best move queries to profile")
+args = parser.parse_args()
+
+config = board.GameConfiguration(args.num_markers, args.num_spots)
+store = strategy.DistributionStore(config)
+
+compute_profiler = profiling.Profiler()
+store.compute(progress_interval=0, profiler=compute_profiler)
+print("compute:")
+print(compute_profiler.report())
+
+query_profiler = profiling.Profiler()
+valid_ids = config.valid_ids().tolist()
+for _ in range(args.num_queries):
+    this_board = board.Board.from_id(config, random.choice(valid_ids))
+    store.compute_best_moves_for_roll(this_board, random.choice(board.ROLLS),
+                                      profiler=query_profiler)
+print()
+print("compute_best_moves_for_roll:")
+print(query_profiler.report())
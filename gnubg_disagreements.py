@@ -19,7 +19,9 @@ import pandas as pd
 import random
 
 import board
+import metrics
 import strategy
+import successor_table
 
 
 SAMPLE_EVERY = 0
@@ -29,15 +31,18 @@ def find_disagreement():
     our_store = strategy.DistributionStore.load_hdf5('data/bgend_store_15_6.hdf5')
     their_store = strategy.DistributionStore.load_hdf5('data/gnubg_store_15_6.hdf5')
     config = our_store.config
+    config.enable_board_cache()
+    table = successor_table.load_or_build(
+        config, 'data/bgend_successors_15_6.hdf5')
 
     print("Starting analysis")
 
     move_disagreements = []
     boards_examined = 0
-    progress_indicator = strategy.ProgressIndicator(config.num_valid_boards, 500)
+    progress = metrics.ProgressMetrics(config.num_valid_boards, 500)
 
     for board_id in our_store.distribution_map:
-        progress_indicator.complete_one()
+        progress.complete_one()
         if SAMPLE_EVERY and np.random.randint(0, SAMPLE_EVERY) > 0:
             continue
 
@@ -47,13 +52,16 @@ def find_disagreement():
         our_mcd = our_store.distribution_map[board_id]
         their_mcd = their_store.distribution_map[board_id]
 
-        for roll in board.ROLLS:
+        for roll_idx, roll in enumerate(board.ROLLS):
+            # Only generate the moves when the best next boards differ.
+            next_ids = table.successor_ids(board_id, roll_idx)
+            if (our_store.compute_best_next_id(next_ids) ==
+                their_store.compute_best_next_id(next_ids)):
+                continue
             our_moves = our_store.compute_best_moves_for_roll(b, roll)
             their_moves = their_store.compute_best_moves_for_roll(b, roll)
             our_board = b.apply_moves(our_moves)
             their_board = b.apply_moves(their_moves)
-            if our_board.get_id() == their_board.get_id():
-                continue
             our_moves_our_ev = our_store.distribution_map[our_board.get_id()].expected_value()
             our_moves_their_ev = their_store.distribution_map[our_board.get_id()].expected_value()
             their_moves_our_ev = our_store.distribution_map[their_board.get_id()].expected_value()
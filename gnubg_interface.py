@@ -17,12 +17,13 @@
 
 import base64
 import gmpy2
+import numpy as np
 import os
 import re
 import subprocess
-import time
 
 import board
+import metrics
 import strategy
 
 
@@ -53,6 +54,21 @@ def gnubg_id_str_to_board_id(config, pos_id_str):
     return modified_pos_id
 
 
+def gnubg_id_strs_to_board_ids(config, pos_id_strs):
+    """Converts many gnubg position IDs for a batch query.
+
+    Args:
+      config: board.GameConfiguration
+      pos_id_strs: iterable of Base64 encoded position IDs from gnubg
+
+    Returns:
+      np array of int64
+    """
+    return np.array([gnubg_id_str_to_board_id(config, s)
+                     for s in pos_id_strs],
+                    dtype=np.int64)
+
+
 def board_id_to_gnubg_id_str(config, board_id):
     """Convert a board ID to a Base64 endcoded position ID from gnubg.
 
@@ -127,7 +143,8 @@ def parse_gnubg_dump(config, gnubg_str):
             mcd)
 
 
-def create_distribution_store_from_gnubg(gnubg_dir):
+def create_distribution_store_from_gnubg(gnubg_dir, progress_interval=500,
+                                         progress_sinks=None):
     """Creates a database in our format from the gnubg database.
 
     This uses a really dumb and inefficient strategy of calling
@@ -137,49 +154,42 @@ def create_distribution_store_from_gnubg(gnubg_dir):
 
     Args:
       gnubg_dir: source directory of gnubg with everyting compiled 
+      progress_interval: passed to metrics.ProgressMetrics
+      progress_sinks: passed to metrics.ProgressMetrics
 
     Returns:
       strategy.DistributionStore
 
     """
-    progress_interval = 500
-    
     config = board.GameConfiguration(15, 6)
     store = strategy.DistributionStore(config)
 
-    start_time = time.time()
+    progress = metrics.ProgressMetrics(config.num_valid_boards,
+                                       progress_interval, progress_sinks)
+    progress.start("gnubg import")
 
     # gnubg uses a 1 based index as an argument to
     # bearoffdump. However, it doesn't have the end state as a valid
     # index so we add that manually.
     store.distribution_map[config.min_board_id] = (
         strategy.MoveCountDistribution([1]))
+    progress.complete_one()
     for idx in range(1, config.num_valid_boards):
-        completed_process = subprocess.run(
-            [os.path.join(gnubg_dir, 'bearoffdump'),
-             os.path.join(gnubg_dir, 'gnubg_os0.bd'),
-             '-n',
-             str(idx)],
-            universal_newlines=True,
-            stdout=subprocess.PIPE,
-            check=True)
+        with progress.phase(metrics.PHASE_IO):
+            completed_process = subprocess.run(
+                [os.path.join(gnubg_dir, 'bearoffdump'),
+                 os.path.join(gnubg_dir, 'gnubg_os0.bd'),
+                 '-n',
+                 str(idx)],
+                universal_newlines=True,
+                stdout=subprocess.PIPE,
+                check=True)
 
         try:
             b, mcd = parse_gnubg_dump(config, completed_process.stdout)
         except ValueError as err:
             raise ValueError('For gnubg index {}: {}'.format(idx, err))
         store.distribution_map[b.get_id()] = mcd
+        progress.complete_one()
 
-        if idx % progress_interval == 0:
-            frac_complete = idx / config.num_valid_boards
-            this_time = time.time()
-            print("%d/%d %.1f%%, %fs elapsed, %fs estimated total" % (
-                idx,
-                config.num_valid_boards,
-                frac_complete * 100,
-                this_time - start_time,
-                (this_time - start_time) / frac_complete), 
-                  flush=True)
-
-        
     return store
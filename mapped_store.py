@@ -0,0 +1,163 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module contains a read only view of a saved DistributionStore
+# which only reads the distributions that are looked up. It is meant
+# for processes that answer a few queries and should start quickly.
+
+import collections
+
+import h5py
+import numpy as np
+
+import board
+import strategy
+
+
+# Default maximum number of decoded distributions kept in memory.
+DEFAULT_CACHE_SIZE = 1 << 12
+
+
+def _open_array(fn, dataset):
+    """Returns a read only np array for dataset, memory mapped if possible.
+
+    Only contiguous (not chunked or compressed) datasets in files
+    opened by name can be memory mapped. Other datasets are returned as
+    is, which h5py reads lazily on every slice.
+    """
+    if isinstance(fn, str) and dataset.size > 0:
+        offset = dataset.id.get_offset()
+        if offset is not None:
+            return np.memmap(fn, mode="r", dtype=dataset.dtype,
+                             shape=dataset.shape, offset=offset)
+    return dataset
+
+
+class MappedDistributionStore(object):
+    """Read only store that decodes distributions when they are used.
+
+    Opening a store does not read any distributions. Files saved with
+    DistributionStore.save_hdf5(..., compress=False) are memory mapped,
+    so processes reading the same file share it through the page cache
+    instead of each holding a copy. Compressed files work too, but
+    every lookup of a row that is not cached reads and decompresses
+    its HDF5 chunk.
+
+    Only format version 2 files (see DistributionStore.save_hdf5) are
+    supported, because version 1 has no index of the boards.
+
+    Pickling (for example to send to a multiprocessing.Pool) only
+    copies the file name and the file is opened again.
+
+    Attributes:
+      fn: file name or file like object of the store
+      config: board.GameConfiguration
+      cache_size: maximum number of boards kept decoded
+    """
+
+    def __init__(self, fn, cache_size=DEFAULT_CACHE_SIZE):
+        self.fn = fn
+        self.cache_size = cache_size
+        # map from board id to (MoveCountDistribution, expected value),
+        # least recently used first
+        self._cache = collections.OrderedDict()
+        self._open()
+
+    def _open(self):
+        self._file = h5py.File(self.fn, "r")
+        f = self._file
+        if f.attrs.get("format_version", 1) < 2:
+            raise ValueError("%s has format version 1, which cannot be mapped; "
+                             "save it again with format version 2" % self.fn)
+        self.config = board.GameConfiguration.load_from_hdf5(f["config"])
+        grp = f["distributions"]
+        self._encoding = grp.attrs["encoding"]
+        self._values = _open_array(self.fn, grp["values"])
+        self._offsets = _open_array(self.fn, grp["offsets"])
+        self._lengths = _open_array(self.fn, grp["lengths"])
+        self._leading_zeros = _open_array(self.fn, grp["leading_zeros"])
+        if "ev_only_values" in f:
+            self._ev_only_values = _open_array(self.fn, f["ev_only_values"])
+        else:
+            self._ev_only_values = None
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        if not isinstance(self.fn, str):
+            raise ValueError("Only stores opened by file name can be pickled")
+        return {"fn": self.fn, "cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["fn"], state["cache_size"])
+
+    def __contains__(self, board_id):
+        return (self.config.is_valid_id(board_id) and
+                self._lengths[self.config.rank(board_id)] > 0)
+
+    def __getitem__(self, board_id):
+        return self._get(board_id)[0]
+
+    def expected_value(self, board_id):
+        """Returns the expected value of the distribution for board_id."""
+        if self._ev_only_values is not None:
+            if not self.config.is_valid_id(board_id):
+                raise KeyError(board_id)
+            return float(self._ev_only_values[self.config.rank(board_id)])
+        return self._get(board_id)[1]
+
+    def compute_best_next_id(self, next_ids):
+        """Same as DistributionStore.compute_best_next_id."""
+        return min((int(i) for i in next_ids),
+                   key=self.expected_value)
+
+    def compute_best_moves_for_roll(self, this_board, roll):
+        """Same as DistributionStore.compute_best_moves_for_roll."""
+        moves_by_next_id = {}
+        for moves, next_id in self.config.generate_successor_ids(
+                this_board.get_id(), roll):
+            moves_by_next_id.setdefault(next_id, moves)
+        return moves_by_next_id[self.compute_best_next_id(moves_by_next_id)]
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _get(self, board_id):
+        """Returns (MoveCountDistribution, expected value)."""
+        cached = self._cache.get(board_id)
+        if cached is not None:
+            self._cache.move_to_end(board_id)
+            return cached
+        if board_id not in self:
+            raise KeyError(board_id)
+
+        rank = self.config.rank(board_id)
+        start, end = self._offsets[rank:rank + 2]
+        dist = np.zeros(self._lengths[rank])
+        dist[self._leading_zeros[rank]:] = strategy.decode_distribution(
+            self._values[start:end], self._encoding)
+        mcd = strategy.MoveCountDistribution(dist)
+
+        cached = (mcd, mcd.expected_value())
+        self._cache[board_id] = cached
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return cached
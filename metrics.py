@@ -0,0 +1,177 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module contains progress and throughput reporting for long
+# computations, with pluggable sinks for the reports.
+
+import collections
+import contextlib
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+
+# Names of the phases the compute code times. Others can be used too.
+PHASE_MOVE_GENERATION = "move_generation"
+PHASE_SUCCESSOR_LOOKUP = "successor_lookup"
+PHASE_DISTRIBUTION_ARITHMETIC = "distribution_arithmetic"
+PHASE_IO = "io"
+
+
+def peak_rss_bytes():
+    """Returns the peak resident set size of this process or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+class PrintSink(object):
+    """Prints a line per record."""
+
+    def emit(self, record):
+        if record["event"] == "start":
+            print("Starting %s on %d boards" % (record["description"],
+                                                record["total"]),
+                  flush=True)
+            return
+        line = "%d/%d %.1f%%, %fs elapsed, %fs estimated total, %.1f/s" % (
+            record["completed"],
+            record["total"],
+            record["fraction"] * 100,
+            record["elapsed_seconds"],
+            record["elapsed_seconds"] + record["eta_seconds"],
+            record["objects_per_second"])
+        if record["peak_rss_bytes"] is not None:
+            line += ", peak RSS %.1fMB" % (record["peak_rss_bytes"] / 2**20)
+        print(line, flush=True)
+
+
+class CallbackSink(object):
+    """Calls a function with every record."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, record):
+        self.callback(record)
+
+
+class JsonLinesSink(object):
+    """Appends every record as a line of JSON to a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class ProgressMetrics(object):
+    """Tracks the progress of a computation over a number of objects.
+
+    Every progress_interval completed objects, and when all are
+    completed, a record is sent to every sink. A record is a dict with
+    "event": "progress", "completed", "total", "fraction",
+    "elapsed_seconds", "objects_per_second", "eta_seconds",
+    "peak_rss_bytes" (None if unknown) and "phase_seconds", a dict from
+    phase name to the total time spent in it (see phase).
+
+    Attributes:
+      total_objects: int
+      completed_objects: int
+      progress_interval: int, 0 to never report progress
+      sinks: list of objects with an emit(record) method. The default
+        is a PrintSink if progress_interval is set. An empty list is
+        quiet.
+      phase_seconds: collections.OrderedDict from phase name to seconds
+    """
+
+    def __init__(self, total_objects, progress_interval, sinks=None):
+        self.total_objects = total_objects
+        self.completed_objects = 0
+        self.progress_interval = progress_interval
+        if sinks is None:
+            sinks = [PrintSink()] if progress_interval else []
+        self.sinks = sinks
+        self.phase_seconds = collections.OrderedDict()
+        self.start_time = time.time()
+
+    def start(self, description):
+        """Reports the start of the computation."""
+        if self.progress_interval:
+            self._emit({"event": "start", "description": description,
+                        "total": self.total_objects})
+
+    def complete_one(self):
+        """Mark completion of one object."""
+        self.complete_many(1)
+
+    def complete_many(self, count):
+        """Mark completion of count objects."""
+        previous_objects = self.completed_objects
+        self.completed_objects += count
+        if self.progress_interval == 0 or count == 0:
+            return
+        if (self.completed_objects != self.total_objects and
+            (self.completed_objects // self.progress_interval ==
+             previous_objects // self.progress_interval)):
+            return
+        self._emit(self.snapshot())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager adding the time spent inside to phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.perf_counter() - start)
+
+    def add_phase_time(self, name, seconds):
+        self.phase_seconds[name] = self.phase_seconds.get(name, 0) + seconds
+
+    def snapshot(self):
+        """Returns the current progress record."""
+        elapsed = time.time() - self.start_time
+        fraction = (self.completed_objects / self.total_objects
+                    if self.total_objects else 1.0)
+        objects_per_second = (self.completed_objects / elapsed
+                              if elapsed > 0 else 0.0)
+        eta = (elapsed / fraction - elapsed) if fraction > 0 else None
+        return {
+            "event": "progress",
+            "completed": self.completed_objects,
+            "total": self.total_objects,
+            "fraction": fraction,
+            "elapsed_seconds": elapsed,
+            "objects_per_second": objects_per_second,
+            "eta_seconds": eta,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "phase_seconds": dict(self.phase_seconds),
+        }
+
+    def _emit(self, record):
+        for sink in self.sinks:
+            sink.emit(record)
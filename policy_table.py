@@ -0,0 +1,165 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module contains a precomputed table of the best play for every
+# board and roll, so that choosing a move needs neither move generation
+# nor a DistributionStore.
+
+import numpy as np
+
+import board
+import metrics
+
+
+# Header of a policy table file. The entries follow directly.
+_HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<i4"),
+                          ("num_markers", "<i4"), ("num_spots", "<i4"),
+                          ("reserved", "<i4")])
+_MAGIC = b"BGPOLICY"
+_VERSION = 1
+
+# Every move is one byte, spot << _DIE_BITS | die. 0 is no move.
+_DIE_BITS = 3
+_MAX_SPOT = (1 << (8 - _DIE_BITS)) - 1
+_MAX_MOVES = 4
+
+ENTRY_DTYPE = np.dtype([("best_rank", "<i4"),
+                        ("moves", "u1", (_MAX_MOVES,))])
+
+
+def encode_moves(moves):
+    """Encodes a list of board.Move as _MAX_MOVES bytes."""
+    out = np.zeros(_MAX_MOVES, dtype=np.uint8)
+    for i, move in enumerate(moves):
+        out[i] = (move.spot << _DIE_BITS) | move.count
+    return out
+
+
+def decode_moves(encoded):
+    """Inverse of encode_moves."""
+    return [board.Move(spot=int(b) >> _DIE_BITS,
+                       count=int(b) & ((1 << _DIE_BITS) - 1))
+            for b in encoded if b != 0]
+
+
+class PolicyTable(object):
+    """Stores the best next board and moves for every (board, roll).
+
+    "best" is the same as DistributionStore.compute_best_moves_for_roll:
+    the next board with the lowest expected value, ties going to the
+    first generated.
+
+    The entry for the board with rank r and roll board.ROLLS[i] is
+    entries[r, i]. Its best_rank is the rank of the best next board
+    and moves is the moves that produce it, encoded with encode_moves.
+
+    Files are a fixed size header followed by the entries as is, so
+    load memory maps them.
+
+    Attributes:
+      config: board.GameConfiguration
+      entries: np array of ENTRY_DTYPE, [num_valid_boards, len(ROLLS)]
+    """
+
+    def __init__(self, config, entries):
+        self.config = config
+        self.entries = entries
+        expected_shape = (config.num_valid_boards, len(board.ROLLS))
+        if entries.shape != expected_shape:
+            raise ValueError("Bad entries shape %s, expected %s" %
+                             (entries.shape, expected_shape))
+
+    def build(config, store, progress_interval=0):
+        """Chooses the best play for every board and roll.
+
+        Args:
+          config: board.GameConfiguration
+          store: strategy.DistributionStore with every board computed
+          progress_interval: passed to metrics.ProgressMetrics
+
+        Returns:
+          PolicyTable
+        """
+        if config.num_spots > _MAX_SPOT:
+            raise ValueError("Moves can only be encoded for up to %d spots" %
+                             _MAX_SPOT)
+        expected_values = store.expected_values()
+        if np.any(np.isnan(expected_values)):
+            raise ValueError("The store does not have every board")
+        entries = np.zeros([config.num_valid_boards, len(board.ROLLS)],
+                           dtype=ENTRY_DTYPE)
+        progress = metrics.ProgressMetrics(config.num_valid_boards,
+                                           progress_interval)
+        for rank, board_id in enumerate(config.valid_ids().tolist()):
+            for roll_idx, roll in enumerate(board.ROLLS):
+                best_ev = None
+                for moves, next_id in config.generate_successor_ids(board_id,
+                                                                    roll):
+                    next_rank = config.rank(next_id)
+                    next_ev = expected_values[next_rank]
+                    if best_ev is None or next_ev < best_ev:
+                        best_ev = next_ev
+                        best_rank = next_rank
+                        best_moves = moves
+                entries[rank, roll_idx]["best_rank"] = best_rank
+                entries[rank, roll_idx]["moves"] = encode_moves(best_moves)
+            progress.complete_one()
+        return PolicyTable(config, entries)
+
+    def best_next_id(self, board_id, roll_idx):
+        """Returns the id of the best next board."""
+        return int(self.config.unrank(int(
+            self.entries["best_rank"][self.config.rank(board_id), roll_idx])))
+
+    def best_moves(self, board_id, roll_idx):
+        """Returns the list of board.Move for the best play."""
+        return decode_moves(
+            self.entries["moves"][self.config.rank(board_id), roll_idx])
+
+    def best_next_ranks(self, ranks, roll_idxs):
+        """Returns the best next board ranks for arrays of ranks and rolls.
+
+        Args:
+          ranks: np array of board ranks
+          roll_idxs: np array of indices into board.ROLLS, broadcast
+            against ranks
+
+        Returns:
+          np array of int32
+        """
+        return self.entries["best_rank"][ranks, roll_idxs]
+
+    def save(self, fn):
+        header = np.zeros(1, dtype=_HEADER_DTYPE)
+        header["magic"] = _MAGIC
+        header["version"] = _VERSION
+        header["num_markers"] = self.config.num_markers
+        header["num_spots"] = self.config.num_spots
+        with open(fn, "wb") as f:
+            f.write(header.tobytes())
+            f.write(np.ascontiguousarray(self.entries).tobytes())
+
+    def load(fn):
+        """Memory maps a table written by save."""
+        header = np.fromfile(fn, dtype=_HEADER_DTYPE, count=1)
+        if (len(header) != 1 or header["magic"][0] != _MAGIC or
+            header["version"][0] != _VERSION):
+            raise ValueError("%s is not a version %d policy table" %
+                             (fn, _VERSION))
+        config = board.GameConfiguration(int(header["num_markers"][0]),
+                                         int(header["num_spots"][0]))
+        entries = np.memmap(
+            fn, mode="r", dtype=ENTRY_DTYPE, offset=_HEADER_DTYPE.itemsize,
+            shape=(config.num_valid_boards, len(board.ROLLS)))
+        return PolicyTable(config, entries)
@@ -0,0 +1,184 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module contains a simple profiler for the hot functions of board
+# and strategy, so that we can see where the time goes for any
+# configuration without external tools.
+
+import collections
+import contextlib
+import functools
+import time
+
+import board
+import strategy
+
+
+# (class, attribute name, whether it is a generator) for every function
+# Profiler times. Generators are timed over all of their iteration.
+PROFILED_FUNCTIONS = [
+    (board.GameConfiguration, "generate_successor_ids", True),
+    (board.GameConfiguration, "apply_move_id", False),
+    (board.GameConfiguration, "rank", False),
+    (board.GameConfiguration, "unrank", False),
+    (board.Board, "from_id", False),
+    (board.Board, "get_id", False),
+    (board.Board, "generate_moves", True),
+    (board.Board, "generate_successors", True),
+    (board.Board, "apply_move", False),
+    (strategy.MoveCountDistribution, "__add__", False),
+    (strategy.MoveCountDistribution, "__mul__", False),
+    (strategy.MoveCountDistribution, "increase_counts", False),
+    (strategy.MoveCountDistribution, "expected_value", False),
+]
+
+_ROLL_INDEX = {(min(roll.dice), max(roll.dice)): roll_idx
+               for roll_idx, roll in enumerate(board.ROLLS)}
+
+
+class Profiler(object):
+    """Counts calls and wall time of PROFILED_FUNCTIONS.
+
+    Functions are only timed inside instrument(), which replaces them on
+    their classes, so there is no cost otherwise. Times are inclusive,
+    so for example generate_successor_ids includes the apply_move_id
+    calls it makes. Only this process is measured, not the workers of
+    a parallel compute.
+
+    Besides the times, for every roll this counts the move lists
+    GameConfiguration.generate_successor_ids generates and the distinct
+    next boards it yields from them.
+
+    Attributes:
+      calls: collections.Counter from function name to number of calls
+      seconds: collections.Counter from function name to total seconds
+      move_lists: list, for each of board.ROLLS, of the number of move
+        lists generated
+      distinct_successors: list, for each of board.ROLLS, of the number
+        of distinct next boards
+    """
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.seconds = collections.Counter()
+        self.move_lists = [0] * len(board.ROLLS)
+        self.distinct_successors = [0] * len(board.ROLLS)
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def instrument(self):
+        """Context manager timing the profiled functions inside.
+
+        Nested uses only instrument once.
+        """
+        self._depth += 1
+        if self._depth > 1:
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+            return
+
+        originals = []
+        for cls, name, is_generator in PROFILED_FUNCTIONS:
+            original = cls.__dict__[name]
+            originals.append((cls, name, original))
+            label = "%s.%s" % (cls.__name__, name)
+            if is_generator:
+                wrapper = self._wrap_generator(original, label)
+            else:
+                wrapper = self._wrap_function(original, label)
+            setattr(cls, name, wrapper)
+        recursive = board.GameConfiguration._generate_successor_ids_recursive
+        originals.append((board.GameConfiguration,
+                          "_generate_successor_ids_recursive", recursive))
+        board.GameConfiguration._generate_successor_ids_recursive = (
+            self._wrap_move_list_counter(recursive))
+        try:
+            yield self
+        finally:
+            for cls, name, original in originals:
+                setattr(cls, name, original)
+            self._depth -= 1
+
+    def report(self):
+        """Returns a summary of the counts as a multi line string."""
+        lines = ["%-46s %12s %12s %12s" % ("function", "calls", "seconds",
+                                           "us/call")]
+        for label, seconds in self.seconds.most_common():
+            calls = self.calls[label]
+            lines.append("%-46s %12d %12.4f %12.2f" % (
+                label, calls, seconds, 1e6 * seconds / calls))
+        total_move_lists = sum(self.move_lists)
+        if total_move_lists:
+            lines.append("")
+            lines.append("%-10s %12s %12s %8s" % (
+                "roll", "move lists", "distinct", "ratio"))
+            for roll, move_lists, distinct in zip(
+                    board.ROLLS, self.move_lists, self.distinct_successors):
+                if move_lists:
+                    lines.append("%-10s %12d %12d %8.2f" % (
+                        "%d-%d" % (roll.dice[0], roll.dice[1]),
+                        move_lists, distinct, move_lists / distinct))
+            total_distinct = sum(self.distinct_successors)
+            lines.append("%-10s %12d %12d %8.2f" % (
+                "total", total_move_lists, total_distinct,
+                total_move_lists / total_distinct))
+        return "\n".join(lines)
+
+    def _wrap_function(self, func, label):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[label] += time.perf_counter() - start
+                self.calls[label] += 1
+        return wrapper
+
+    def _wrap_generator(self, func, label):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.calls[label] += 1
+            gen = func(*args, **kwargs)
+            count_successors = label.endswith("generate_successor_ids")
+            if count_successors:
+                roll = args[2] if len(args) > 2 else kwargs["roll"]
+                roll_idx = _ROLL_INDEX[(min(roll.dice), max(roll.dice))]
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    self.seconds[label] += time.perf_counter() - start
+                if count_successors:
+                    self.distinct_successors[roll_idx] += 1
+                yield item
+        return wrapper
+
+    def _wrap_move_list_counter(self, func):
+        @functools.wraps(func)
+        def wrapper(config, board_id, dice, dice_idx, *args):
+            if dice_idx > 0:
+                yield from func(config, board_id, dice, dice_idx, *args)
+                return
+            roll_idx = _ROLL_INDEX[(min(dice), max(dice))]
+            for item in func(config, board_id, dice, dice_idx, *args):
+                self.move_lists[roll_idx] += 1
+                yield item
+        return wrapper
+
@@ -0,0 +1,88 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module contains the chance of winning a race where both players
+# are bearing off, from the one sided distributions of a
+# DistributionStore.
+
+import numpy as np
+
+
+class RaceEvaluator(object):
+    """Computes cubeless winning chances of two sided races.
+
+    Each player's number of rolls to finish is taken from their own
+    MoveCountDistribution, independent of the other player, which is
+    the usual one sided approximation. The player on roll wins if they
+    need at most as many rolls as their opponent, so
+
+      P(win) = sum over n of P(we need n rolls) * P(they need >= n rolls)
+
+    Both players' boards are from the same GameConfiguration.
+
+    Attributes:
+      config: board.GameConfiguration
+    """
+
+    def __init__(self, store):
+        """Precomputes the distributions needed for store.
+
+        Args:
+          store: strategy.DistributionStore with every board that will
+            be evaluated
+        """
+        self.config = store.config
+        dists, self._lengths = store.distribution_arrays()
+        self._dists = np.asarray(dists, dtype=np.float64)
+        # _at_least[i, n] is P(board with rank i needs >= n rolls)
+        self._at_least = np.ones(self._dists.shape)
+        self._at_least[:, 1:] = np.clip(
+            1 - np.cumsum(self._dists[:, :-1], axis=1), 0, 1)
+
+    def win_probabilities(self, our_ids, their_ids):
+        """Computes P(we win) for pairs of boards with us on roll.
+
+        Args:
+          our_ids: array like of board ids of the player on roll
+          their_ids: array like of board ids of the opponent, broadcast
+            against our_ids
+
+        Return
+          np array of float64 with the broadcast shape
+        """
+        our_ranks, their_ranks = np.broadcast_arrays(
+            self._ranks(our_ids), self._ranks(their_ids))
+        return np.einsum("...n,...n->...", self._dists[our_ranks],
+                         self._at_least[their_ranks])
+
+    def win_probability_matrix(self, our_ids, their_ids):
+        """Computes P(we win) for every combination of boards.
+
+        Args:
+          our_ids: 1D array like of board ids of the player on roll
+          their_ids: 1D array like of board ids of the opponent
+
+        Return
+          2D np array of float64, [len(our_ids), len(their_ids)]
+        """
+        return (self._dists[self._ranks(our_ids)] @
+                self._at_least[self._ranks(their_ids)].T)
+
+    def _ranks(self, board_ids):
+        ranks = self.config.rank_array(board_ids)
+        missing = self._lengths[ranks] == 0
+        if np.any(missing):
+            raise ValueError("Board %d has no distribution in the store" %
+                             np.asarray(board_ids)[missing].flat[0])
+        return ranks
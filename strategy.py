@@ -12,39 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import collections.abc
+import contextlib
 import h5py
+import multiprocessing
 import numpy as np
+import os
+import tempfile
 import time
 
 import board
+import features
+import metrics
+import successor_table
 
 
-class ProgressIndicator(object):
-    """Simple print based progress indicator."""
-    def __init__(self, total_objects, progress_interval):
-        self.total_objects = total_objects
-        self.completed_objects = 0
-        self.progress_interval = progress_interval
-        self.start_time = time.time()
-
-    def complete_one(self):
-        """Mark completion of one obhect."""
-        self.completed_objects += 1
-        if self.progress_interval == 0:
-            return
-        if (self.completed_objects != self.total_objects and
-            self.completed_objects % self.progress_interval != 0):
-            return
-
-        frac_complete = self.completed_objects / self.total_objects
-        this_time = time.time()
-        print("%d/%d %.1f%%, %fs elapsed, %fs estimated total" % (
-            self.completed_objects,
-            self.total_objects,
-            frac_complete * 100,
-            this_time - self.start_time,
-            (this_time - self.start_time) / frac_complete),
-            flush=True)
+# Kept for existing callers, see metrics.ProgressMetrics.
+ProgressIndicator = metrics.ProgressMetrics
 
 
 class MoveCountDistribution(object):
@@ -112,24 +97,437 @@ class MoveCountDistribution(object):
         return MoveCountDistribution(np.append(self.dist, values))
 
     def trim_low_prob(self, threshold):
-        modified_dist = self.dist
+        modified_dist = self.dist.copy()
         modified_dist[modified_dist < threshold] = 0
         return MoveCountDistribution(np.trim_zeros(modified_dist, 'b'))
 
 
+# Encodings for storing distributions. Float encodings are just the
+# dtype. Fixed point encodings store round(p * scale) in an unsigned
+# integer, which has an absolute error of at most 0.5 / scale for
+# every probability.
+ENCODINGS = {
+    "float64": (np.float64, None),
+    "float32": (np.float32, None),
+    "float16": (np.float16, None),
+    "fixed16": (np.uint16, 2**16 - 1),
+    "fixed32": (np.uint32, 2**32 - 1),
+}
+
+
+def encode_distribution(dist, encoding):
+    """Converts dist to the array stored for encoding."""
+    dtype, scale = ENCODINGS[encoding]
+    if scale is None:
+        return np.asarray(dist, dtype=dtype)
+    return np.round(np.asarray(dist) * scale).astype(dtype)
+
+
+def decode_distribution(arr, encoding):
+    """Inverse of encode_distribution, returns np array of float64."""
+    dtype, scale = ENCODINGS[encoding]
+    if scale is None:
+        return np.asarray(arr, dtype=np.float64)
+    return np.asarray(arr, dtype=np.float64) / scale
+
+
+class PrecisionReport(object):
+    """Errors from storing distributions with less precision.
+
+    Attributes:
+      encoding: key of ENCODINGS
+      trim_threshold: probabilities below this were dropped
+      max_mass_error: max over boards of |total probability - 1|
+      max_expected_value_error: max over boards of the absolute change
+        in expected value, NaN if the exact values are not known
+    """
+
+    def __init__(self, encoding, trim_threshold, max_mass_error,
+                 max_expected_value_error):
+        self.encoding = encoding
+        self.trim_threshold = trim_threshold
+        self.max_mass_error = max_mass_error
+        self.max_expected_value_error = max_expected_value_error
+
+    def __str__(self):
+        return ("PrecisionReport(%s, trim %g, mass error %g, "
+                "expected value error %g)" % (
+                    self.encoding, self.trim_threshold,
+                    self.max_mass_error, self.max_expected_value_error))
+
+
+class DenseDistributionMap(collections.abc.MutableMapping):
+    """Map from board id to MoveCountDistribution backed by one 2D array.
+
+    Row i of dists holds the distribution for the board with rank i
+    (see board.GameConfiguration.rank), padded with zeros to the width
+    of the longest distribution. This avoids a Python object and a
+    small np array per board and lets store wide operations work on
+    whole arrays.
+
+    Getting an item returns a MoveCountDistribution whose dist is a view
+    into dists, so it should not be modified.
+
+    Iteration is in increasing board id order.
+
+    Attributes:
+      config: board.GameConfiguration
+      dists: 2D np array, [num_valid_boards, width]. float64 unless a
+        smaller float dtype is given to save memory.
+      lengths: np array of int32, length of each distribution, 0 when
+        the board has none
+      expected_values: np array of float64, expected value of each
+        distribution, NaN when the board has none
+    """
+
+    def __init__(self, config, initial_width=16, dtype=np.float64):
+        self.config = config
+        self.dists = np.zeros([config.num_valid_boards, initial_width],
+                              dtype=dtype)
+        self.lengths = np.zeros(config.num_valid_boards, dtype=np.int32)
+        self.expected_values = np.full(config.num_valid_boards, np.nan)
+        self._num_present = 0
+
+    def from_arrays(config, dists, lengths, expected_values):
+        """Creates a map using the given arrays without copying them.
+
+        The arrays can be in shared memory or memory mapped. Setting a
+        distribution longer than dists is wide replaces dists with a
+        new private array, so the width has to be big enough up front
+        for the writes to be seen by others sharing the arrays.
+        """
+        out = DenseDistributionMap(config, initial_width=0)
+        out.dists = dists
+        out.lengths = lengths
+        out.expected_values = expected_values
+        out._num_present = int(np.count_nonzero(lengths))
+        return out
+
+    def __getitem__(self, board_id):
+        rank = self._rank_or_key_error(board_id)
+        length = self.lengths[rank]
+        if length == 0:
+            raise KeyError(board_id)
+        return MoveCountDistribution(self.dists[rank, :length])
+
+    def __setitem__(self, board_id, mcd):
+        rank = self.config.rank(board_id)
+        length = len(mcd.dist)
+        if length > self.dists.shape[1]:
+            self._grow(max(length, 2 * self.dists.shape[1]))
+        if self.lengths[rank] == 0:
+            self._num_present += 1
+        self.dists[rank, :length] = mcd.dist
+        self.dists[rank, length:] = 0
+        # At least 1 so that the row counts as present.
+        self.lengths[rank] = max(length, 1)
+        self.expected_values[rank] = mcd.expected_value()
+
+    def __delitem__(self, board_id):
+        rank = self._rank_or_key_error(board_id)
+        if self.lengths[rank] == 0:
+            raise KeyError(board_id)
+        self._num_present -= 1
+        self.dists[rank] = 0
+        self.lengths[rank] = 0
+        self.expected_values[rank] = np.nan
+
+    def __contains__(self, board_id):
+        try:
+            rank = self.config.rank(board_id)
+        except ValueError:
+            return False
+        return self.lengths[rank] > 0
+
+    def __iter__(self):
+        return iter(self.config.valid_ids()[self.lengths > 0].tolist())
+
+    def __len__(self):
+        return self._num_present
+
+    def clear(self):
+        self.dists[:] = 0
+        self.lengths[:] = 0
+        self.expected_values[:] = np.nan
+        self._num_present = 0
+
+    def expected_value(self, board_id):
+        """Returns the cached expected value of the distribution."""
+        rank = self._rank_or_key_error(board_id)
+        if self.lengths[rank] == 0:
+            raise KeyError(board_id)
+        return self.expected_values[rank]
+
+    def _rank_or_key_error(self, board_id):
+        try:
+            return self.config.rank(board_id)
+        except ValueError:
+            raise KeyError(board_id)
+
+    def _grow(self, width):
+        new_dists = np.zeros([self.dists.shape[0], width],
+                             dtype=self.dists.dtype)
+        new_dists[:, :self.dists.shape[1]] = self.dists
+        self.dists = new_dists
+
+
+class Checkpointer(object):
+    """Periodically saves a partially computed store so compute can resume.
+
+    A checkpoint is a normal store file (see DistributionStore.save_hdf5)
+    with the boards solved so far. It is written to a temporary file
+    and then renamed, so a crash while saving leaves the previous
+    checkpoint intact.
+
+    Attributes:
+      path: file name of the checkpoint
+      interval_boards: if > 0, save after this many more boards are solved
+      interval_seconds: if > 0, save after this many more seconds
+      resume: whether compute starts from an existing checkpoint at path
+      num_saves: number of checkpoints written
+    """
+
+    def __init__(self, path, interval_boards=0, interval_seconds=0,
+                 resume=True):
+        self.path = path
+        self.interval_boards = interval_boards
+        self.interval_seconds = interval_seconds
+        self.resume = resume
+        self.num_saves = 0
+        self._last_save_boards = 0
+        self._last_save_time = time.time()
+
+    def maybe_save(self, store, completed_boards):
+        """Saves store if an interval has passed since the last save."""
+        if ((self.interval_boards > 0 and
+             completed_boards - self._last_save_boards >=
+             self.interval_boards) or
+            (self.interval_seconds > 0 and
+             time.time() - self._last_save_time >= self.interval_seconds)):
+            self.save(store, completed_boards)
+
+    def save(self, store, completed_boards):
+        tmp_path = self.path + ".tmp"
+        store.save_hdf5(tmp_path)
+        os.replace(tmp_path, self.path)
+        self.num_saves += 1
+        self._last_save_boards = completed_boards
+        self._last_save_time = time.time()
+
+    def load(self, config):
+        """Loads the checkpoint at self.path for config.
+
+        Args:
+          config: board.GameConfiguration the checkpoint must be for
+
+        Return
+          dict from board id to MoveCountDistribution, in increasing id
+          order. Empty if there is no checkpoint or resume is False.
+
+        Raises:
+          ValueError: if the checkpoint does not match config or has
+            bad distributions
+        """
+        self._last_save_boards = 0
+        self._last_save_time = time.time()
+        if not self.resume or not os.path.exists(self.path):
+            return {}
+        checkpoint = DistributionStore.load_hdf5(self.path)
+        if (checkpoint.config.num_markers != config.num_markers or
+            checkpoint.config.num_spots != config.num_spots):
+            raise ValueError(
+                "Checkpoint %s is for %dx%d, expected %dx%d" % (
+                    self.path, checkpoint.config.num_markers,
+                    checkpoint.config.num_spots, config.num_markers,
+                    config.num_spots))
+        out = {}
+        for board_id in sorted(checkpoint.distribution_map):
+            mcd = checkpoint.distribution_map[board_id]
+            if not config.is_valid_id(board_id) or not mcd.is_normalized():
+                raise ValueError("Checkpoint %s has bad board %d: %s" %
+                                 (self.path, board_id, mcd))
+            out[board_id] = mcd
+        self._last_save_boards = len(out)
+        return out
+
+
+# Version of the file layout written by DistributionStore.save_hdf5
+FORMAT_VERSION = 2
+
+# Default maximum number of boards kept by DistributionStore.get_or_compute.
+DEFAULT_LAZY_CACHE_SIZE = 1 << 20
+
+# Extra objectives DistributionStore.compute can solve for in the same
+# pass. See _compute_batched.
+OBJECTIVES = ["first_off", "within_k"]
+
+# Default largest k for the "within_k" objective.
+DEFAULT_WITHIN_K_MAX_ROLLS = 16
+
+
 class DistributionStore(object):
     """Stores MoveCountDistributions for board states.
 
     Attributes:
       config: board.GameConfiguration
-      distribution_map: map from board id to MoveCountDistribution
+      distribution_map: map from board id to MoveCountDistribution. A
+        dict, or a DenseDistributionMap if the store is dense.
+      features: features.FeatureTable or None. See compute_features.
+      lazy_cache_size: maximum number of boards kept by get_or_compute
+      ev_only_values: np array of float64 expected values aligned with
+        board rank if computed with compute(mode="ev"), otherwise None.
+        When set, these are the expected values used to choose moves.
+      precision_report: PrecisionReport if the distributions were
+        loaded from a reduced precision file or reduced with
+        reduce_precision, otherwise None
+      objectives: dict from name to np array aligned with board rank
+        for the objectives computed with compute(objectives=...). See
+        _compute_batched for the names.
+      compute_metrics: metrics.ProgressMetrics of the last compute or
+        None
     """
 
-    def __init__(self, config):
+    def __init__(self, config, lazy_cache_size=DEFAULT_LAZY_CACHE_SIZE,
+                 dense=False):
         self.config = config
-        self.distribution_map = {}
+        if dense:
+            self.distribution_map = DenseDistributionMap(config)
+        else:
+            self.distribution_map = {}
+        self.features = None
+        self.ev_only_values = None
+        self.precision_report = None
+        self.objectives = {}
+        self.compute_metrics = None
+        self.lazy_cache_size = lazy_cache_size
+        # map from board id to (MoveCountDistribution, expected value),
+        # least recently used first
+        self._lazy_cache = collections.OrderedDict()
+
+    def is_dense(self):
+        return isinstance(self.distribution_map, DenseDistributionMap)
 
-    def compute_best_moves_for_roll(self, this_board, roll):
+    def expected_value(self, board_id):
+        """Returns the expected value of the distribution for board_id.
+
+        Dense stores keep these precomputed.
+        """
+        if self.ev_only_values is not None:
+            return self.ev_only_values[self.config.rank(board_id)]
+        if self.is_dense():
+            return self.distribution_map.expected_value(board_id)
+        return self.distribution_map[board_id].expected_value()
+
+    def expected_values(self):
+        """Returns the expected value for every board.
+
+        Return
+          np array of float64 aligned with board rank, NaN for boards
+          not in the store
+        """
+        if self.ev_only_values is not None:
+            return self.ev_only_values.copy()
+        if self.is_dense():
+            return self.distribution_map.expected_values.copy()
+        out = np.full(self.config.num_valid_boards, np.nan)
+        for board_id, mcd in self.distribution_map.items():
+            out[self.config.rank(board_id)] = mcd.expected_value()
+        return out
+
+    def distribution_arrays(self):
+        """Returns all the distributions as arrays aligned with board rank.
+
+        Dense stores return their arrays without copying.
+
+        Return
+          (dists, lengths): dists is a 2D np array with row i the
+          distribution of the board with rank i padded with zeros and
+          lengths is an np array of int32 distribution lengths, 0 for
+          boards not in the store
+        """
+        if self.is_dense():
+            return self.distribution_map.dists, self.distribution_map.lengths
+        width = max((len(mcd) for mcd in self.distribution_map.values()),
+                    default=0)
+        dists = np.zeros([self.config.num_valid_boards, width])
+        lengths = np.zeros(self.config.num_valid_boards, dtype=np.int32)
+        for board_id, mcd in self.distribution_map.items():
+            rank = self.config.rank(board_id)
+            dists[rank, :len(mcd)] = mcd.dist
+            lengths[rank] = len(mcd)
+        return dists, lengths
+
+    def restrict_to(self, config):
+        """Returns a store for a smaller config made from this one.
+
+        A board of config is the board of self.config with the extra
+        markers off and the extra spots empty (see
+        board.GameConfiguration.embed_ids), and it plays exactly the
+        same, so this answers queries for config without computing it.
+
+        Boards whose embedded board is not in this store are left out.
+        Objectives are not carried over.
+
+        Args:
+          config: board.GameConfiguration with no more markers and
+            spots than self.config
+
+        Return
+          DistributionStore for config, dense if this one is
+        """
+        embedded_ids = self.config.embed_ids(config, config.valid_ids())
+        embedded_ranks = self.config.rank_array(embedded_ids)
+        out = DistributionStore(config, self.lazy_cache_size)
+        out.precision_report = self.precision_report
+        if self.ev_only_values is not None:
+            out.ev_only_values = self.ev_only_values[embedded_ranks]
+        if self.is_dense():
+            out.distribution_map = DenseDistributionMap.from_arrays(
+                config, self.distribution_map.dists[embedded_ranks],
+                self.distribution_map.lengths[embedded_ranks],
+                self.distribution_map.expected_values[embedded_ranks])
+        else:
+            for board_id, embedded_id in zip(config.valid_ids().tolist(),
+                                             embedded_ids.tolist()):
+                mcd = self.distribution_map.get(embedded_id)
+                if mcd is not None:
+                    out.distribution_map[board_id] = mcd
+        return out
+
+    def _seed_arrays(self, seed_store):
+        """Returns the distributions of seed_store embedded in self.config.
+
+        Args:
+          seed_store: DistributionStore for a config contained in
+            self.config
+
+        Return
+          (ranks, dists, lengths, expected_values): ranks in
+          self.config of the boards seed_store has and their rows of
+          seed_store.distribution_arrays and expected_values
+        """
+        if seed_store.ev_only_values is not None:
+            raise ValueError("seed_store only has expected values")
+        dists, lengths = seed_store.distribution_arrays()
+        present = lengths > 0
+        embedded_ids = self.config.embed_ids(
+            seed_store.config, seed_store.config.valid_ids()[present])
+        return (self.config.rank_array(embedded_ids), dists[present],
+                lengths[present], seed_store.expected_values()[present])
+
+    def _seed_distributions(self, seed_store):
+        """Returns a dict from board id to MoveCountDistribution.
+
+        Same as _seed_arrays, in the form of a checkpoint (see
+        Checkpointer.load).
+        """
+        ranks, dists, lengths, _ = self._seed_arrays(seed_store)
+        return {board_id: MoveCountDistribution(
+                    np.array(dists[i, :lengths[i]], dtype=np.float64))
+                for i, board_id in enumerate(
+                    self.config.unrank_array(ranks).tolist())}
+
+    def compute_best_moves_for_roll(self, this_board, roll, profiler=None):
         """Computes the best moves for the roll.
 
         "best" means the resulting position with the lowest expected
@@ -143,6 +541,7 @@ class DistributionStore(object):
         Args:
           this_board: board.Board
           roll: board.Roll
+          profiler: if given, a profiling.Profiler to record into
 
         Return
           list of board.Move
@@ -150,20 +549,33 @@ class DistributionStore(object):
         """
         # dict from board id to tuple of (expected_value, moves)
         possible_next_boards = {}
-        for moves in this_board.generate_moves(roll):
-            next_board = this_board.apply_moves(moves)
-            next_board_id = next_board.get_id()
-            if next_board_id in possible_next_boards:
-                continue
-            possible_next_boards[next_board_id] = (
-                self.distribution_map[next_board_id].expected_value(),
-                moves)
+        with _instrument(profiler):
+            for moves, next_board_id in self.config.generate_successor_ids(
+                    this_board.get_id(), roll):
+                possible_next_boards[next_board_id] = (
+                    self.expected_value(next_board_id),
+                    moves)
 
         best_next_board = min(possible_next_boards.keys(),
                               key=(lambda k: possible_next_boards[k][0]))
 
         return possible_next_boards[best_next_board][1]
 
+    def compute_best_next_id(self, next_ids):
+        """Chooses the next board with the lowest expected value.
+
+        Ties go to the first of next_ids, the same as
+        compute_best_moves_for_roll.
+
+        Args:
+          next_ids: iterable of board ids
+
+        Return
+          int board id
+        """
+        return min((int(i) for i in next_ids),
+                   key=self.expected_value)
+
     def compute_move_distribution_for_board(self, this_board):
         """Computes the MoveCountDistribution for this_board.
 
@@ -173,58 +585,685 @@ class DistributionStore(object):
         Args:
           this_board: board.Board
 
+        Return
+          MoveCountDistribution
+        """
+        return self.compute_move_distribution_for_id(this_board.get_id())
+
+    def compute_move_distribution_for_id(self, board_id):
+        """Computes the MoveCountDistribution for board_id.
+
+        Same as compute_move_distribution_for_board, but works on the
+        id without creating any board.Board.
+
+        Args:
+          board_id: valid board id
+
+        Return
+          MoveCountDistribution
+        """
+        return self._compute_move_distribution(
+            (next_id for _, next_id in
+             self.config.generate_successor_ids(board_id, roll))
+            for roll in board.ROLLS)
+
+    def compute_move_distribution_from_table(self, board_id, successor_table):
+        """Computes the MoveCountDistribution for board_id.
+
+        Like compute_move_distribution_for_board, but the next boards
+        come from successor_table instead of generating moves.
+
+        Args:
+          board_id: valid board id
+          successor_table: successor_table.SuccessorTable
+
+        Return
+          MoveCountDistribution
+        """
+        return self._compute_move_distribution(
+            successor_table.successor_ids(board_id, roll_idx)
+            for roll_idx in range(len(board.ROLLS)))
+
+    def _compute_move_distribution(self, next_ids_by_roll):
+        """Combines the best next boards for each roll.
+
+        Args:
+          next_ids_by_roll: for each of board.ROLLS in order, an
+            iterable of the possible next board ids
+
         Return
           MoveCountDistribution
         """
         out = MoveCountDistribution()
-        for roll in board.ROLLS:
-            moves = self.compute_best_moves_for_roll(this_board, roll)
-            next_board = this_board.apply_moves(moves)
-            out += (self.distribution_map[next_board.get_id()]
+        for roll, next_ids in zip(board.ROLLS, next_ids_by_roll):
+            best_next_id = self.compute_best_next_id(next_ids)
+            out += (self.distribution_map[best_next_id]
                     .increase_counts(1) * roll.prob)
 
         assert out.is_normalized()
 
         return out
 
-    def compute(self, progress_interval=500, limit=-1):
+    def compute(self, progress_interval=500, limit=-1, successor_table=None,
+                jobs=1, batched=False, checkpointer=None, mode="distribution",
+                objectives=(), within_k_max_rolls=DEFAULT_WITHIN_K_MAX_ROLLS,
+                progress_sinks=None, profiler=None, seed_store=None):
         """Computes and stores MoveCountDistribution for each board.
 
         clears an existing data in self.distribution_map
 
+        Progress, throughput and the time in each metrics.PHASE_* are
+        tracked in a metrics.ProgressMetrics, left in
+        self.compute_metrics afterwards.
+
         Args:
+          progress_interval: report progress every this many boards, 0
+            for never
           limit: if > 0, only computes this many valid boards
+          successor_table: if given, a successor_table.SuccessorTable
+            for self.config used instead of generating moves
+          jobs: if > 1, the number of processes to compute with. See
+            _compute_parallel.
+          batched: if True, compute whole pip levels at once with array
+            operations. See _compute_batched. Uses successor_table,
+            which is built if not given.
+          checkpointer: if given, a Checkpointer used to save progress
+            and, if it has a checkpoint, to skip the boards already
+            solved in it. Supported by the serial, batched and jobs
+            computes, but not with objectives or mode "ev". The batched
+            and jobs computes check it after every pip level.
+          mode: "distribution" to compute a MoveCountDistribution per
+            board or "ev" to only compute self.ev_only_values. See
+            _compute_ev.
+          objectives: names from OBJECTIVES to also compute into
+            self.objectives in the same pass. Requires batched.
+          within_k_max_rolls: largest k for the "within_k" objective
+          progress_sinks: sinks for the progress reports, see
+            metrics.ProgressMetrics
+          profiler: if given, a profiling.Profiler to record into
+          seed_store: if given, a computed DistributionStore for a
+            config with no more markers and spots than self.config. Its
+            boards are embedded (see restrict_to) and copied instead of
+            computed, so extending a store by a marker or a spot only
+            computes the new boards. Not supported with objectives or
+            mode "ev".
         """
+        with _instrument(profiler):
+            self._compute(progress_interval, limit, successor_table, jobs,
+                          batched, checkpointer, mode, objectives,
+                          within_k_max_rolls, progress_sinks, seed_store)
+
+    def _compute(self, progress_interval, limit, successor_table, jobs,
+                 batched, checkpointer, mode, objectives, within_k_max_rolls,
+                 progress_sinks, seed_store):
+        self.objectives = {}
+        for name in objectives:
+            if name not in OBJECTIVES:
+                raise ValueError("Unknown objective %s" % name)
+        if objectives and (mode != "distribution" or not batched):
+            raise ValueError("objectives are only supported with batched "
+                             "and mode distribution")
+        if checkpointer and objectives:
+            raise ValueError("checkpointer is not supported with objectives")
+        if seed_store and (objectives or mode == "ev"):
+            raise ValueError("seed_store is not supported with objectives "
+                             "or mode ev")
+        progress = metrics.ProgressMetrics(self.config.num_valid_boards,
+                                           progress_interval, progress_sinks)
+        self.compute_metrics = progress
+        if mode == "ev":
+            if limit > 0 or jobs > 1 or checkpointer:
+                raise ValueError(
+                    "limit, jobs and checkpointer are not supported with "
+                    "mode ev")
+            self._compute_ev(progress, successor_table, batched)
+            return
+        if mode != "distribution":
+            raise ValueError("Unknown mode %s" % mode)
+        self.ev_only_values = None
+        if jobs > 1:
+            if limit > 0 or successor_table or batched:
+                raise ValueError(
+                    "limit, successor_table and batched are not supported "
+                    "with jobs")
+            self._compute_parallel(progress, jobs, checkpointer, seed_store)
+            return
+        if batched:
+            if limit > 0:
+                raise ValueError("limit is not supported with batched")
+            self._compute_batched(progress, successor_table, objectives,
+                                  within_k_max_rolls, seed_store,
+                                  checkpointer)
+            return
+
         self.distribution_map.clear()
+        if checkpointer:
+            with progress.phase(metrics.PHASE_IO):
+                self.distribution_map.update(checkpointer.load(self.config))
+        # Added in id order as they come up, like the computed boards.
+        seeds = self._seed_distributions(seed_store) if seed_store else {}
 
-        progress_indicator = ProgressIndicator(self.config.num_valid_boards,
-                                               progress_interval)
-        if progress_interval:
-            print("Starting compute on %d boards" %
-                  self.config.num_valid_boards,
-                  flush=True)
+        progress.start("compute")
 
         # The minimum board id is the game ended state.
-        progress_indicator.complete_one()
+        progress.complete_one()
         self.distribution_map[self.config.min_board_id] = MoveCountDistribution([1])
-        id_generator = self.config.generate_valid_ids()
-        next(id_generator)  # skip the solved state
+        # [1:] skips the solved state
+        for board_id in self.config.valid_ids()[1:].tolist():
+            progress.complete_one()
 
-        for board_id in id_generator:
-            if not self.config.is_valid_id(board_id):
+            if board_id in self.distribution_map:
+                # Solved in the checkpoint
+                continue
+            if board_id in seeds:
+                self.distribution_map[board_id] = seeds[board_id]
                 continue
 
-            progress_indicator.complete_one()
-
-            this_board = board.Board.from_id(self.config, board_id)
-            dist = self.compute_move_distribution_for_board(this_board)
+            if successor_table:
+                with progress.phase(metrics.PHASE_SUCCESSOR_LOOKUP):
+                    next_ids_by_roll = [
+                        successor_table.successor_ids(board_id, roll_idx)
+                        for roll_idx in range(len(board.ROLLS))]
+            else:
+                with progress.phase(metrics.PHASE_MOVE_GENERATION):
+                    next_ids_by_roll = [
+                        [next_id for _, next_id in
+                         self.config.generate_successor_ids(board_id, roll)]
+                        for roll in board.ROLLS]
+            with progress.phase(metrics.PHASE_DISTRIBUTION_ARITHMETIC):
+                dist = self._compute_move_distribution(next_ids_by_roll)
             self.distribution_map[board_id] = dist
+            if checkpointer:
+                with progress.phase(metrics.PHASE_IO):
+                    checkpointer.maybe_save(self, progress.completed_objects)
 
-            if limit > 0 and progress_indicator.completed_objects >= limit:
+            if limit > 0 and progress.completed_objects >= limit:
                 print("Stopping at %d boards, id %d"
-                      % (progress_indicator.completed_objects, board_id))
+                      % (progress.completed_objects, board_id))
                 break
 
+    def _compute_ev(self, progress, table, batched):
+        """Computes only the expected number of rolls for every board.
+
+        The expected value of a board is one more than the probability
+        weighted sum over rolls of the lowest expected value of the
+        next boards. That needs one float per board instead of a
+        distribution, so it is much cheaper in time and memory.
+
+        Clears self.distribution_map and sets self.ev_only_values. Use
+        compute_distributions_from_ev to get distributions for some
+        boards afterwards.
+
+        The values agree with the expected values of the full
+        distributions up to rounding. If two moves are within rounding
+        of each other, the other one may be chosen.
+
+        Args:
+          progress: metrics.ProgressMetrics
+          table: successor_table.SuccessorTable or None. Used, and built
+            if needed, when batched.
+          batched: compute a pip level at a time with array operations
+        """
+        self.distribution_map.clear()
+        self.ev_only_values = None
+        progress.start("expected value compute")
+
+        values = np.full(self.config.num_valid_boards, np.nan)
+        # Rank 0 is the min_board_id, the finished board.
+        values[0] = 0
+        progress.complete_one()
+        if batched:
+            if table is None:
+                with progress.phase(metrics.PHASE_MOVE_GENERATION):
+                    table = successor_table.SuccessorTable.build(self.config)
+            total_pips = board.BoardBatch.from_ids(
+                self.config, self.config.valid_ids()).total_pips()
+            for pips in range(1, int(np.max(total_pips)) + 1):
+                ranks = np.flatnonzero(total_pips == pips)
+                with progress.phase(metrics.PHASE_SUCCESSOR_LOOKUP):
+                    successors = _gather_successors(_roll_entries(ranks),
+                                                    table)
+                with progress.phase(metrics.PHASE_DISTRIBUTION_ARITHMETIC):
+                    best = _choose_best_successors(ranks, table, values,
+                                                   successors)
+                    total = np.zeros(len(ranks))
+                    for roll_idx in range(len(board.ROLLS)):
+                        total += (_ROLL_PROBS[roll_idx] *
+                                  values[best[:, roll_idx]])
+                    values[ranks] = 1 + total
+                progress.complete_many(len(ranks))
+        else:
+            # Same arithmetic in the same order as the batched path.
+            for rank, board_id in enumerate(
+                    self.config.valid_ids()[1:].tolist(), start=1):
+                if table:
+                    with progress.phase(metrics.PHASE_SUCCESSOR_LOOKUP):
+                        next_ranks_by_roll = [
+                            table.successor_ranks(rank, roll_idx)
+                            for roll_idx in range(len(board.ROLLS))]
+                else:
+                    with progress.phase(metrics.PHASE_MOVE_GENERATION):
+                        next_ranks_by_roll = [
+                            [self.config.rank(next_id) for _, next_id in
+                             self.config.generate_successor_ids(board_id,
+                                                                roll)]
+                            for roll in board.ROLLS]
+                with progress.phase(metrics.PHASE_DISTRIBUTION_ARITHMETIC):
+                    total = 0.0
+                    for roll, next_ranks in zip(board.ROLLS,
+                                                next_ranks_by_roll):
+                        total += roll.prob * min(values[r] for r in next_ranks)
+                    values[rank] = 1 + total
+                progress.complete_one()
+
+        self.ev_only_values = values
+
+    def compute_distributions_from_ev(self, board_ids):
+        """Computes distributions for board_ids with the expected value policy.
+
+        Moves are chosen by self.ev_only_values (see compute with mode
+        "ev"). The distributions of the boards that policy can reach
+        are computed as well and everything is put in
+        self.distribution_map.
+
+        Args:
+          board_ids: iterable of valid board ids
+        """
+        if self.ev_only_values is None:
+            raise ValueError("No expected values, use compute(mode='ev')")
+        for board_id in board_ids:
+            if not self.config.is_valid_id(board_id):
+                raise ValueError("%d is not a valid board id" % board_id)
+            self._distribution_from_ev(int(board_id))
+
+    def _distribution_from_ev(self, board_id):
+        mcd = self.distribution_map.get(board_id)
+        if mcd is not None:
+            return mcd
+        if board_id == self.config.min_board_id:
+            mcd = MoveCountDistribution([1])
+        else:
+            mcd = MoveCountDistribution()
+            for roll in board.ROLLS:
+                best_next_id = self.compute_best_next_id(
+                    next_id for _, next_id in
+                    self.config.generate_successor_ids(board_id, roll))
+                mcd += (self._distribution_from_ev(best_next_id)
+                        .increase_counts(1) * roll.prob)
+            assert mcd.is_normalized()
+        self.distribution_map[board_id] = mcd
+        return mcd
+
+    def _compute_batched(self, progress, table, objectives=(),
+                         within_k_max_rolls=DEFAULT_WITHIN_K_MAX_ROLLS,
+                         seed_store=None, checkpointer=None):
+        """Computes every board, a pip level at a time, with array operations.
+
+        The boards with the same total pips only depend on boards with
+        fewer pips, so a whole level is done at once by
+        _compute_block into preallocated arrays. The per board
+        MoveCountDistribution arithmetic in compute is the reference
+        for this, and the results are identical to it.
+
+        The next boards of a level are gathered from the table once and
+        shared by the extra objectives, each with its own policy:
+
+          "first_off": the distribution of the number of rolls until
+            the first marker is off, when minimizing its expected
+            value, as when trying to save a gammon. Sets
+            self.objectives["first_off"], a 2D array of distributions
+            padded with zeros ([1] for boards with a marker off), and
+            "first_off_policy", the chosen next rank for every board
+            and roll (-1 for boards with a marker off).
+          "within_k": P(finishing within k rolls) when maximizing it
+            for that k. Sets self.objectives["within_k"],
+            [num_valid_boards, within_k_max_rolls + 1] with element
+            [i, k] for k rolls, and "within_k_policy",
+            [num_valid_boards, len(board.ROLLS), within_k_max_rolls]
+            with element [i, r, k - 1] the chosen next rank for k rolls
+            (-1 for the finished board).
+
+        Args:
+          progress: metrics.ProgressMetrics
+          table: successor_table.SuccessorTable or None to build one
+          objectives: names from OBJECTIVES
+          within_k_max_rolls: largest k for "within_k"
+          seed_store: DistributionStore whose boards are copied instead
+            of computed, see compute
+          checkpointer: Checkpointer whose boards are copied instead of
+            computed and which is checked after every level
+        """
+        self.distribution_map.clear()
+        if table is None:
+            with progress.phase(metrics.PHASE_MOVE_GENERATION):
+                table = successor_table.SuccessorTable.build(self.config)
+
+        progress.start("batched compute")
+
+        num_boards = self.config.num_valid_boards
+        # See _compute_parallel for this bound.
+        width = self.config.num_markers * self.config.num_spots // 2 + 2
+        dists = np.zeros([num_boards, width])
+        lengths = np.zeros(num_boards, dtype=np.int32)
+        expected_values = np.full(num_boards, np.nan)
+        # Rank 0 is the min_board_id, the finished board.
+        dists[0, 0] = 1
+        lengths[0] = 1
+        expected_values[0] = 0
+        progress.complete_one()
+        is_solved = np.zeros(num_boards, dtype=bool)
+        if seed_store:
+            (seed_ranks, seed_dists, seed_lengths,
+             seed_expected_values) = self._seed_arrays(seed_store)
+            dists[seed_ranks, :seed_dists.shape[1]] = seed_dists
+            lengths[seed_ranks] = seed_lengths
+            expected_values[seed_ranks] = seed_expected_values
+            is_solved[seed_ranks] = True
+        if checkpointer:
+            with progress.phase(metrics.PHASE_IO):
+                checkpoint = checkpointer.load(self.config)
+            for board_id, mcd in checkpoint.items():
+                rank = self.config.rank(board_id)
+                dists[rank, :len(mcd)] = mcd.dist
+                lengths[rank] = len(mcd)
+                expected_values[rank] = mcd.expected_value()
+                is_solved[rank] = True
+            # Saves the rows solved so far, which are those with a
+            # length, straight from the arrays.
+            checkpoint_store = DistributionStore(self.config)
+            checkpoint_store.distribution_map = (
+                DenseDistributionMap.from_arrays(self.config, dists, lengths,
+                                                 expected_values))
+
+        batch = board.BoardBatch.from_ids(self.config, self.config.valid_ids())
+        if "first_off" in objectives:
+            has_off = batch.spot_counts[:, 0] > 0
+            first_off = np.zeros([num_boards, width])
+            first_off[has_off, 0] = 1
+            first_off_lengths = has_off.astype(np.int32)
+            first_off_values = np.where(has_off, 0.0, np.nan)
+            first_off_policy = np.full([num_boards, len(board.ROLLS)], -1,
+                                       dtype=np.int32)
+        if "within_k" in objectives:
+            within = np.zeros([num_boards, within_k_max_rolls + 1])
+            within[0] = 1
+            within_policy = np.full(
+                [num_boards, len(board.ROLLS), within_k_max_rolls], -1,
+                dtype=np.int32)
+
+        total_pips = batch.total_pips()
+        for pips in range(1, int(np.max(total_pips)) + 1):
+            level_ranks = np.flatnonzero(total_pips == pips)
+            ranks = level_ranks[~is_solved[level_ranks]]
+            with progress.phase(metrics.PHASE_SUCCESSOR_LOOKUP):
+                successors = _gather_successors(_roll_entries(ranks), table)
+            with progress.phase(metrics.PHASE_DISTRIBUTION_ARITHMETIC):
+                _compute_block(ranks, table, dists, lengths, expected_values,
+                               successors)
+                if "first_off" in objectives:
+                    # Boards with a marker off are computed too, to keep
+                    # the shared successors, and then put back.
+                    best = _compute_block(ranks, table, first_off,
+                                          first_off_lengths, first_off_values,
+                                          successors)
+                    off_ranks = ranks[has_off[ranks]]
+                    first_off[off_ranks] = 0
+                    first_off[off_ranks, 0] = 1
+                    first_off_lengths[off_ranks] = 1
+                    first_off_values[off_ranks] = 0
+                    first_off_policy[ranks] = np.where(
+                        has_off[ranks, np.newaxis], -1, best)
+                if "within_k" in objectives:
+                    _compute_within_block(ranks, within, within_policy,
+                                          successors)
+            progress.complete_many(len(level_ranks))
+            if checkpointer and len(ranks):
+                with progress.phase(metrics.PHASE_IO):
+                    checkpointer.maybe_save(checkpoint_store,
+                                            progress.completed_objects)
+
+        if "first_off" in objectives:
+            self.objectives["first_off"] = np.ascontiguousarray(
+                first_off[:, :int(np.max(first_off_lengths))])
+            self.objectives["first_off_policy"] = first_off_policy
+        if "within_k" in objectives:
+            self.objectives["within_k"] = within
+            self.objectives["within_k_policy"] = within_policy
+
+        max_length = int(np.max(lengths))
+        if self.is_dense():
+            self.distribution_map = DenseDistributionMap.from_arrays(
+                self.config, np.ascontiguousarray(dists[:, :max_length]),
+                lengths, expected_values)
+        else:
+            for rank, board_id in enumerate(self.config.valid_ids().tolist()):
+                self.distribution_map[board_id] = MoveCountDistribution(
+                    dists[rank, :lengths[rank]].copy())
+
+    def _compute_parallel(self, progress, jobs, checkpointer, seed_store=None):
+        """Computes every board with a pool of jobs processes.
+
+        Every move lowers the total pips, so the boards with the same
+        total pips only depend on boards with fewer pips. We go through
+        the pip counts in increasing order and split the boards of each
+        one among the processes.
+
+        The distributions are shared through memory mapped files which
+        the workers read from and write their rows into, so nothing but
+        lists of ids is pickled. The arithmetic and the order of it is
+        the same as in the serial compute, so the results are
+        identical.
+
+        If given, checkpointer is checked after every level. The boards
+        of seed_store, if given, are copied in like those of a
+        checkpoint.
+
+        The workers' move generation is not timed separately, it is part
+        of the metrics.PHASE_DISTRIBUTION_ARITHMETIC time of the levels.
+        """
+        self.distribution_map.clear()
+        with progress.phase(metrics.PHASE_IO):
+            checkpoint = checkpointer.load(self.config) if checkpointer else {}
+        if seed_store:
+            checkpoint.update(self._seed_distributions(seed_store))
+
+        progress.start("compute with %d jobs" % jobs)
+
+        valid_ids = self.config.valid_ids()
+        total_pips = board.BoardBatch.from_ids(self.config,
+                                               valid_ids).total_pips()
+        # Every roll either finishes or moves at least 2 pips, so no
+        # distribution can be longer than this.
+        width = self.config.num_markers * self.config.num_spots // 2 + 2
+        num_boards = self.config.num_valid_boards
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            arrays = {}
+            for name, dtype, shape in _SHARED_COMPUTE_ARRAYS:
+                arrays[name] = np.memmap(
+                    os.path.join(tmpdir, name), dtype=dtype, mode="w+",
+                    shape=shape(num_boards, width))
+            arrays["expected_values"][:] = np.nan
+            shared_store = DistributionStore(self.config)
+            shared_store.distribution_map = DenseDistributionMap.from_arrays(
+                self.config, **arrays)
+            shared_store.distribution_map[self.config.min_board_id] = (
+                MoveCountDistribution([1]))
+            progress.complete_one()
+            shared_store.distribution_map.update(checkpoint)
+            for array in arrays.values():
+                array.flush()
+
+            with multiprocessing.Pool(
+                    jobs, initializer=_init_compute_worker,
+                    initargs=(self.config.num_markers, self.config.num_spots,
+                              tmpdir, width)) as pool:
+                # Level 0 is only the finished board
+                for pips in range(1, int(np.max(total_pips)) + 1):
+                    level_ids = valid_ids[total_pips == pips].tolist()
+                    num_solved = len(level_ids)
+                    level_ids = [board_id for board_id in level_ids
+                                 if board_id not in checkpoint]
+                    progress.complete_many(num_solved - len(level_ids))
+                    chunk_size = max(1, -(-len(level_ids) // (4 * jobs)))
+                    chunks = [level_ids[i:i + chunk_size]
+                              for i in range(0, len(level_ids), chunk_size)]
+                    level_start = time.perf_counter()
+                    for num_done in pool.imap_unordered(_compute_ids_worker,
+                                                        chunks):
+                        progress.complete_many(num_done)
+                    progress.add_phase_time(
+                        metrics.PHASE_DISTRIBUTION_ARITHMETIC,
+                        time.perf_counter() - level_start)
+                    if checkpointer and level_ids:
+                        with progress.phase(metrics.PHASE_IO):
+                            checkpointer.maybe_save(
+                                shared_store, progress.completed_objects)
+
+            # Copy out of the memory maps before the files go away.
+            for board_id in valid_ids.tolist():
+                self.distribution_map[board_id] = MoveCountDistribution(
+                    np.array(shared_store.distribution_map[board_id].dist))
+            del shared_store
+            del arrays
+
+    def get_or_compute(self, board_id, profiler=None):
+        """Returns the MoveCountDistribution for board_id, solving if needed.
+
+        Unlike compute, this only solves the boards reachable from
+        board_id, so it is usable for single positions of
+        configurations too big to compute fully.
+
+        Boards found in self.distribution_map are used as is. The
+        boards reachable from board_id are collected first and then
+        solved a total pip level at a time, from the bottom up. Only the
+        last levels that boards still to solve can reach are kept while
+        solving, so the memory used does not depend on the cache.
+        Solved boards are kept in a separate cache of at most
+        self.lazy_cache_size boards which drops the least recently used
+        ones. Later calls use the cached boards and solve the dropped
+        ones again if needed.
+
+        The results are identical to what compute produces.
+
+        Args:
+          board_id: valid board id
+          profiler: if given, a profiling.Profiler to record into
+
+        Return
+          MoveCountDistribution
+        """
+        if not self.config.is_valid_id(board_id):
+            raise ValueError("%d is not a valid board id" % board_id)
+        with _instrument(profiler):
+            return self._get_or_compute(int(board_id))[0]
+
+    def clear_lazy_cache(self):
+        """Removes all boards solved by get_or_compute."""
+        self._lazy_cache.clear()
+
+    def _find_solved(self, board_id):
+        """Returns (MoveCountDistribution, expected value) or None."""
+        if board_id in self.distribution_map:
+            return (self.distribution_map[board_id],
+                    self.expected_value(board_id))
+        cached = self._lazy_cache.get(board_id)
+        if cached is not None:
+            self._lazy_cache.move_to_end(board_id)
+            return cached
+        if board_id == self.config.min_board_id:
+            mcd = MoveCountDistribution([1])
+            return (mcd, mcd.expected_value())
+        return None
+
+    def _get_or_compute(self, board_id):
+        """Returns (MoveCountDistribution, expected value)."""
+        found = self._find_solved(board_id)
+        if found is not None:
+            return found
+
+        # Boards solved before this call, where the search stops
+        known = {}
+        unsolved = {board_id}
+        stack = [board_id]
+        while stack:
+            this_id = stack.pop()
+            for roll in board.ROLLS:
+                for _, next_id in self.config.generate_successor_ids(
+                        this_id, roll):
+                    if next_id in unsolved or next_id in known:
+                        continue
+                    found = self._find_solved(next_id)
+                    if found is not None:
+                        known[next_id] = found
+                    else:
+                        unsolved.add(next_id)
+                        stack.append(next_id)
+
+        ids = np.array(sorted(unsolved), dtype=np.int64)
+        del unsolved
+        total_pips = board.BoardBatch.from_ids(self.config, ids).total_pips()
+        order = np.argsort(total_pips, kind="stable")
+        level_pips, level_starts = np.unique(total_pips[order],
+                                             return_index=True)
+        levels = np.split(ids[order], level_starts[1:])
+
+        # Every next board has at most _MAX_PIPS_PER_ROLL fewer pips, so
+        # a level is dropped from solved once the level being solved is
+        # that far above it.
+        solved = dict(known)
+        kept_levels = collections.deque()
+        for pips, level_ids in zip(level_pips.tolist(), levels):
+            while (kept_levels and
+                   kept_levels[0][0] < pips - _MAX_PIPS_PER_ROLL):
+                for old_id in kept_levels.popleft()[1]:
+                    del solved[old_id]
+            level_ids = level_ids.tolist()
+            for this_id in level_ids:
+                result = self._solve_from(this_id, solved)
+                solved[this_id] = result
+                self._lazy_cache[this_id] = result
+                if len(self._lazy_cache) > self.lazy_cache_size:
+                    self._lazy_cache.popitem(last=False)
+            kept_levels.append((pips, level_ids))
+        # board_id has the most pips, so it is in the last level.
+        return solved[board_id]
+
+    def _solve_from(self, board_id, solved):
+        """Solves board_id from solved, a dict with all its next boards.
+
+        The same arithmetic in the same order as
+        _compute_move_distribution, with ties going to the first
+        generated board.
+
+        Return
+          (MoveCountDistribution, expected value)
+        """
+        mcd = MoveCountDistribution()
+        for roll in board.ROLLS:
+            best_mcd = None
+            best_ev = None
+            for _, next_id in self.config.generate_successor_ids(board_id,
+                                                                 roll):
+                next_mcd, next_ev = solved[next_id]
+                if best_mcd is None or next_ev < best_ev:
+                    best_mcd = next_mcd
+                    best_ev = next_ev
+            mcd += best_mcd.increase_counts(1) * roll.prob
+        assert mcd.is_normalized()
+        return (mcd, mcd.expected_value())
+
+    def compute_features(self):
+        """Computes and stores a features.FeatureTable for this store.
+
+        The table is saved and loaded with the store.
+
+        Return
+          features.FeatureTable
+        """
+        self.features = features.FeatureTable.build(self.config, self)
+        return self.features
+
     def pretty_string(self, limit=-1):
         num_printed = 0
         for board_id, dist in self.distribution_map.items():
@@ -233,19 +1272,514 @@ class DistributionStore(object):
             print(dist)
             print(this_board.pretty_string())
 
-    def save_hdf5(self, fileobj):
+    def reduce_precision(self, encoding, trim_threshold=0):
+        """Reduces the precision of the distributions in memory.
+
+        Only float encodings are supported in memory. Dense stores
+        change the dtype of the whole array, so float32 halves the
+        memory and float16 quarters it.
+
+        Args:
+          encoding: float key of ENCODINGS
+          trim_threshold: if > 0, probabilities below this are dropped
+            (see MoveCountDistribution.trim_low_prob)
+
+        Return
+          PrecisionReport, also stored in self.precision_report
+        """
+        if ENCODINGS[encoding][1] is not None:
+            raise ValueError("Fixed point encoding %s is only for files" %
+                             encoding)
+        exact_values = self.expected_values()
+        reduced = {}
+        for board_id, mcd in self.distribution_map.items():
+            reduced[board_id] = MoveCountDistribution(
+                encode_distribution(
+                    _trim_distribution(mcd, trim_threshold).dist, encoding))
+        if self.is_dense():
+            self.distribution_map = DenseDistributionMap(
+                self.config, dtype=ENCODINGS[encoding][0])
+        self.distribution_map.clear()
+        self.distribution_map.update(reduced)
+        self.precision_report = self._precision_report(
+            encoding, trim_threshold, exact_values)
+        return self.precision_report
+
+    def _precision_report(self, encoding, trim_threshold, exact_values):
+        """Compares the current distributions to exact_values.
+
+        Boards with an exact value but no distribution have lost all of
+        their mass.
+        """
+        max_mass_error = 0.0
+        for mcd in self.distribution_map.values():
+            max_mass_error = max(
+                max_mass_error,
+                abs(np.sum(mcd.dist, dtype=np.float64) - 1))
+        if self.ev_only_values is None and exact_values is not None:
+            present = np.zeros(self.config.num_valid_boards, dtype=bool)
+            ranks = self.config.rank_array(list(self.distribution_map))
+            present[ranks] = True
+            if np.any(~np.isnan(exact_values) & ~present):
+                max_mass_error = 1.0
+            value_errors = np.abs(self.expected_values() - exact_values)
+            max_expected_value_error = (
+                float(np.nanmax(value_errors))
+                if np.any(~np.isnan(value_errors)) else 0.0)
+        else:
+            max_expected_value_error = np.nan
+        return PrecisionReport(encoding, trim_threshold, float(max_mass_error),
+                               max_expected_value_error)
+
+    def save_hdf5(self, fileobj, encoding="float64", trim_threshold=0,
+                  format_version=FORMAT_VERSION, compress=True):
+        """Saves the store.
+
+        Format version 1 has one dataset per board in the group
+        "distribution_map", named by the board id. Version 2 has all
+        the distributions concatenated in the single dataset
+        "distributions/values" with per rank offsets. That avoids the
+        HDF5 overhead of a dataset per board, which dominates the time
+        and size of version 1 files. load_hdf5 reads both.
+
+        Args:
+          fileobj: file name or file like object
+          encoding: key of ENCODINGS for the distributions
+          trim_threshold: if > 0, probabilities below this are dropped
+            (see MoveCountDistribution.trim_low_prob)
+          format_version: 1 or 2
+          compress: for version 2, whether to gzip the distributions.
+            Uncompressed files are bigger but can be memory mapped by
+            mapped_store.MappedDistributionStore.
+        """
+        lossy = encoding != "float64" or trim_threshold > 0
         with h5py.File(fileobj, "w") as f:
-            dist_map_grp = f.create_group("distribution_map")
-            for board_id, mcd in self.distribution_map.items():
-                #print(mcd)
-                dist_map_grp.create_dataset(str(board_id), data=mcd.dist)
+            f.attrs["format_version"] = format_version
+            if format_version == 1:
+                self._save_distribution_map_v1(f, encoding, trim_threshold)
+            elif format_version == 2:
+                self._save_distributions_v2(f, encoding, trim_threshold,
+                                            compress)
+            else:
+                raise ValueError("Unknown format version %d" % format_version)
+            if lossy and self.ev_only_values is None:
+                # Lets load_hdf5 report the error in expected values.
+                f.create_dataset("exact_expected_values",
+                                 data=self.expected_values())
             self.config.save_into_hdf5(f.create_group("config"))
+            if self.features is not None:
+                self.features.save_into_hdf5(f.create_group("features"))
+            if self.ev_only_values is not None:
+                f.create_dataset("ev_only_values", data=self.ev_only_values)
+            if self.objectives:
+                objectives_grp = f.create_group("objectives")
+                for name, data in self.objectives.items():
+                    objectives_grp.create_dataset(name, data=data)
 
-    def load_hdf5(fileobj):
+    def _save_distribution_map_v1(self, f, encoding, trim_threshold):
+        dist_map_grp = f.create_group("distribution_map")
+        dist_map_grp.attrs["encoding"] = encoding
+        dist_map_grp.attrs["trim_threshold"] = trim_threshold
+        for board_id, mcd in self.distribution_map.items():
+            #print(mcd)
+            dist_map_grp.create_dataset(
+                str(board_id),
+                data=encode_distribution(
+                    _trim_distribution(mcd, trim_threshold).dist,
+                    encoding))
+
+    def _save_distributions_v2(self, f, encoding, trim_threshold, compress):
+        """Saves the distributions as one ragged array.
+
+        For the board with rank r, the distribution has lengths[r]
+        elements (0 if the board is not in the store), of which the
+        first leading_zeros[r] are 0 and the rest are
+        values[offsets[r]:offsets[r + 1]].
+        """
+        num_boards = self.config.num_valid_boards
+        lengths = np.zeros(num_boards, dtype=np.int32)
+        leading_zeros = np.zeros(num_boards, dtype=np.int32)
+        stored = {}
+        for board_id, mcd in self.distribution_map.items():
+            dist = np.asarray(_trim_distribution(mcd, trim_threshold).dist)
+            rank = self.config.rank(board_id)
+            nonzero = np.flatnonzero(dist)
+            leading = nonzero[0] if len(nonzero) else len(dist)
+            lengths[rank] = len(dist)
+            leading_zeros[rank] = leading
+            stored[rank] = dist[leading:]
+        offsets = np.zeros(num_boards + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths - leading_zeros)
+        if stored:
+            values = np.concatenate([stored[rank] for rank in sorted(stored)])
+        else:
+            values = np.zeros(0)
+
+        grp = f.create_group("distributions")
+        grp.attrs["encoding"] = encoding
+        grp.attrs["trim_threshold"] = trim_threshold
+        # Chunking is required for compression but fails for empty data.
+        if compress and len(values):
+            compression = {"chunks": True, "compression": "gzip"}
+        else:
+            compression = {}
+        grp.create_dataset("values",
+                           data=encode_distribution(values, encoding),
+                           **compression)
+        for name, data in [("offsets", offsets), ("lengths", lengths),
+                           ("leading_zeros", leading_zeros)]:
+            grp.create_dataset(name, data=data, **compression)
+
+    def load_hdf5(fileobj, dense=False):
         with h5py.File(fileobj, "r") as f:
             store = DistributionStore(
-                board.GameConfiguration.load_from_hdf5(f["config"]))
-            for board_id, arr in f["distribution_map"].items():
-                store.distribution_map[int(board_id)] = (
-                    MoveCountDistribution(arr))
+                board.GameConfiguration.load_from_hdf5(f["config"]),
+                dense=dense)
+            if "distributions" in f:
+                dist_grp = f["distributions"]
+                store._load_distributions_v2(dist_grp)
+            else:
+                dist_grp = f["distribution_map"]
+                encoding = dist_grp.attrs.get("encoding", "float64")
+                for board_id, arr in dist_grp.items():
+                    store.distribution_map[int(board_id)] = (
+                        MoveCountDistribution(
+                            decode_distribution(arr, encoding)))
+            if "features" in f:
+                store.features = features.FeatureTable.load_from_hdf5(
+                    store.config, f["features"])
+            if "ev_only_values" in f:
+                store.ev_only_values = f["ev_only_values"][:]
+            if "objectives" in f:
+                store.objectives = {name: arr[:] for name, arr in
+                                    f["objectives"].items()}
+            if "exact_expected_values" in f:
+                store.precision_report = store._precision_report(
+                    dist_grp.attrs.get("encoding", "float64"),
+                    dist_grp.attrs.get("trim_threshold", 0),
+                    f["exact_expected_values"][:])
         return store
+
+    def _load_distributions_v2(self, grp):
+        values = decode_distribution(grp["values"][:],
+                                     grp.attrs["encoding"])
+        offsets = grp["offsets"][:]
+        lengths = grp["lengths"][:]
+        leading_zeros = grp["leading_zeros"][:]
+        valid_ids = self.config.valid_ids()
+        for rank in np.flatnonzero(lengths).tolist():
+            dist = np.zeros(lengths[rank])
+            dist[leading_zeros[rank]:] = values[offsets[rank]:offsets[rank + 1]]
+            self.distribution_map[int(valid_ids[rank])] = (
+                MoveCountDistribution(dist))
+
+
+class BatchQuery(object):
+    """Answers queries about arrays of boards with array operations.
+
+    The expected values and distributions are copied out of the store
+    once, so the Python overhead is per call rather than per board.
+    The answers are the same as the per board methods of
+    DistributionStore.
+
+    gnubg position ids can be converted with
+    gnubg_interface.gnubg_id_strs_to_board_ids.
+
+    Attributes:
+      config: board.GameConfiguration
+      table: successor_table.SuccessorTable
+    """
+
+    def __init__(self, store, table=None):
+        """Creates the query arrays for store.
+
+        Args:
+          store: DistributionStore
+          table: successor_table.SuccessorTable for store.config, built
+            if not given
+        """
+        self.config = store.config
+        if table is None:
+            table = successor_table.SuccessorTable.build(self.config)
+        self.table = table
+        self._expected_values = store.expected_values()
+        self._dists, self._lengths = store.distribution_arrays()
+
+    def best_next_ids(self, board_ids, roll_idxs):
+        """Chooses the best next board for each board and roll.
+
+        Same as DistributionStore.compute_best_next_id on the boards
+        generated for board.ROLLS[roll_idx].
+
+        Args:
+          board_ids: array like of valid board ids
+          roll_idxs: array like of indices into board.ROLLS, broadcast
+            against board_ids
+
+        Return
+          np array of int64 board ids with the broadcast shape
+        """
+        ranks, roll_idxs = np.broadcast_arrays(
+            self.config.rank_array(board_ids),
+            np.asarray(roll_idxs, dtype=np.int64))
+        if np.any((roll_idxs < 0) | (roll_idxs >= len(board.ROLLS))):
+            raise ValueError("Roll indices must be in [0, %d)" %
+                             len(board.ROLLS))
+        if ranks.size == 0:
+            return np.zeros(ranks.shape, dtype=np.int64)
+        entries = (ranks * len(board.ROLLS) + roll_idxs).reshape(-1)
+        best_ranks = _choose_best_entries(entries, self.table,
+                                          self._expected_values)
+        return self.config.unrank_array(best_ranks).reshape(ranks.shape)
+
+    def expected_values(self, board_ids):
+        """Returns np array of float64 expected values for board_ids.
+
+        NaN for boards not in the store.
+        """
+        return self._expected_values[self.config.rank_array(board_ids)]
+
+    def distributions(self, board_ids):
+        """Returns the MoveCountDistribution dists for board_ids.
+
+        Args:
+          board_ids: 1D array like of valid board ids
+
+        Return
+          2D np array, [len(board_ids), longest distribution], rows
+          padded with zeros
+        """
+        ranks = self.config.rank_array(board_ids)
+        lengths = self._lengths[ranks]
+        if np.any(lengths == 0):
+            raise ValueError("Board %d has no distribution in the store" %
+                             np.asarray(board_ids)[lengths == 0][0])
+        width = int(np.max(lengths)) if len(lengths) else 0
+        return np.array(self._dists[ranks, :width], dtype=np.float64)
+
+
+def _instrument(profiler):
+    """Returns profiler.instrument() or a no-op context if profiler is None."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.instrument()
+
+
+def _trim_distribution(mcd, trim_threshold):
+    """Trims mcd for storing, always keeping its largest probability.
+
+    A distribution trimmed to nothing would be stored with length 0,
+    which means the board is not in the store.
+    """
+    if trim_threshold <= 0:
+        return mcd
+    trimmed = mcd.trim_low_prob(trim_threshold)
+    if len(trimmed) == 0 and len(mcd) > 0:
+        largest = int(np.argmax(mcd.dist))
+        dist = np.zeros(largest + 1)
+        dist[largest] = mcd.dist[largest]
+        trimmed = MoveCountDistribution(dist)
+    return trimmed
+
+
+_ROLL_PROBS = np.array([roll.prob for roll in board.ROLLS])
+
+# Most pips any roll moves. Doubles have all 4 dice in roll.dice.
+_MAX_PIPS_PER_ROLL = max(sum(roll.dice) for roll in board.ROLLS)
+
+
+# The next boards of many table entries in one flat array. The next
+# boards of entry i are next_ranks[segment_starts[i]:][:counts[i]].
+_Successors = collections.namedtuple(
+    "_Successors", ["next_ranks", "segment_starts", "counts"])
+
+
+def _gather_successors(entries, table):
+    """Returns _Successors for entries.
+
+    Args:
+      entries: np array of rank * len(board.ROLLS) + roll index
+      table: successor_table.SuccessorTable
+    """
+    starts = table.offsets[entries]
+    counts = table.offsets[entries + 1] - starts
+    segment_starts = np.cumsum(counts) - counts
+    positions = np.arange(int(np.sum(counts)))
+    next_ranks = table.successors[
+        np.repeat(starts - segment_starts, counts) + positions]
+    return _Successors(next_ranks, segment_starts, counts)
+
+
+def _roll_entries(ranks):
+    """Returns the table entries for every roll of ranks, rank major."""
+    return (ranks[:, np.newaxis] * len(board.ROLLS) +
+            np.arange(len(board.ROLLS))).reshape(-1)
+
+
+def _first_in_segments(is_best, successors):
+    """Returns the next ranks of the first True in every segment.
+
+    Args:
+      is_best: np array of bool aligned with successors.next_ranks,
+        optionally with more axes after the first
+      successors: _Successors
+
+    Returns:
+      np array of ranks with shape [num segments] + is_best.shape[1:]
+    """
+    total = len(successors.next_ranks)
+    positions = np.arange(total).reshape((total,) + (1,) * (is_best.ndim - 1))
+    first = np.minimum.reduceat(np.where(is_best, positions, total),
+                                successors.segment_starts)
+    return successors.next_ranks[first]
+
+
+def _choose_best_successors(ranks, table, expected_values, successors=None):
+    """Chooses the next board with the lowest expected value for each roll.
+
+    Ties go to the first next board in table, the same as
+    DistributionStore.compute_best_next_id.
+
+    Args:
+      ranks: np array of board ranks
+      table: successor_table.SuccessorTable
+      expected_values: np array aligned with rank, must be set for
+        all next boards
+      successors: _Successors for _roll_entries(ranks), gathered if
+        not given
+
+    Returns:
+      2D np array of ranks, [len(ranks), len(board.ROLLS)]
+    """
+    return _choose_best_entries(
+        _roll_entries(ranks), table, expected_values, successors).reshape(
+            len(ranks), len(board.ROLLS))
+
+
+def _choose_best_entries(entries, table, expected_values, successors=None):
+    """Like _choose_best_successors for a flat array of table entries.
+
+    Args:
+      entries: np array of rank * len(board.ROLLS) + roll index
+      table: successor_table.SuccessorTable
+      expected_values: np array aligned with rank, must be set for
+        all next boards
+      successors: _Successors for entries, gathered if not given
+
+    Returns:
+      np array of ranks, same length as entries
+    """
+    if successors is None:
+        successors = _gather_successors(entries, table)
+    next_values = expected_values[successors.next_ranks]
+    if np.any(np.isnan(next_values)):
+        raise ValueError(
+            "Next board %d has no expected value" %
+            table.config.unrank(
+                int(successors.next_ranks[np.isnan(next_values)][0])))
+    segment_min = np.minimum.reduceat(next_values, successors.segment_starts)
+    return _first_in_segments(
+        next_values == np.repeat(segment_min, successors.counts), successors)
+
+
+def _compute_block(ranks, table, dists, lengths, expected_values,
+                   successors=None):
+    """Computes the distributions for a block of boards.
+
+    All the next boards of the block must already be computed. The
+    results are written into rows ranks of dists, lengths and
+    expected_values.
+
+    This does the same floating point operations in the same order as
+    DistributionStore._compute_move_distribution, just for many boards
+    at once, so the results are identical. That is also why the
+    expected values are summed per distribution length rather than over
+    the padded rows.
+
+    Args:
+      ranks: np array of board ranks
+      table: successor_table.SuccessorTable
+      dists: 2D np array of float64, rows aligned with rank
+      lengths: np array of int32 aligned with rank
+      expected_values: np array of float64 aligned with rank
+      successors: _Successors for _roll_entries(ranks), gathered if
+        not given
+
+    Returns:
+      2D np array of the chosen next ranks, [len(ranks), len(board.ROLLS)]
+    """
+    best = _choose_best_successors(ranks, table, expected_values, successors)
+    out = np.zeros([len(ranks), dists.shape[1]])
+    for roll_idx in range(len(board.ROLLS)):
+        out[:, 1:] += dists[best[:, roll_idx], :-1] * _ROLL_PROBS[roll_idx]
+    block_lengths = 1 + np.max(lengths[best], axis=1)
+    assert np.allclose(np.sum(out, axis=1), 1)
+
+    dists[ranks] = out
+    lengths[ranks] = block_lengths
+    for length in np.unique(block_lengths):
+        in_length = block_lengths == length
+        expected_values[ranks[in_length]] = np.sum(
+            out[in_length, :length] * np.arange(length), axis=1)
+    return best
+
+
+def _compute_within_block(ranks, within, policy, successors):
+    """Computes P(finish within k rolls) for a block of boards.
+
+    For each k, the next board chosen for a roll is the one with the
+    highest P(finish within k - 1 rolls), ties going to the first.
+
+    Args:
+      ranks: np array of board ranks, not including the finished board
+      within: 2D np array of float64, [num_valid_boards, max_rolls + 1],
+        element [i, k] is P(board with rank i finishes within k rolls)
+      policy: 3D np array of int32, [num_valid_boards, len(board.ROLLS),
+        max_rolls], element [i, r, k - 1] is the chosen next rank for
+        k rolls
+      successors: _Successors for _roll_entries(ranks)
+    """
+    next_values = within[successors.next_ranks, :-1]
+    segment_max = np.maximum.reduceat(next_values, successors.segment_starts)
+    best = _first_in_segments(
+        next_values == np.repeat(segment_max, successors.counts, axis=0),
+        successors)
+    segment_max = segment_max.reshape(len(ranks), len(board.ROLLS), -1)
+    total = np.zeros([len(ranks), within.shape[1] - 1])
+    for roll_idx in range(len(board.ROLLS)):
+        total += segment_max[:, roll_idx] * _ROLL_PROBS[roll_idx]
+    within[ranks, 0] = 0
+    within[ranks, 1:] = total
+    policy[ranks] = best.reshape(len(ranks), len(board.ROLLS), -1)
+
+
+# (name, dtype, shape function of (num_boards, width)) for the memory
+# mapped arrays shared by DistributionStore._compute_parallel
+_SHARED_COMPUTE_ARRAYS = [
+    ("dists", np.float64, lambda num_boards, width: (num_boards, width)),
+    ("lengths", np.int32, lambda num_boards, width: (num_boards,)),
+    ("expected_values", np.float64, lambda num_boards, width: (num_boards,)),
+]
+
+# Set in each worker process by _init_compute_worker
+_worker_store = None
+
+
+def _init_compute_worker(num_markers, num_spots, tmpdir, width):
+    global _worker_store
+    config = board.GameConfiguration(num_markers, num_spots)
+    arrays = {}
+    for name, dtype, shape in _SHARED_COMPUTE_ARRAYS:
+        arrays[name] = np.memmap(
+            os.path.join(tmpdir, name), dtype=dtype, mode="r+",
+            shape=shape(config.num_valid_boards, width))
+    _worker_store = DistributionStore(config)
+    _worker_store.distribution_map = DenseDistributionMap.from_arrays(
+        config, **arrays)
+
+
+def _compute_ids_worker(board_ids):
+    for board_id in board_ids:
+        _worker_store.distribution_map[board_id] = (
+            _worker_store.compute_move_distribution_for_id(board_id))
+    return len(board_ids)
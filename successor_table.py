@@ -0,0 +1,136 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module contains a precomputed table of the boards reachable
+# from every board with every roll, so that move generation only has
+# to be done once per GameConfiguration.
+
+import array
+import h5py
+import numpy as np
+import os
+
+import board
+import metrics
+
+
+class SuccessorTable(object):
+    """Stores the distinct next boards for every (board, roll).
+
+    The table is stored CSR style. The entry for the board with rank r
+    and roll board.ROLLS[i] is index e = r * len(board.ROLLS) + i and the
+    ranks of the next boards are successors[offsets[e]:offsets[e + 1]].
+    The next boards are in the order they are generated by
+    GameConfiguration.generate_successor_ids.
+
+    Attributes:
+      config: board.GameConfiguration
+      offsets: np array of int64, size num_valid_boards * len(ROLLS) + 1
+      successors: np array of int32 ranks of next boards
+    """
+
+    def __init__(self, config, offsets, successors):
+        self.config = config
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.successors = np.asarray(successors, dtype=np.int32)
+        expected_size = config.num_valid_boards * len(board.ROLLS) + 1
+        if self.offsets.shape != (expected_size,):
+            raise ValueError("Bad offsets shape %s, expected (%d,)" %
+                             (self.offsets.shape, expected_size))
+        if self.offsets[-1] != self.successors.shape[0]:
+            raise ValueError("Offsets end at %d but there are %d successors" %
+                             (self.offsets[-1], self.successors.shape[0]))
+
+    def build(config, progress_interval=0):
+        """Generates the moves for every board and roll.
+
+        Args:
+          config: board.GameConfiguration
+          progress_interval: passed to metrics.ProgressMetrics
+
+        Returns:
+          SuccessorTable
+        """
+        progress = metrics.ProgressMetrics(config.num_valid_boards,
+                                           progress_interval)
+        offsets = np.zeros(config.num_valid_boards * len(board.ROLLS) + 1,
+                           dtype=np.int64)
+        # Ranked a board at a time into a compact array, so there are
+        # never more than one board's worth of Python ints around.
+        successors = array.array("i")
+        entry = 0
+        for board_id in config.valid_ids().tolist():
+            next_ids = []
+            for roll in board.ROLLS:
+                for _, next_id in config.generate_successor_ids(board_id,
+                                                                roll):
+                    next_ids.append(next_id)
+                entry += 1
+                offsets[entry] = len(successors) + len(next_ids)
+            successors.frombytes(
+                config.rank_array(next_ids).astype(np.int32).tobytes())
+            progress.complete_one()
+
+        return SuccessorTable(config, offsets,
+                              np.frombuffer(successors, dtype=np.int32))
+
+    def successor_ranks(self, rank, roll_idx):
+        """Returns np array of the ranks of the next boards."""
+        entry = rank * len(board.ROLLS) + roll_idx
+        return self.successors[self.offsets[entry]:self.offsets[entry + 1]]
+
+    def successor_ids(self, board_id, roll_idx):
+        """Returns np array of the ids of the next boards."""
+        return self.config.valid_ids()[
+            self.successor_ranks(self.config.rank(board_id), roll_idx)]
+
+    def save_hdf5(self, fileobj):
+        with h5py.File(fileobj, "w") as f:
+            table_grp = f.create_group("successor_table")
+            table_grp.create_dataset("offsets", data=self.offsets)
+            table_grp.create_dataset("successors", data=self.successors)
+            self.config.save_into_hdf5(f.create_group("config"))
+
+    def load_hdf5(fileobj):
+        with h5py.File(fileobj, "r") as f:
+            return SuccessorTable(
+                board.GameConfiguration.load_from_hdf5(f["config"]),
+                f["successor_table"]["offsets"][:],
+                f["successor_table"]["successors"][:])
+
+
+def load_or_build(config, fn, progress_interval=0):
+    """Loads the table from fn, building and saving it if it does not exist.
+
+    Args:
+      config: board.GameConfiguration
+      fn: file name for the table
+      progress_interval: passed to SuccessorTable.build
+
+    Returns:
+      SuccessorTable
+    """
+    if os.path.exists(fn):
+        table = SuccessorTable.load_hdf5(fn)
+        if (table.config.num_markers != config.num_markers or
+            table.config.num_spots != config.num_spots):
+            raise ValueError("Table in %s is for %dx%d, expected %dx%d" % (
+                fn, table.config.num_markers, table.config.num_spots,
+                config.num_markers, config.num_spots))
+        # Use the caller's config so that lookups share its caches.
+        table.config = config
+        return table
+    table = SuccessorTable.build(config, progress_interval)
+    table.save_hdf5(fn)
+    return table
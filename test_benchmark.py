@@ -0,0 +1,75 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import json
+import unittest
+import unittest.mock
+
+import benchmark
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_benchmark_config(self):
+        results = benchmark.benchmark_config(3, 3, repeat=1)
+        self.assertIn("successor_table_seconds", results)
+        self.assertIn("batch_query_seconds", results)
+        self.assertIn("successor_lookup_seconds", results)
+        for name in ["compute_seconds", "from_id_seconds", "get_id_seconds",
+                     "generate_moves_seconds", "evaluate_board_seconds",
+                     "best_moves_query_seconds", "save_seconds",
+                     "load_seconds", "save_v1_seconds", "load_v1_seconds"]:
+            self.assertGreater(results[name], 0, msg=name)
+
+    def test_benchmark_config_partial(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = benchmark.benchmark_config(3, 3, limit=10, repeat=1)
+        self.assertNotIn("successor_table_seconds", results)
+        self.assertNotIn("batch_query_seconds", results)
+        self.assertNotIn("successor_lookup_seconds", results)
+        self.assertGreater(results["compute_seconds"], 0)
+
+    def test_run_is_json(self):
+        with unittest.mock.patch.dict(benchmark.CONFIGS,
+                                      {"tiny": (3, 2, 0)}):
+            with contextlib.redirect_stdout(io.StringIO()):
+                output = benchmark.run(["tiny"], repeat=1)
+        self.assertEqual(list(output["results"]), ["tiny"])
+        self.assertEqual(json.loads(json.dumps(output)), output)
+
+    def test_check_expectations(self):
+        output = {"results": {
+            "fast": {"successor_lookup_seconds": 1.0,
+                     "generate_moves_seconds": 2.0},
+            "slow": {"successor_lookup_seconds": 2.0,
+                     "generate_moves_seconds": 1.0},
+            "partial": {"generate_moves_seconds": 1.0}}}
+        failures = benchmark.check_expectations(output)
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].startswith("slow:"))
+
+    def test_compare(self):
+        baseline = {"results": {"a": {"x": 1.0, "y": 1.0, "old": 1.0},
+                                "b": {"x": 1.0}}}
+        current = {"results": {"a": {"x": 1.1, "y": 1.5, "new": 1.0},
+                               "c": {"x": 5.0}}}
+        self.assertEqual(
+            benchmark.compare(current, baseline, tolerance=0.2),
+            [("a", "x", 1.0, 1.1, False), ("a", "y", 1.0, 1.5, True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,9 @@
 # limitations under the License.
 
 import array
+import numpy as np
 import unittest
+import unittest.mock
 from parameterized import parameterized
 
 import board
@@ -51,6 +53,27 @@ class GameConfigurationTestCase(unittest.TestCase):
                          sum(1 for _ in config.generate_valid_ids()))
 
 
+    @parameterized.expand([
+        (5, 3),
+        (10, 5),
+        (1, 4),
+        (4, 1),
+    ])
+    def test_valid_ids(self, num_markers, num_spots):
+        config = board.GameConfiguration(num_markers, num_spots)
+        expected = [idx for idx in range(config.min_board_id,
+                                         config.max_board_id)
+                    if config.is_valid_id(idx)]
+        np.testing.assert_array_equal(config.valid_ids(), expected)
+
+    def test_valid_ids_large(self):
+        config = board.GameConfiguration(15, 10)
+        ids = config.valid_ids()
+        self.assertEqual(len(ids), config.num_valid_boards)
+        self.assertEqual(ids[0], config.min_board_id)
+        self.assertEqual(ids[-1], config.max_board_id - 1)
+        self.assertTrue(np.all(np.diff(ids) > 0))
+
     @parameterized.expand([
         (5, 3),
         (10, 5),
@@ -77,6 +100,150 @@ class GameConfigurationTestCase(unittest.TestCase):
 
             board_id = next_board_id
 
+    @parameterized.expand([
+        (5, 3),
+        (10, 5),
+        (3, 8),
+    ])
+    def test_rank_unrank(self, num_markers, num_spots):
+        config = board.GameConfiguration(num_markers, num_spots)
+        for expected_rank, board_id in enumerate(config.generate_valid_ids()):
+            self.assertEqual(config.rank(board_id), expected_rank)
+            self.assertEqual(config.unrank(expected_rank), board_id)
+
+    @parameterized.expand([
+        (5, 3),
+        (10, 5),
+    ])
+    def test_rank_unrank_array(self, num_markers, num_spots):
+        config = board.GameConfiguration(num_markers, num_spots)
+        # Before and after valid_ids is computed, which it then uses.
+        unranked = config.unrank_array(np.arange(config.num_valid_boards))
+        ids = list(config.generate_valid_ids())
+        np.testing.assert_array_equal(unranked, ids)
+        np.testing.assert_array_equal(
+            config.unrank_array(np.arange(config.num_valid_boards)), ids)
+        np.testing.assert_array_equal(
+            config.rank_array(ids), np.arange(config.num_valid_boards))
+
+    def test_rank_without_lookup(self):
+        config = board.GameConfiguration(5, 3)
+        with unittest.mock.patch.object(board, "RANK_LOOKUP_MAX_IDS", 0):
+            ids = list(config.generate_valid_ids())
+            self.assertEqual([config.rank(i) for i in ids],
+                             list(range(config.num_valid_boards)))
+            np.testing.assert_array_equal(
+                config.rank_array(ids), np.arange(config.num_valid_boards))
+            with self.assertRaises(ValueError):
+                config.rank_array([config.min_board_id + 1])
+
+    def test_numpy_ids_without_lookup(self):
+        config = board.GameConfiguration(5, 3)
+        ids = config.valid_ids()
+        with unittest.mock.patch.object(board, "RANK_LOOKUP_MAX_IDS", 0):
+            for rank, board_id in enumerate(ids):
+                self.assertIsInstance(board_id, np.int64)
+                self.assertTrue(config.is_valid_id(board_id))
+                self.assertEqual(config.rank(board_id), rank)
+            self.assertFalse(config.is_valid_id(np.int64(ids[1] + 1)))
+            with self.assertRaises(ValueError):
+                config.rank(np.int64(ids[1] + 1))
+
+    def test_rank_errors(self):
+        config = board.GameConfiguration(3, 2)
+        with self.assertRaises(ValueError):
+            config.rank(8)
+        with self.assertRaises(ValueError):
+            config.rank(1 << 10)
+        with self.assertRaises(ValueError):
+            config.rank_array([7, 8])
+        with self.assertRaises(ValueError):
+            config.unrank(10)
+        with self.assertRaises(ValueError):
+            config.unrank_array([0, -1])
+
+    @parameterized.expand([
+        (3, 2, 3, 2),
+        (3, 2, 4, 3),
+        (2, 4, 5, 4),
+        (4, 3, 4, 6),
+    ])
+    def test_embed_ids(self, small_markers, small_spots, num_markers,
+                       num_spots):
+        small = board.GameConfiguration(small_markers, small_spots)
+        config = board.GameConfiguration(num_markers, num_spots)
+        self.assertTrue(config.contains_config(small))
+        embedded = config.embed_ids(small, small.valid_ids())
+        for board_id, embedded_id in zip(small.valid_ids().tolist(),
+                                         embedded.tolist()):
+            spot_counts = board.Board.from_id(small, board_id).spot_counts
+            expected = list(spot_counts) + [0] * (num_spots - small_spots)
+            expected[0] += num_markers - small_markers
+            self.assertEqual(board.Board(config, expected).get_id(),
+                             embedded_id)
+
+    def test_embed_ids_errors(self):
+        config = board.GameConfiguration(4, 3)
+        for other in [board.GameConfiguration(5, 3),
+                      board.GameConfiguration(4, 4)]:
+            self.assertFalse(config.contains_config(other))
+            with self.assertRaises(ValueError):
+                config.embed_ids(other, other.valid_ids())
+
+    def test_apply_move_id(self):
+        config = board.GameConfiguration(6, 2)
+        b = board.Board(config, [1, 2, 3])
+        for move in [board.Move(2, 6), board.Move(2, 1), board.Move(1, 1),
+                     board.Move(2, 2), board.Move(1, 1)]:
+            self.assertEqual(config.apply_move_id(b.get_id(), *move),
+                             b.apply_move(move).get_id(), str(move))
+
+    def test_apply_move_id_errors(self):
+        config = board.GameConfiguration(6, 2)
+        with self.assertRaisesRegex(ValueError, "Invalid spot"):
+            config.apply_move_id(
+                board.Board(config, [1, 2, 3]).get_id(), 0, 6)
+        with self.assertRaisesRegex(ValueError, "No marker"):
+            config.apply_move_id(
+                board.Board(config, [3, 0, 3]).get_id(), 1, 1)
+        with self.assertRaisesRegex(ValueError, "Overflow count"):
+            config.apply_move_id(
+                board.Board(config, [1, 2, 3]).get_id(), 1, 6)
+
+    @parameterized.expand([
+        (5, 3),
+        (4, 6),
+    ])
+    def test_apply_move_id_all(self, num_markers, num_spots):
+        config = board.GameConfiguration(num_markers, num_spots)
+        for board_id in config.generate_valid_ids():
+            b = board.Board.from_id(config, board_id)
+            for spot in range(1, num_spots + 1):
+                for die in range(1, 7):
+                    try:
+                        expected = b.apply_move(board.Move(spot, die)).get_id()
+                    except ValueError:
+                        with self.assertRaises(ValueError):
+                            config.apply_move_id(board_id, spot, die)
+                        continue
+                    self.assertEqual(
+                        config.apply_move_id(board_id, spot, die), expected)
+
+    @parameterized.expand([
+        (5, 3),
+        (4, 6),
+    ])
+    def test_generate_successor_ids(self, num_markers, num_spots):
+        config = board.GameConfiguration(num_markers, num_spots)
+        for board_id in config.generate_valid_ids():
+            b = board.Board.from_id(config, board_id)
+            for roll in board.ROLLS:
+                expected = [(moves, next_board.get_id())
+                            for moves, next_board in b.generate_successors(roll)]
+                self.assertEqual(
+                    list(config.generate_successor_ids(board_id, roll)),
+                    expected)
+
     def rolls_sum_to_one(self):
         sum = 0
         for _, prob in board.ROLLS:
@@ -275,6 +442,144 @@ class BoardTestCase(unittest.TestCase):
                 print("%s with moves %s" % (roll, moves))
                 raise e
 
+    def test_generate_successors_four_dice(self):
+        config = board.GameConfiguration(9, 4)
+        b = board.Board(config, [0, 0, 3, 3, 3])
+        roll = board.Roll(dice=[2, 2, 2, 2], prob=0)
+        got = list(b.generate_successors(roll))
+        got_ids = [next_board.get_id() for _, next_board in got]
+        self.assertEqual(len(got_ids), len(set(got_ids)))
+        self.assertEqual(set(got_ids),
+                         {b.apply_moves(moves).get_id()
+                          for moves in b.generate_moves(roll)})
+        for moves, next_board in got:
+            self.assertEqual(b.apply_moves(moves), next_board)
+            spots = [m.spot for m in moves]
+            self.assertEqual(spots, sorted(spots, reverse=True))
+
+    @parameterized.expand([
+        (5, 3),
+        (4, 6),
+    ])
+    def test_generate_successors_matches_generate_moves(self, num_markers,
+                                                        num_spots):
+        config = board.GameConfiguration(num_markers, num_spots)
+        for board_id in config.generate_valid_ids():
+            b = board.Board.from_id(config, board_id)
+            for roll in board.ROLLS:
+                # dict rather than set to also check the order
+                expected = {}
+                for moves in b.generate_moves(roll):
+                    expected[b.apply_moves(moves).get_id()] = None
+                got = []
+                for moves, next_board in b.generate_successors(roll):
+                    self.assertEqual(b.apply_moves(moves), next_board)
+                    got.append(next_board.get_id())
+                self.assertEqual(got, list(expected), "%s %s" % (b, roll))
+
+
+class BoardCacheTestCase(unittest.TestCase):
+
+    def test_from_id_uses_cache(self):
+        config = board.GameConfiguration(6, 2)
+        cache = config.enable_board_cache(max_size=2)
+        b1 = board.Board.from_id(config, 0xED)
+        b2 = board.Board.from_id(config, 0xED)
+        self.assertIs(b1, b2)
+        self.assertEqual(list(b1.spot_counts), [1, 2, 3])
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        config.disable_board_cache()
+        self.assertIsNot(board.Board.from_id(config, 0xED), b1)
+
+    def test_eviction(self):
+        config = board.GameConfiguration(6, 2)
+        cache = config.enable_board_cache(max_size=2)
+        board.Board.from_id(config, 0xED)
+        board.Board.from_id(config, 0x3F)
+        board.Board.from_id(config, 0xED)
+        # 0x3F is now the least recently used
+        board.Board.from_id(config, 0x7E)
+        self.assertEqual(len(cache), 2)
+        board.Board.from_id(config, 0xED)
+        self.assertEqual(cache.hits, 2)
+        board.Board.from_id(config, 0x3F)
+        self.assertEqual(cache.misses, 4)
+
+    def test_shared_boards_are_immutable(self):
+        config = board.GameConfiguration(6, 2)
+        config.enable_board_cache()
+        b = board.Board.from_id(config, 0xED)
+        with self.assertRaises(TypeError):
+            b.spot_counts[0] = 2
+        self.assertEqual(b.apply_move(board.Move(2, 1)),
+                         board.Board(config, [1, 3, 2]))
+        self.assertEqual(b.next_valid_board(),
+                         board.Board(config, [0, 3, 3]))
+        self.assertEqual(list(board.Board.from_id(config, 0xED).spot_counts),
+                         [1, 2, 3])
+        self.assertEqual(len(list(b.generate_successors(board.ROLLS[0]))), 3)
+
+    def test_invalid_id(self):
+        config = board.GameConfiguration(6, 2)
+        cache = config.enable_board_cache()
+        with self.assertRaises(ValueError):
+            board.Board.from_id(config, 0xEC)
+        self.assertEqual(len(cache), 0)
+
+
+class BoardBatchTestCase(unittest.TestCase):
+
+    @parameterized.expand([
+        (5, 3),
+        (10, 5),
+        (15, 6),
+    ])
+    def test_matches_board(self, num_markers, num_spots):
+        config = board.GameConfiguration(num_markers, num_spots)
+        ids = config.valid_ids()[::7]
+        batch = board.BoardBatch.from_ids(config, ids)
+        self.assertEqual(len(batch), len(ids))
+        np.testing.assert_array_equal(batch.get_ids(), ids)
+        boards = [board.Board.from_id(config, i) for i in ids.tolist()]
+        np.testing.assert_array_equal(
+            batch.spot_counts, [list(b.spot_counts) for b in boards])
+        np.testing.assert_array_equal(
+            batch.total_pips(), [b.total_pips() for b in boards])
+        np.testing.assert_array_equal(
+            batch.is_finished(), [b.is_finished() for b in boards])
+        self.assertEqual(batch[3], boards[3])
+
+    def test_from_boards(self):
+        config = board.GameConfiguration(6, 2)
+        batch = board.BoardBatch.from_boards(
+            config, [board.Board(config, [1, 2, 3]),
+                     board.Board(config, [6, 0, 0])])
+        np.testing.assert_array_equal(batch.spot_counts,
+                                      [[1, 2, 3], [6, 0, 0]])
+        np.testing.assert_array_equal(batch.get_ids(), [0xED, 0x3F])
+        np.testing.assert_array_equal(batch.total_pips(), [8, 0])
+        np.testing.assert_array_equal(batch.is_finished(), [False, True])
+
+    def test_errors(self):
+        config = board.GameConfiguration(6, 2)
+        with self.assertRaises(ValueError):
+            board.BoardBatch.from_ids(config, [0xED, 0xEC])
+        with self.assertRaises(ValueError):
+            board.BoardBatch(config, [[1, 2, 3, 0]])
+        with self.assertRaises(ValueError):
+            board.BoardBatch(config, [[1, 2, 3], [1, 1, 1]])
+        np.testing.assert_array_equal(
+            board.BoardBatch(config, [[1, 2, 3], [1, 1, 1]],
+                             sanity_check=False).is_valid(),
+            [True, False])
+
+    def test_is_valid_id_array(self):
+        config = board.GameConfiguration(5, 3)
+        ids = np.arange(config.max_board_id + 5)
+        np.testing.assert_array_equal(
+            config.is_valid_id_array(ids),
+            [config.is_valid_id(i) for i in ids.tolist()])
 
 
 class EncodedMovesTestCase(unittest.TestCase):
@@ -0,0 +1,73 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import tempfile
+import unittest
+
+import board
+import features
+import strategy
+
+
+class FeatureTableTestCase(unittest.TestCase):
+
+    def test_matches_boards(self):
+        config = board.GameConfiguration(5, 3)
+        table = features.FeatureTable.build(config)
+        for rank, board_id in enumerate(config.generate_valid_ids()):
+            b = board.Board.from_id(config, board_id)
+            self.assertEqual(table.total_pips[rank], b.total_pips())
+            self.assertEqual(table.checkers_off[rank], b.spot_counts[0])
+            self.assertEqual(table.is_finished[rank], b.is_finished())
+            occupied = [spot for spot in range(1, 4) if b.spot_counts[spot]]
+            self.assertEqual(table.highest_spot[rank], max(occupied, default=0))
+        self.assertTrue(np.all(np.isnan(table.expected_value)))
+
+    def test_with_store(self):
+        config = board.GameConfiguration(6, 3)
+        store = strategy.DistributionStore(config)
+        store.compute(progress_interval=0)
+        table = store.compute_features()
+        b = board.Board(config, [4, 0, 2, 0])
+        rank = config.rank(b.get_id())
+        np.testing.assert_allclose(table.expected_value[rank], 1 + 10/36)
+        np.testing.assert_allclose(table.wastage[rank],
+                                   (1 + 10/36) * 49 / 6 - 4)
+        np.testing.assert_array_equal(
+            table.board_ids(table.total_pips == 1),
+            [board.Board(config, [5, 1, 0, 0]).get_id()])
+
+    def test_save_load_with_store(self):
+        config = board.GameConfiguration(3, 2)
+        store = strategy.DistributionStore(config)
+        store.compute(progress_interval=0)
+        store.compute_features()
+        with tempfile.TemporaryFile() as tmp:
+            store.save_hdf5(tmp)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp)
+        for name in features.FeatureTable.COLUMNS:
+            np.testing.assert_array_equal(getattr(loaded.features, name),
+                                          getattr(store.features, name))
+
+    def test_bad_shape(self):
+        config = board.GameConfiguration(3, 2)
+        columns = {name: np.zeros(3) for name in features.FeatureTable.COLUMNS}
+        with self.assertRaises(ValueError):
+            features.FeatureTable(config, **columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -45,6 +45,16 @@ class PositionIDTest(unittest.TestCase):
                          gnubg_interface.gnubg_id_str_to_board_id(
                              config, 'uX8HAAAAAAAAAA'))
 
+    def test_many_from_string(self):
+        config = board.GameConfiguration(15, 6)
+        board_ids = gnubg_interface.gnubg_id_strs_to_board_ids(
+            config, ['AQAAAAAAAAAAAA', 'uX8HAAAAAAAAAA'])
+        self.assertEqual(board_ids.dtype, np.int64)
+        self.assertEqual(
+            board_ids.tolist(),
+            [board.Board(config, [14, 1, 0, 0, 0, 0, 0]).get_id(),
+             board.Board(config, [0, 1, 0, 3, 8, 3, 0]).get_id()])
+
     def test_to_string(self):
         config = board.GameConfiguration(15, 6)
         self.assertEqual(
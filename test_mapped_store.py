@@ -0,0 +1,127 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import os
+import pickle
+import tempfile
+import unittest
+from parameterized import parameterized
+
+import board
+import mapped_store
+import strategy
+
+
+class MappedDistributionStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = board.GameConfiguration(6, 3)
+        self.store = strategy.DistributionStore(self.config)
+        self.store.compute(progress_interval=0)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmpdir.name, "store.hdf5")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @parameterized.expand([
+        ("mapped", False, "float64"),
+        ("compressed", True, "float64"),
+        ("fixed16", False, "fixed16"),
+    ])
+    def test_matches_store(self, _, compress, encoding):
+        self.store.save_hdf5(self.fn, encoding=encoding, compress=compress)
+        loaded = strategy.DistributionStore.load_hdf5(self.fn)
+        with mapped_store.MappedDistributionStore(self.fn) as mapped:
+            self.assertEqual(isinstance(mapped._values, np.memmap),
+                             not compress)
+            for board_id in self.config.valid_ids().tolist():
+                self.assertIn(board_id, mapped)
+                np.testing.assert_array_equal(
+                    mapped[board_id].dist,
+                    loaded.distribution_map[board_id].dist)
+                self.assertEqual(mapped.expected_value(board_id),
+                                 loaded.expected_value(board_id))
+
+    def test_best_moves(self):
+        self.store.save_hdf5(self.fn, compress=False)
+        with mapped_store.MappedDistributionStore(self.fn) as mapped:
+            for board_id in self.config.valid_ids().tolist():
+                this_board = board.Board.from_id(self.config, board_id)
+                for roll in board.ROLLS:
+                    next_ids = [next_id for _, next_id in
+                                self.config.generate_successor_ids(board_id,
+                                                                   roll)]
+                    self.assertEqual(
+                        mapped.compute_best_next_id(next_ids),
+                        self.store.compute_best_next_id(next_ids))
+                    moves = mapped.compute_best_moves_for_roll(this_board,
+                                                               roll)
+                    self.assertEqual(
+                        this_board.apply_moves(moves).get_id(),
+                        mapped.compute_best_next_id(next_ids))
+
+    def test_cache(self):
+        self.store.save_hdf5(self.fn, compress=False)
+        with mapped_store.MappedDistributionStore(
+                self.fn, cache_size=2) as mapped:
+            ids = self.config.valid_ids().tolist()[:3]
+            first = mapped[ids[0]]
+            self.assertIs(mapped[ids[0]], first)
+            mapped[ids[1]]
+            mapped[ids[2]]
+            self.assertEqual(list(mapped._cache), ids[1:])
+            mapped.clear_cache()
+            self.assertEqual(len(mapped._cache), 0)
+
+    def test_missing_boards(self):
+        missing_id = board.Board(self.config, [0, 0, 0, 6]).get_id()
+        del self.store.distribution_map[missing_id]
+        self.store.save_hdf5(self.fn, compress=False)
+        with mapped_store.MappedDistributionStore(self.fn) as mapped:
+            self.assertNotIn(missing_id, mapped)
+            self.assertNotIn(0xEC, mapped)
+            with self.assertRaises(KeyError):
+                mapped[missing_id]
+            with self.assertRaises(KeyError):
+                mapped[0xEC]
+
+    def test_ev_only(self):
+        store = strategy.DistributionStore(self.config)
+        store.compute(progress_interval=0, mode="ev")
+        store.save_hdf5(self.fn, compress=False)
+        with mapped_store.MappedDistributionStore(self.fn) as mapped:
+            for board_id in self.config.valid_ids().tolist():
+                self.assertEqual(mapped.expected_value(board_id),
+                                 store.expected_value(board_id))
+
+    def test_pickle(self):
+        self.store.save_hdf5(self.fn, compress=False)
+        with mapped_store.MappedDistributionStore(self.fn) as mapped:
+            unpickled = pickle.loads(pickle.dumps(mapped))
+        board_id = int(self.config.valid_ids()[-1])
+        np.testing.assert_array_equal(
+            unpickled[board_id].dist,
+            self.store.distribution_map[board_id].dist)
+        unpickled.close()
+
+    def test_version_1(self):
+        self.store.save_hdf5(self.fn, format_version=1)
+        with self.assertRaises(ValueError):
+            mapped_store.MappedDistributionStore(self.fn)
+
+
+if __name__ == '__main__':
+    unittest.main()
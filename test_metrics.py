@@ -0,0 +1,121 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from parameterized import parameterized
+
+import board
+import metrics
+import strategy
+
+
+class ProgressMetricsTestCase(unittest.TestCase):
+
+    def test_reports_every_interval(self):
+        records = []
+        progress = metrics.ProgressMetrics(
+            10, 4, [metrics.CallbackSink(records.append)])
+        progress.start("test")
+        progress.complete_one()
+        progress.complete_many(3)
+        progress.complete_many(5)
+        progress.complete_one()
+        self.assertEqual([r["event"] for r in records],
+                         ["start", "progress", "progress", "progress"])
+        self.assertEqual([r.get("completed") for r in records],
+                         [None, 4, 9, 10])
+        last = records[-1]
+        self.assertEqual(last["total"], 10)
+        self.assertEqual(last["fraction"], 1)
+        self.assertEqual(last["eta_seconds"], 0)
+        self.assertGreaterEqual(last["objects_per_second"], 0)
+        if metrics.resource is not None:
+            self.assertGreater(last["peak_rss_bytes"], 0)
+
+    def test_quiet(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            progress = metrics.ProgressMetrics(10, 0)
+            progress.start("test")
+            progress.complete_many(10)
+            progress = metrics.ProgressMetrics(10, 1, sinks=[])
+            progress.start("test")
+            progress.complete_many(10)
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_print_sink(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            progress = metrics.ProgressMetrics(2, 1)
+            progress.start("test")
+            progress.complete_many(2)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], "Starting test on 2 boards")
+        self.assertTrue(lines[1].startswith("2/2 100.0%"))
+
+    def test_json_lines_sink(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "metrics.jsonl")
+            progress = metrics.ProgressMetrics(
+                4, 2, [metrics.JsonLinesSink(path)])
+            with progress.phase("work"):
+                progress.complete_many(4)
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["completed"], 4)
+
+    def test_phases(self):
+        progress = metrics.ProgressMetrics(1, 0)
+        with progress.phase("a"):
+            pass
+        with progress.phase("a"):
+            pass
+        progress.add_phase_time("b", 2.5)
+        self.assertEqual(list(progress.phase_seconds), ["a", "b"])
+        self.assertEqual(progress.snapshot()["phase_seconds"]["b"], 2.5)
+        with self.assertRaises(RuntimeError):
+            with progress.phase("c"):
+                raise RuntimeError()
+        self.assertIn("c", progress.phase_seconds)
+
+    @parameterized.expand([
+        ("serial", {}, [metrics.PHASE_MOVE_GENERATION,
+                        metrics.PHASE_DISTRIBUTION_ARITHMETIC]),
+        ("batched", {"batched": True},
+         [metrics.PHASE_MOVE_GENERATION, metrics.PHASE_SUCCESSOR_LOOKUP,
+          metrics.PHASE_DISTRIBUTION_ARITHMETIC]),
+        ("ev", {"mode": "ev"}, [metrics.PHASE_MOVE_GENERATION,
+                                metrics.PHASE_DISTRIBUTION_ARITHMETIC]),
+    ])
+    def test_compute_phases(self, _, kwargs, phases):
+        config = board.GameConfiguration(4, 3)
+        store = strategy.DistributionStore(config)
+        records = []
+        store.compute(progress_interval=5,
+                      progress_sinks=[metrics.CallbackSink(records.append)],
+                      **kwargs)
+        self.assertEqual(records[0]["event"], "start")
+        self.assertEqual(records[-1]["completed"], config.num_valid_boards)
+        self.assertEqual(sorted(store.compute_metrics.phase_seconds),
+                         sorted(phases))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import os
+import tempfile
+import unittest
+
+import board
+import policy_table
+import strategy
+
+
+class PolicyTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = board.GameConfiguration(6, 4)
+        self.store = strategy.DistributionStore(self.config)
+        self.store.compute(progress_interval=0)
+
+    def test_encode_moves(self):
+        moves = [board.Move(spot=4, count=6), board.Move(spot=31, count=1)]
+        encoded = policy_table.encode_moves(moves)
+        self.assertEqual(len(encoded), 4)
+        self.assertEqual(policy_table.decode_moves(encoded), moves)
+        self.assertEqual(
+            policy_table.decode_moves(policy_table.encode_moves([])), [])
+
+    def test_matches_store(self):
+        table = policy_table.PolicyTable.build(self.config, self.store)
+        for board_id in self.config.valid_ids().tolist():
+            this_board = board.Board.from_id(self.config, board_id)
+            for roll_idx, roll in enumerate(board.ROLLS):
+                next_ids = [next_id for _, next_id in
+                            self.config.generate_successor_ids(board_id, roll)]
+                best_id = table.best_next_id(board_id, roll_idx)
+                self.assertEqual(best_id,
+                                 self.store.compute_best_next_id(next_ids))
+                moves = table.best_moves(board_id, roll_idx)
+                self.assertEqual(this_board.apply_moves(moves).get_id(),
+                                 best_id)
+
+    def test_best_next_ranks(self):
+        table = policy_table.PolicyTable.build(self.config, self.store)
+        ranks = np.array([3, 0, 7])
+        roll_idxs = np.array([20, 1, 5])
+        np.testing.assert_array_equal(
+            table.best_next_ranks(ranks, roll_idxs),
+            [self.config.rank(table.best_next_id(self.config.unrank(r), i))
+             for r, i in zip(ranks, roll_idxs)])
+
+    def test_save_load(self):
+        table = policy_table.PolicyTable.build(self.config, self.store)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "policy.bin")
+            table.save(fn)
+            self.assertEqual(
+                os.path.getsize(fn),
+                24 + 8 * self.config.num_valid_boards * len(board.ROLLS))
+            loaded = policy_table.PolicyTable.load(fn)
+            self.assertEqual(loaded.config.num_markers, 6)
+            self.assertEqual(loaded.config.num_spots, 4)
+            np.testing.assert_array_equal(loaded.entries, table.entries)
+            del loaded
+
+            with open(fn, "wb") as f:
+                f.write(b"not a policy table at all")
+            with self.assertRaises(ValueError):
+                policy_table.PolicyTable.load(fn)
+
+    def test_errors(self):
+        del self.store.distribution_map[self.config.min_board_id]
+        with self.assertRaises(ValueError):
+            policy_table.PolicyTable.build(self.config, self.store)
+        with self.assertRaises(ValueError):
+            policy_table.PolicyTable(
+                self.config,
+                np.zeros([3, len(board.ROLLS)], dtype=policy_table.ENTRY_DTYPE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import unittest.mock
+
+import board
+import profiling
+import strategy
+
+
+class ProfilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = board.GameConfiguration(4, 3)
+
+    def test_compute(self):
+        profiler = profiling.Profiler()
+        store = strategy.DistributionStore(self.config)
+        store.compute(progress_interval=0, profiler=profiler)
+        num_computed = self.config.num_valid_boards - 1
+        self.assertEqual(
+            profiler.calls["GameConfiguration.generate_successor_ids"],
+            num_computed * len(board.ROLLS))
+        self.assertEqual(
+            profiler.calls["MoveCountDistribution.increase_counts"],
+            num_computed * len(board.ROLLS))
+        self.assertGreater(
+            profiler.seconds["GameConfiguration.generate_successor_ids"], 0)
+        self.assertNotIn("Board.from_id", profiler.calls)
+
+        num_successors = 0
+        for board_id in self.config.valid_ids()[1:].tolist():
+            for roll in board.ROLLS:
+                num_successors += len(list(
+                    self.config.generate_successor_ids(board_id, roll)))
+        self.assertEqual(sum(profiler.distinct_successors), num_successors)
+        self.assertGreater(sum(profiler.move_lists), num_successors)
+        for move_lists, distinct in zip(profiler.move_lists,
+                                        profiler.distinct_successors):
+            self.assertGreaterEqual(move_lists, distinct)
+
+        report = profiler.report()
+        self.assertIn("GameConfiguration.generate_successor_ids", report)
+        self.assertIn("total", report)
+
+    def test_restores_functions(self):
+        original = board.Board.from_id
+        profiler = profiling.Profiler()
+        with profiler.instrument():
+            self.assertIsNot(board.Board.from_id, original)
+            with profiler.instrument():
+                board.Board.from_id(self.config, self.config.min_board_id)
+            self.assertIsNot(board.Board.from_id, original)
+        self.assertIs(board.Board.from_id, original)
+        self.assertEqual(profiler.calls["Board.from_id"], 1)
+
+        with self.assertRaises(ValueError):
+            with profiler.instrument():
+                raise ValueError()
+        self.assertIs(board.Board.from_id, original)
+
+    def test_times_generator_iteration(self):
+        # A fake clock that only advances while the moves are generated
+        clock = [0.0]
+
+        def generate_moves(this_board, roll):
+            for _ in range(3):
+                clock[0] += 1
+                yield []
+
+        this_board = board.Board(self.config, [0, 1, 1, 2])
+        profiler = profiling.Profiler()
+        with unittest.mock.patch.object(board.Board, "generate_moves",
+                                        generate_moves):
+            with unittest.mock.patch.object(profiling.time, "perf_counter",
+                                            lambda: clock[0]):
+                with profiler.instrument():
+                    moves = this_board.generate_moves(board.ROLLS[0])
+                    self.assertEqual(
+                        profiler.seconds["Board.generate_moves"], 0)
+                    self.assertEqual(len(list(moves)), 3)
+        self.assertEqual(profiler.calls["Board.generate_moves"], 1)
+        self.assertEqual(profiler.seconds["Board.generate_moves"], 3)
+
+    def test_queries(self):
+        store = strategy.DistributionStore(self.config)
+        store.compute(progress_interval=0)
+        profiler = profiling.Profiler()
+        this_board = board.Board(self.config, [0, 1, 1, 2])
+        store.compute_best_moves_for_roll(this_board, board.ROLLS[3],
+                                          profiler=profiler)
+        self.assertEqual(profiler.calls["Board.get_id"], 1)
+        self.assertEqual(
+            profiler.calls["GameConfiguration.generate_successor_ids"], 1)
+
+        store.get_or_compute(this_board.get_id(), profiler=profiler)
+        self.assertEqual(
+            profiler.calls["GameConfiguration.generate_successor_ids"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
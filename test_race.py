@@ -0,0 +1,95 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import unittest
+from parameterized import parameterized
+
+import board
+import race
+import strategy
+
+
+def _win_probability_loop(our_mcd, their_mcd):
+    total = 0
+    for our_rolls, our_prob in enumerate(our_mcd.dist):
+        for their_rolls, their_prob in enumerate(their_mcd.dist):
+            if our_rolls <= their_rolls:
+                total += our_prob * their_prob
+    return total
+
+
+class RaceEvaluatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = board.GameConfiguration(4, 4)
+        self.store = strategy.DistributionStore(self.config)
+        self.store.compute(progress_interval=0)
+
+    @parameterized.expand([(False,), (True,)])
+    def test_matches_loop(self, dense):
+        if dense:
+            store = strategy.DistributionStore(self.config, dense=True)
+            store.compute(progress_interval=0)
+        else:
+            store = self.store
+        evaluator = race.RaceEvaluator(store)
+        valid_ids = self.config.valid_ids()
+        matrix = evaluator.win_probability_matrix(valid_ids, valid_ids)
+        self.assertEqual(matrix.shape, (len(valid_ids), len(valid_ids)))
+        for i, our_id in enumerate(valid_ids.tolist()):
+            for j, their_id in enumerate(valid_ids.tolist()):
+                self.assertAlmostEqual(
+                    matrix[i, j],
+                    _win_probability_loop(store.distribution_map[our_id],
+                                          store.distribution_map[their_id]))
+        np.testing.assert_allclose(
+            evaluator.win_probabilities(valid_ids, valid_ids[::-1]),
+            [matrix[i, len(valid_ids) - 1 - i]
+             for i in range(len(valid_ids))])
+
+    def test_simple_races(self):
+        evaluator = race.RaceEvaluator(self.store)
+        finished_id = self.config.min_board_id
+        last_id = board.Board(self.config, [3, 1, 0, 0, 0]).get_id()
+        far_id = board.Board(self.config, [0, 0, 0, 0, 4]).get_id()
+        self.assertAlmostEqual(
+            evaluator.win_probabilities(finished_id, far_id), 1)
+        self.assertAlmostEqual(
+            evaluator.win_probabilities(far_id, finished_id), 0)
+        self.assertAlmostEqual(
+            evaluator.win_probabilities(last_id, far_id), 1)
+        # Being on roll is worth something when the boards are the same.
+        self.assertGreater(evaluator.win_probabilities(far_id, far_id), 0.5)
+
+    def test_broadcast(self):
+        evaluator = race.RaceEvaluator(self.store)
+        valid_ids = self.config.valid_ids()
+        out = evaluator.win_probabilities(valid_ids[-1], valid_ids[:5])
+        self.assertEqual(out.shape, (5,))
+        np.testing.assert_allclose(
+            out,
+            evaluator.win_probability_matrix([valid_ids[-1]],
+                                             valid_ids[:5])[0])
+
+    def test_missing_board(self):
+        del self.store.distribution_map[self.config.min_board_id]
+        evaluator = race.RaceEvaluator(self.store)
+        with self.assertRaises(ValueError):
+            evaluator.win_probabilities(self.config.min_board_id,
+                                        self.config.valid_ids()[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
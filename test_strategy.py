@@ -13,8 +13,11 @@
 # limitations under the License.
 
 import numpy as np
+import os
 import tempfile
 import unittest
+import unittest.mock
+from parameterized import parameterized
 
 import board
 import strategy
@@ -69,6 +72,11 @@ class MoveCountDistributionTestCase(unittest.TestCase):
                                    [0.1, 0.2, 0.3, 0.4])
         
 
+    def test_trim_low_prob_does_not_modify(self):
+        d = strategy.MoveCountDistribution([0.1, 0.2, 0.3])
+        d.trim_low_prob(0.15)
+        np.testing.assert_allclose(d.dist, [0.1, 0.2, 0.3])
+
     def test_trim_low_prob(self):
         np.testing.assert_allclose(
             strategy.MoveCountDistribution([0.1, 0.2, 0.3])
@@ -83,8 +91,90 @@ class MoveCountDistributionTestCase(unittest.TestCase):
             .trim_low_prob(0.15).dist,
             [0.3, 0.2])
             
-        
-class DistributionStoreTestCase(unittest.TestCase):
+
+
+class DenseDistributionMapTestCase(unittest.TestCase):
+
+    def test_dict_like(self):
+        config = board.GameConfiguration(3, 2)
+        dist_map = strategy.DenseDistributionMap(config, initial_width=2)
+        self.assertEqual(len(dist_map), 0)
+        dist_map[config.min_board_id] = strategy.MoveCountDistribution([1])
+        dist_map[0b11001] = strategy.MoveCountDistribution([0, 0.5, 0.5])
+        self.assertEqual(len(dist_map), 2)
+        self.assertEqual(list(dist_map), [config.min_board_id, 0b11001])
+        self.assertIn(0b11001, dist_map)
+        self.assertNotIn(0b10011, dist_map)
+        self.assertNotIn(0b11111, dist_map)
+        np.testing.assert_array_equal(dist_map[0b11001].dist, [0, 0.5, 0.5])
+        np.testing.assert_array_equal(dist_map[config.min_board_id].dist, [1])
+        self.assertEqual(dist_map.expected_value(0b11001), 1.5)
+        self.assertEqual(dist_map.dists.shape[1], 4)
+        with self.assertRaises(KeyError):
+            dist_map[0b10011]
+        with self.assertRaises(KeyError):
+            dist_map[0b11111]
+        self.assertIsNone(dist_map.get(0b10011))
+
+        dist_map[0b11001] = strategy.MoveCountDistribution([0, 1])
+        np.testing.assert_array_equal(dist_map[0b11001].dist, [0, 1])
+        del dist_map[0b11001]
+        self.assertEqual(len(dist_map), 1)
+        self.assertTrue(np.isnan(dist_map.expected_values[
+            config.rank(0b11001)]))
+        dist_map.clear()
+        self.assertEqual(len(dist_map), 0)
+        self.assertEqual(list(dist_map.items()), [])
+
+
+class EncodingTestCase(unittest.TestCase):
+
+    @parameterized.expand([
+        ("float64", 0),
+        ("float32", 1e-7),
+        ("float16", 1e-3),
+        ("fixed16", 1e-5),
+        ("fixed32", 1e-9),
+    ])
+    def test_round_trip(self, encoding, tolerance):
+        dist = np.array([0, 0.123456789, 0.5, 0.376543211])
+        encoded = strategy.encode_distribution(dist, encoding)
+        self.assertEqual(encoded.dtype, strategy.ENCODINGS[encoding][0])
+        np.testing.assert_allclose(
+            strategy.decode_distribution(encoded, encoding), dist,
+            atol=tolerance, rtol=0)
+
+
+# map from (num_markers, num_spots) to a serially computed
+# DistributionStore, shared by the tests so each is computed once. Tests
+# must not modify them.
+_reference_stores = {}
+
+
+def _reference_store(num_markers, num_spots):
+    key = (num_markers, num_spots)
+    if key not in _reference_stores:
+        store = strategy.DistributionStore(
+            board.GameConfiguration(num_markers, num_spots))
+        store.compute(progress_interval=0)
+        _reference_stores[key] = store
+    return _reference_stores[key]
+
+
+class StoreTestCase(unittest.TestCase):
+
+    def assertStoresEqual(self, expected, actual):
+        """Asserts the stores have exactly the same boards and values."""
+        self.assertEqual(list(expected.distribution_map),
+                         list(actual.distribution_map))
+        for board_id, mcd in expected.distribution_map.items():
+            np.testing.assert_array_equal(
+                mcd.dist, actual.distribution_map[board_id].dist)
+        np.testing.assert_array_equal(expected.expected_values(),
+                                      actual.expected_values())
+
+
+class DistributionStoreTestCase(StoreTestCase):
 
     def test_e2e_6_3(self):
         config = board.GameConfiguration(6, 3)
@@ -114,6 +204,391 @@ class DistributionStoreTestCase(unittest.TestCase):
         # except 1-2 and you go out in 1 roll
         test_move_count_distribution([4, 1, 0, 1], [0, 34/36, 2/36])
 
+    def test_dense_matches_dict(self):
+        expected = _reference_store(6, 3)
+        config = expected.config
+        dense = strategy.DistributionStore(config, dense=True)
+        dense.compute(progress_interval=0)
+        self.assertStoresEqual(expected, dense)
+
+        with tempfile.TemporaryFile() as tmp:
+            dense.save_hdf5(tmp)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp, dense=True)
+        self.assertTrue(loaded.is_dense())
+        np.testing.assert_array_equal(loaded.distribution_map.dists,
+                                      dense.distribution_map.dists)
+
+    def test_parallel_matches_serial(self):
+        expected = _reference_store(6, 4)
+        config = expected.config
+        for dense in [False, True]:
+            parallel = strategy.DistributionStore(config, dense=dense)
+            parallel.compute(progress_interval=0, jobs=3)
+            self.assertStoresEqual(expected, parallel)
+        with self.assertRaises(ValueError):
+            parallel.compute(progress_interval=0, limit=5, jobs=2)
+
+    @parameterized.expand([
+        (6, 4, False),
+        (8, 5, True),
+    ])
+    def test_batched_matches_serial(self, num_markers, num_spots, dense):
+        expected = _reference_store(num_markers, num_spots)
+        config = expected.config
+        batched = strategy.DistributionStore(config, dense=dense)
+        batched.compute(progress_interval=0, batched=True)
+        self.assertStoresEqual(expected, batched)
+
+    def test_checkpoint_resume(self):
+        expected = _reference_store(6, 3)
+        config = expected.config
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "checkpoint.hdf5")
+            # Stop part way like a crash would.
+            partial = strategy.DistributionStore(config)
+            checkpointer = strategy.Checkpointer(path, interval_boards=10)
+            partial.compute(progress_interval=0, limit=35,
+                            checkpointer=checkpointer)
+            self.assertEqual(checkpointer.num_saves, 3)
+
+            resumed = strategy.DistributionStore(config)
+            with unittest.mock.patch.object(
+                    resumed, "_compute_move_distribution",
+                    wraps=resumed._compute_move_distribution) as mock:
+                resumed.compute(progress_interval=0,
+                                checkpointer=strategy.Checkpointer(path))
+            self.assertEqual(mock.call_count, config.num_valid_boards - 30)
+            self.assertStoresEqual(expected, resumed)
+
+            parallel = strategy.DistributionStore(config)
+            parallel.compute(progress_interval=0, jobs=2,
+                             checkpointer=strategy.Checkpointer(path))
+            self.assertStoresEqual(expected, parallel)
+
+            batched = strategy.DistributionStore(config)
+            batched.compute(progress_interval=0, batched=True,
+                            checkpointer=strategy.Checkpointer(path))
+            self.assertStoresEqual(expected, batched)
+
+            with self.assertRaises(ValueError):
+                strategy.DistributionStore(board.GameConfiguration(5, 3)).compute(
+                    progress_interval=0,
+                    checkpointer=strategy.Checkpointer(path))
+
+    def test_checkpoint_parallel(self):
+        config = board.GameConfiguration(5, 3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "checkpoint.hdf5")
+            checkpointer = strategy.Checkpointer(path, interval_boards=1)
+            store = strategy.DistributionStore(config)
+            store.compute(progress_interval=0, jobs=2,
+                          checkpointer=checkpointer)
+            self.assertGreater(checkpointer.num_saves, 1)
+            loaded = strategy.DistributionStore.load_hdf5(path)
+            self.assertEqual(len(loaded.distribution_map),
+                             config.num_valid_boards)
+
+    def test_checkpoint_batched(self):
+        config = board.GameConfiguration(5, 3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "checkpoint.hdf5")
+            checkpointer = strategy.Checkpointer(path, interval_boards=1)
+            store = strategy.DistributionStore(config)
+            store.compute(progress_interval=0, batched=True,
+                          checkpointer=checkpointer)
+            self.assertGreater(checkpointer.num_saves, 1)
+            loaded = strategy.DistributionStore.load_hdf5(path)
+            self.assertEqual(len(loaded.distribution_map),
+                             config.num_valid_boards)
+
+            resumed = strategy.DistributionStore(config)
+            with unittest.mock.patch.object(
+                    strategy, "_compute_block",
+                    wraps=strategy._compute_block) as mock:
+                resumed.compute(progress_interval=0, batched=True,
+                                checkpointer=strategy.Checkpointer(path))
+            self.assertEqual(
+                sum(len(call.args[0]) for call in mock.call_args_list), 0)
+            self.assertEqual(len(resumed.distribution_map),
+                             config.num_valid_boards)
+
+            with self.assertRaises(ValueError):
+                store.compute(progress_interval=0, batched=True,
+                              objectives=["first_off"],
+                              checkpointer=strategy.Checkpointer(path))
+
+    @parameterized.expand([
+        (4, 3, 6, 3, False),
+        (5, 3, 5, 4, True),
+        (4, 3, 6, 5, True),
+    ])
+    def test_restrict_to(self, small_markers, small_spots, num_markers,
+                         num_spots, dense):
+        expected = _reference_store(small_markers, small_spots)
+        small = expected.config
+        large = strategy.DistributionStore(
+            board.GameConfiguration(num_markers, num_spots), dense=dense)
+        large.compute(progress_interval=0)
+        restricted = large.restrict_to(small)
+        self.assertEqual(restricted.is_dense(), dense)
+        self.assertStoresEqual(expected, restricted)
+        with self.assertRaises(ValueError):
+            expected.restrict_to(large.config)
+
+    @parameterized.expand([
+        ("serial", {}),
+        ("batched", {"batched": True}),
+        ("parallel", {"jobs": 2}),
+    ])
+    def test_seed_store(self, _, kwargs):
+        expected = _reference_store(6, 4)
+        config = expected.config
+        for seed_store in [_reference_store(5, 4), _reference_store(6, 3)]:
+            seeded = strategy.DistributionStore(config)
+            seeded.compute(progress_interval=0, seed_store=seed_store,
+                           **kwargs)
+            self.assertStoresEqual(expected, seeded)
+
+    def test_seed_store_only_computes_new_boards(self):
+        config = board.GameConfiguration(6, 4)
+        seed_store = _reference_store(5, 4)
+        seeded = strategy.DistributionStore(config)
+        with unittest.mock.patch.object(
+                seeded, "_compute_move_distribution",
+                wraps=seeded._compute_move_distribution) as mock:
+            seeded.compute(progress_interval=0, seed_store=seed_store)
+        self.assertEqual(
+            mock.call_count,
+            config.num_valid_boards - seed_store.config.num_valid_boards)
+
+    def test_seed_store_errors(self):
+        config = board.GameConfiguration(4, 3)
+        store = strategy.DistributionStore(config)
+        larger = strategy.DistributionStore(board.GameConfiguration(5, 3))
+        larger.compute(progress_interval=0)
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, seed_store=larger)
+        smaller = strategy.DistributionStore(board.GameConfiguration(3, 3))
+        smaller.compute(progress_interval=0)
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, seed_store=smaller,
+                          mode="ev")
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, seed_store=smaller,
+                          batched=True, objectives=["first_off"])
+        smaller.compute(progress_interval=0, mode="ev")
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, seed_store=smaller)
+
+    def test_ev_mode(self):
+        expected = _reference_store(6, 4)
+        config = expected.config
+
+        store = strategy.DistributionStore(config)
+        store.compute(progress_interval=0, mode="ev")
+        self.assertEqual(len(store.distribution_map), 0)
+        np.testing.assert_allclose(store.ev_only_values,
+                                   expected.expected_values())
+        batched = strategy.DistributionStore(config)
+        batched.compute(progress_interval=0, mode="ev", batched=True)
+        np.testing.assert_array_equal(batched.ev_only_values,
+                                      store.ev_only_values)
+
+        board_id = board.Board(config, [0, 0, 2, 2, 2]).get_id()
+        store.compute_distributions_from_ev([board_id])
+        self.assertLess(len(store.distribution_map), config.num_valid_boards)
+        for filled_id, mcd in store.distribution_map.items():
+            np.testing.assert_allclose(
+                mcd.dist, expected.distribution_map[filled_id].dist)
+
+        with tempfile.TemporaryFile() as tmp:
+            store.save_hdf5(tmp)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp)
+        np.testing.assert_array_equal(loaded.ev_only_values,
+                                      store.ev_only_values)
+
+        store.compute(progress_interval=0)
+        self.assertIsNone(store.ev_only_values)
+        with self.assertRaises(ValueError):
+            store.compute_distributions_from_ev([board_id])
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, mode="bogus")
+
+    @parameterized.expand([
+        ("float32", 0, 1e-6),
+        ("float16", 0, 1e-2),
+        ("fixed32", 0, 1e-8),
+        ("fixed16", 1e-4, 1e-2),
+    ])
+    def test_save_reduced_precision(self, encoding, trim_threshold,
+                                    tolerance):
+        config = board.GameConfiguration(6, 3)
+        store = strategy.DistributionStore(config)
+        store.compute(progress_interval=0)
+        with tempfile.TemporaryFile() as tmp:
+            store.save_hdf5(tmp, encoding=encoding,
+                            trim_threshold=trim_threshold)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp)
+        report = loaded.precision_report
+        self.assertEqual(report.encoding, encoding)
+        self.assertEqual(report.trim_threshold, trim_threshold)
+        self.assertGreater(report.max_mass_error, 0)
+        self.assertLess(report.max_mass_error, tolerance)
+        self.assertLess(report.max_expected_value_error, 20 * tolerance)
+        for board_id, mcd in store.distribution_map.items():
+            loaded_dist = loaded.distribution_map[board_id].dist
+            self.assertEqual(loaded_dist.dtype, np.float64)
+            np.testing.assert_allclose(
+                loaded_dist, mcd.dist[:len(loaded_dist)], atol=tolerance)
+
+    @parameterized.expand([(1,), (2,)])
+    def test_save_trim_keeps_every_board(self, format_version):
+        store = _reference_store(4, 3)
+        with tempfile.TemporaryFile() as tmp:
+            # Removes every probability of most distributions
+            store.save_hdf5(tmp, trim_threshold=0.9,
+                            format_version=format_version)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp)
+        self.assertEqual(sorted(store.distribution_map),
+                         sorted(loaded.distribution_map))
+        for board_id, mcd in store.distribution_map.items():
+            loaded_dist = loaded.distribution_map[board_id].dist
+            self.assertEqual(np.max(loaded_dist), np.max(mcd.dist))
+        self.assertGreater(loaded.precision_report.max_mass_error, 0.5)
+
+    def test_precision_report_counts_missing_boards(self):
+        store = strategy.DistributionStore(board.GameConfiguration(4, 3))
+        store.compute(progress_interval=0)
+        exact_values = store.expected_values()
+        del store.distribution_map[store.config.max_board_id - 1]
+        report = store._precision_report("float64", 0, exact_values)
+        self.assertEqual(report.max_mass_error, 1)
+
+    @parameterized.expand([
+        (1, "float64"),
+        (2, "float64"),
+        (1, "fixed16"),
+        (2, "fixed16"),
+    ])
+    def test_round_trip_format_versions(self, format_version, encoding):
+        config = board.GameConfiguration(6, 3)
+        store = strategy.DistributionStore(config)
+        store.compute(progress_interval=0)
+        # Not every board so that missing ones are covered.
+        del store.distribution_map[board.Board(config, [0, 0, 0, 6]).get_id()]
+        with tempfile.TemporaryFile() as tmp:
+            store.save_hdf5(tmp, encoding=encoding,
+                            format_version=format_version)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp, dense=True)
+        self.assertEqual(sorted(store.distribution_map),
+                         list(loaded.distribution_map))
+        for board_id, mcd in store.distribution_map.items():
+            np.testing.assert_allclose(
+                mcd.dist, loaded.distribution_map[board_id].dist, atol=1e-4)
+
+    def test_v2_is_smaller(self):
+        config = board.GameConfiguration(6, 3)
+        store = strategy.DistributionStore(config)
+        store.compute(progress_interval=0)
+        sizes = {}
+        for format_version in [1, 2]:
+            with tempfile.TemporaryFile() as tmp:
+                store.save_hdf5(tmp, format_version=format_version)
+                sizes[format_version] = tmp.seek(0, os.SEEK_END)
+        self.assertLess(sizes[2], sizes[1])
+        with tempfile.TemporaryFile() as tmp:
+            with self.assertRaises(ValueError):
+                store.save_hdf5(tmp, format_version=3)
+
+    def test_save_full_precision_has_no_report(self):
+        config = board.GameConfiguration(3, 2)
+        store = strategy.DistributionStore(config)
+        store.compute(progress_interval=0)
+        with tempfile.TemporaryFile() as tmp:
+            store.save_hdf5(tmp)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp)
+        self.assertIsNone(loaded.precision_report)
+
+    def test_reduce_precision_in_memory(self):
+        config = board.GameConfiguration(6, 3)
+        store = strategy.DistributionStore(config, dense=True)
+        store.compute(progress_interval=0)
+        exact_values = store.expected_values()
+        report = store.reduce_precision("float32", trim_threshold=1e-9)
+        self.assertTrue(store.is_dense())
+        self.assertEqual(store.distribution_map.dists.dtype, np.float32)
+        self.assertLess(report.max_mass_error, 1e-6)
+        self.assertLess(report.max_expected_value_error, 1e-5)
+        np.testing.assert_allclose(store.expected_values(), exact_values,
+                                   atol=1e-5)
+        self.assertIs(store.precision_report, report)
+        with self.assertRaises(ValueError):
+            store.reduce_precision("fixed16")
+
+    def test_get_or_compute_matches_compute(self):
+        expected = _reference_store(6, 3)
+        config = expected.config
+        lazy = strategy.DistributionStore(config)
+        for board_id in reversed(list(config.generate_valid_ids())):
+            np.testing.assert_array_equal(
+                lazy.get_or_compute(board_id).dist,
+                expected.distribution_map[board_id].dist)
+        self.assertEqual(len(lazy.distribution_map), 0)
+
+    def test_get_or_compute_small_cache(self):
+        expected = _reference_store(4, 3)
+        config = expected.config
+        lazy = strategy.DistributionStore(config, lazy_cache_size=3)
+        board_id = config.max_board_id - 1
+        np.testing.assert_array_equal(
+            lazy.get_or_compute(board_id).dist,
+            expected.distribution_map[board_id].dist)
+        self.assertEqual(len(lazy._lazy_cache), 3)
+        lazy.clear_lazy_cache()
+        self.assertEqual(len(lazy._lazy_cache), 0)
+
+    def test_get_or_compute_cache_smaller_than_reachable(self):
+        expected = _reference_store(6, 4)
+        config = expected.config
+        board_id = int(config.valid_ids()[-1])
+        unbounded = strategy.DistributionStore(config)
+        unbounded.get_or_compute(board_id)
+        num_reachable = len(unbounded._lazy_cache)
+
+        lazy = strategy.DistributionStore(
+            config, lazy_cache_size=num_reachable // 10)
+        with unittest.mock.patch.object(
+                config, "generate_successor_ids",
+                wraps=config.generate_successor_ids) as mock:
+            mcd = lazy.get_or_compute(board_id)
+        np.testing.assert_array_equal(
+            mcd.dist, expected.distribution_map[board_id].dist)
+        self.assertEqual(len(lazy._lazy_cache), num_reachable // 10)
+        # Once to find the reachable boards and once to solve them, so
+        # no board is solved twice.
+        self.assertLessEqual(mock.call_count,
+                             2 * num_reachable * len(board.ROLLS))
+        for cached_id, (cached_mcd, _) in lazy._lazy_cache.items():
+            np.testing.assert_array_equal(
+                cached_mcd.dist, expected.distribution_map[cached_id].dist)
+
+    def test_get_or_compute_large_config(self):
+        # Far too many boards to compute all of them in a test.
+        config = board.GameConfiguration(15, 10)
+        store = strategy.DistributionStore(config)
+        b = board.Board(config, [12, 0, 0, 0, 0, 0, 0, 0, 0, 1, 2])
+        mcd = store.get_or_compute(b.get_id())
+        self.assertTrue(mcd.is_normalized())
+        self.assertLess(len(store._lazy_cache), config.num_valid_boards / 100)
+        with self.assertRaises(ValueError):
+            store.get_or_compute(b.get_id() + 1)
+
     def test_round_trip_save_load(self):
         config = board.GameConfiguration(3, 2)
         store = strategy.DistributionStore(config)
@@ -138,5 +613,166 @@ class DistributionStoreTestCase(unittest.TestCase):
                     loaded_store.distribution_map[board_id].dist)
         
 
+class ObjectivesTestCase(StoreTestCase):
+
+    def setUp(self):
+        self.config = board.GameConfiguration(4, 4)
+
+    def _successor_ids(self, board_id, roll):
+        return [next_id for _, next_id in
+                self.config.generate_successor_ids(board_id, roll)]
+
+    def test_first_off(self):
+        store = strategy.DistributionStore(self.config)
+        store.compute(progress_interval=0, batched=True,
+                      objectives=["first_off"])
+        expected = {}
+        for rank, board_id in enumerate(self.config.valid_ids().tolist()):
+            if board.Board.from_id(self.config, board_id).spot_counts[0]:
+                expected[board_id] = strategy.MoveCountDistribution([1])
+                self.assertTrue(np.all(
+                    store.objectives["first_off_policy"][rank] == -1))
+                continue
+            mcd = strategy.MoveCountDistribution()
+            for roll_idx, roll in enumerate(board.ROLLS):
+                best_id = min(self._successor_ids(board_id, roll),
+                              key=lambda i: expected[i].expected_value())
+                mcd += expected[best_id].increase_counts(1) * roll.prob
+                self.assertEqual(
+                    store.objectives["first_off_policy"][rank, roll_idx],
+                    self.config.rank(best_id))
+            expected[board_id] = mcd
+            dist = store.objectives["first_off"][rank]
+            np.testing.assert_allclose(dist[:len(mcd)], mcd.dist)
+            np.testing.assert_array_equal(dist[len(mcd):], 0)
+
+    def test_within_k(self):
+        max_rolls = 5
+        store = strategy.DistributionStore(self.config)
+        store.compute(progress_interval=0, batched=True,
+                      objectives=["within_k"], within_k_max_rolls=max_rolls)
+        within = store.objectives["within_k"]
+        policy = store.objectives["within_k_policy"]
+        self.assertEqual(within.shape,
+                         (self.config.num_valid_boards, max_rolls + 1))
+        np.testing.assert_array_equal(within[0], 1)
+        np.testing.assert_array_equal(policy[0], -1)
+        for rank, board_id in enumerate(self.config.valid_ids()[1:].tolist(),
+                                        start=1):
+            self.assertEqual(within[rank, 0], 0)
+            for k in range(1, max_rolls + 1):
+                total = 0
+                for roll_idx, roll in enumerate(board.ROLLS):
+                    next_ranks = [self.config.rank(i) for i in
+                                  self._successor_ids(board_id, roll)]
+                    best = max(next_ranks, key=lambda r: within[r, k - 1])
+                    self.assertEqual(policy[rank, roll_idx, k - 1], best)
+                    total += roll.prob * within[best, k - 1]
+                self.assertAlmostEqual(within[rank, k], total)
+        # Maximizing P(within k) does at least as well as the expected
+        # value policy.
+        for rank, board_id in enumerate(self.config.valid_ids().tolist()):
+            cdf = np.cumsum(store.distribution_map[board_id].dist)
+            for k in range(min(len(cdf), max_rolls + 1)):
+                self.assertGreaterEqual(within[rank, k], cdf[k] - 1e-12)
+            self.assertTrue(np.all(np.diff(within[rank]) >= 0))
+
+    def test_distributions_unchanged(self):
+        store = strategy.DistributionStore(self.config)
+        store.compute(progress_interval=0, batched=True)
+        with_objectives = strategy.DistributionStore(self.config)
+        with_objectives.compute(progress_interval=0, batched=True,
+                                objectives=strategy.OBJECTIVES)
+        self.assertStoresEqual(store, with_objectives)
+
+    def test_save_load(self):
+        store = strategy.DistributionStore(self.config)
+        store.compute(progress_interval=0, batched=True,
+                      objectives=strategy.OBJECTIVES)
+        with tempfile.TemporaryFile() as tmp:
+            store.save_hdf5(tmp)
+            tmp.seek(0)
+            loaded = strategy.DistributionStore.load_hdf5(tmp)
+        self.assertEqual(sorted(loaded.objectives),
+                         ["first_off", "first_off_policy", "within_k",
+                          "within_k_policy"])
+        for name, arr in store.objectives.items():
+            np.testing.assert_array_equal(loaded.objectives[name], arr)
+        store.compute(progress_interval=0)
+        self.assertEqual(store.objectives, {})
+
+    def test_errors(self):
+        store = strategy.DistributionStore(self.config)
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, batched=True,
+                          objectives=["gammon"])
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, objectives=["first_off"])
+        with self.assertRaises(ValueError):
+            store.compute(progress_interval=0, batched=True, mode="ev",
+                          objectives=["first_off"])
+
+
+class BatchQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = board.GameConfiguration(5, 4)
+        self.store = strategy.DistributionStore(self.config)
+        self.store.compute(progress_interval=0)
+
+    @parameterized.expand([(False,), (True,)])
+    def test_matches_store(self, dense):
+        if dense:
+            store = strategy.DistributionStore(self.config, dense=True)
+            store.compute(progress_interval=0)
+        else:
+            store = self.store
+        query = strategy.BatchQuery(store)
+        valid_ids = self.config.valid_ids()
+        board_ids = np.repeat(valid_ids, len(board.ROLLS))
+        roll_idxs = np.tile(np.arange(len(board.ROLLS)), len(valid_ids))
+        best_ids = query.best_next_ids(board_ids, roll_idxs)
+        self.assertEqual(best_ids.shape, board_ids.shape)
+        for board_id, roll_idx, best_id in zip(
+                board_ids.tolist(), roll_idxs.tolist(), best_ids.tolist()):
+            next_ids = [next_id for _, next_id in
+                        self.config.generate_successor_ids(
+                            board_id, board.ROLLS[roll_idx])]
+            self.assertEqual(best_id, store.compute_best_next_id(next_ids))
+
+        np.testing.assert_array_equal(
+            query.expected_values(valid_ids),
+            [store.expected_value(i) for i in valid_ids.tolist()])
+        dists = query.distributions(valid_ids[[0, 5, -1]])
+        for row, board_id in zip(dists, valid_ids[[0, 5, -1]].tolist()):
+            mcd = store.distribution_map[board_id]
+            np.testing.assert_array_equal(row[:len(mcd)], mcd.dist)
+            np.testing.assert_array_equal(row[len(mcd):], 0)
+
+    def test_broadcast(self):
+        query = strategy.BatchQuery(self.store)
+        board_id = int(self.config.valid_ids()[-1])
+        best_ids = query.best_next_ids(board_id, np.arange(len(board.ROLLS)))
+        self.assertEqual(best_ids.shape, (len(board.ROLLS),))
+        self.assertEqual(best_ids[3], query.best_next_ids([board_id], [3])[0])
+        self.assertEqual(query.best_next_ids([], []).shape, (0,))
+
+    def test_errors(self):
+        query = strategy.BatchQuery(self.store)
+        board_id = int(self.config.valid_ids()[-1])
+        with self.assertRaises(ValueError):
+            query.best_next_ids([board_id], [len(board.ROLLS)])
+        with self.assertRaises(ValueError):
+            query.best_next_ids([0xEE], [0])
+
+        del self.store.distribution_map[self.config.min_board_id]
+        query = strategy.BatchQuery(self.store)
+        with self.assertRaises(ValueError):
+            query.best_next_ids(
+                [board.Board(self.config, [4, 1, 0, 0, 0]).get_id()], [0])
+        with self.assertRaises(ValueError):
+            query.distributions([self.config.min_board_id])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+# Copyright 2019 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import board
+import strategy
+import successor_table
+
+
+class SuccessorTableTestCase(unittest.TestCase):
+
+    def test_matches_generate_moves(self):
+        config = board.GameConfiguration(5, 3)
+        table = successor_table.SuccessorTable.build(config)
+        for board_id in config.generate_valid_ids():
+            b = board.Board.from_id(config, board_id)
+            for roll_idx, roll in enumerate(board.ROLLS):
+                expected = {b.apply_moves(moves).get_id()
+                            for moves in b.generate_moves(roll)}
+                got = list(table.successor_ids(board_id, roll_idx))
+                self.assertEqual(len(got), len(expected))
+                self.assertEqual(set(got), expected)
+
+    def test_numpy_ids_without_rank_lookup(self):
+        config = board.GameConfiguration(4, 3)
+        table = successor_table.SuccessorTable.build(config)
+        with unittest.mock.patch.object(board, "RANK_LOOKUP_MAX_IDS", 0):
+            for rank, board_id in enumerate(config.valid_ids()):
+                np.testing.assert_array_equal(
+                    table.successor_ids(board_id, 3),
+                    config.valid_ids()[table.successor_ranks(rank, 3)])
+
+    def test_lookup_does_not_generate_or_unrank(self):
+        config = board.GameConfiguration(4, 3)
+        table = successor_table.SuccessorTable.build(config)
+        with unittest.mock.patch.object(
+                config, "generate_successor_ids",
+                side_effect=AssertionError("generated moves")):
+            with unittest.mock.patch.object(
+                    config, "unrank_array",
+                    side_effect=AssertionError("unranked")):
+                for board_id in config.valid_ids().tolist():
+                    table.successor_ids(board_id, 5)
+
+    def test_round_trip_save_load(self):
+        config = board.GameConfiguration(4, 3)
+        table = successor_table.SuccessorTable.build(config)
+        with tempfile.TemporaryFile() as tmp:
+            table.save_hdf5(tmp)
+            tmp.seek(0)
+            loaded = successor_table.SuccessorTable.load_hdf5(tmp)
+        self.assertEqual(loaded.config.num_markers, 4)
+        self.assertEqual(loaded.config.num_spots, 3)
+        np.testing.assert_array_equal(loaded.offsets, table.offsets)
+        np.testing.assert_array_equal(loaded.successors, table.successors)
+
+    def test_load_or_build(self):
+        config = board.GameConfiguration(3, 2)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "table.hdf5")
+            built = successor_table.load_or_build(config, fn)
+            self.assertTrue(os.path.exists(fn))
+            loaded = successor_table.load_or_build(config, fn)
+            self.assertIs(loaded.config, config)
+            np.testing.assert_array_equal(loaded.successors, built.successors)
+            with self.assertRaises(ValueError):
+                successor_table.load_or_build(
+                    board.GameConfiguration(2, 3), fn)
+
+    def test_compute_matches_move_generation(self):
+        config = board.GameConfiguration(6, 3)
+        expected = strategy.DistributionStore(config)
+        expected.compute(progress_interval=0)
+        got = strategy.DistributionStore(config)
+        got.compute(progress_interval=0,
+                    successor_table=successor_table.SuccessorTable.build(config))
+        self.assertEqual(expected.distribution_map.keys(),
+                         got.distribution_map.keys())
+        for board_id, mcd in expected.distribution_map.items():
+            np.testing.assert_array_equal(
+                mcd.dist, got.distribution_map[board_id].dist)
+
+
+if __name__ == '__main__':
+    unittest.main()